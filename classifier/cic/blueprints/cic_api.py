@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify, send_file, current_app, make_response
-from ..predictor_manager import PredictorManager
-from ..utils.file_processing import allowed_file, read_json, process_compressed_file
-from ..utils.response_helpers import create_error_response, create_success_response, create_zip_response
+from flask import Blueprint, Response, request, jsonify, send_file, current_app, make_response, stream_with_context
+from ..predictor_manager import PredictorManager, model_registry, get_result_cache, get_ensemble_pool, get_job_manager
+from ..utils.file_processing import allowed_file, read_json, iter_compressed_file
+from ..utils.response_helpers import create_error_response, create_success_response, create_zip_response, stream_zip, SERIALIZATION_SECONDS
+from ..utils import columnar
+from ..jobs import JobQueueFull
+from .. import metrics
 import tempfile
+import shutil
+import json
+import time
 import os
 
 api_bp = Blueprint('api', __name__)
@@ -78,53 +84,48 @@ def classify():
             }
             return create_error_response(manifest_dict, 400)
 
+        if not filename.endswith('.json'):
+            # Handle compressed files, read in memory from the upload without extracting them
+            data_list = iter_compressed_file(file.stream, filename, predictor_manager)
+            # The files are validated as they are read and their citations are batched together by chunks,
+            # results are split back per file and streamed in the ZIP file as soon as their chunk is classified
+            all_results = predictor_manager.iter_archive(data_list, request_source, chunk_size=current_app.config.get('ARCHIVE_CHUNK_FILES'))
+            compact = current_app.config.get('ZIP_COMPACT_JSON', False)
+            # Prepare response. 2 scenarios: web or terminal
+            if request_source == 'web-interface':
+                return create_zip_response(all_results, None, compact)
+            else:
+                # The manifest is complete once all the files are classified
+                return create_zip_response(all_results, lambda: predictor_manager.manifest_dict, compact)
+
         # Save file to a temporary dir
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_file_path = os.path.join(temp_dir, filename)
             file.save(temp_file_path)
 
-            # Process the file accordin to its type
-            if filename.endswith('.json'):
-                try:
-                    read_data = read_json(temp_file_path, request_source)
-                    # Process data
-                    result = predictor_manager.process_data(read_data, filename, from_json=True, request_source=request_source)
-                    if result is None:
-                        manifest_dict = predictor_manager.manifest_dict
-                        return create_error_response(manifest_dict, 500)
-                    # Prepare response. 2 scenarios: web or terminal
-                    if request_source == 'web-interface':
-                        return jsonify(result)
-                    else:
-                        manifest_dict = predictor_manager.manifest_dict
-                        return create_success_response(result, manifest_dict, filename)
-                except ValueError as e:
-                    manifest_dict["Data Processing"] = {
-                        "Filename": filename,
-                        "Status": "Error",
-                        "Summary": {
-                            "Data format check": "Error",
-                            "Error details": str(e)
-                        }
-                    }
-                    return create_error_response(manifest_dict, 400)
-            else:
-                # Handle compressed foiles
-                data_list, _ = process_compressed_file(temp_file_path, temp_dir, predictor_manager)
-                all_results = []
-                for item in data_list:
-                    json_data = item['data']
-                    json_filename = item['filename']
-                    rel_path = item.get('rel_path', json_filename)
-                    result = predictor_manager.process_data(json_data, json_filename, from_json=True, request_source=request_source)
-                    if result is not None:
-                        all_results.append({'filename': json_filename, 'rel_path': rel_path, 'result': result})
+            try:
+                read_data = read_json(temp_file_path, request_source)
+                # Process data
+                result = predictor_manager.process_data(read_data, filename, from_json=True, request_source=request_source)
+                if result is None:
+                    manifest_dict = predictor_manager.manifest_dict
+                    return create_error_response(manifest_dict, 500)
                 # Prepare response. 2 scenarios: web or terminal
                 if request_source == 'web-interface':
-                    return create_zip_response(all_results, None)
+                    return jsonify(result)
                 else:
                     manifest_dict = predictor_manager.manifest_dict
-                    return create_zip_response(all_results, manifest_dict)
+                    return create_success_response(result, manifest_dict, filename)
+            except ValueError as e:
+                manifest_dict["Data Processing"] = {
+                    "Filename": filename,
+                    "Status": "Error",
+                    "Summary": {
+                        "Data format check": "Error",
+                        "Error details": str(e)
+                    }
+                }
+                return create_error_response(manifest_dict, 400)
     else:
         # Handle JSON data from request body
         data = request.json.get('data')
@@ -139,7 +140,8 @@ def classify():
             return create_error_response(manifest_dict, 400)
 
         # Process data
-        result = predictor_manager.process_data(data, "input_data", from_json=False, request_source=request_source)
+        # Small JSON-body requests are batched with the concurrent ones when the coalescer is enabled
+        result = predictor_manager.process_data(data, "input_data", from_json=False, request_source=request_source, coalesce=True)
         if result is None:
             manifest_dict = predictor_manager.manifest_dict
             return create_error_response(manifest_dict, 500)
@@ -150,3 +152,327 @@ def classify():
         else:
             manifest_dict = predictor_manager.manifest_dict
             return create_success_response(result, manifest_dict, "result")
+
+
+@api_bp.route('/classify/stream', methods=['POST'])
+def classify_stream():
+    """
+    Classify newline-delimited JSON records ({"id", "SECTION", "CITATION", ...}) sent in the
+    request body, streaming back one NDJSON result per record as each batch is classified.
+    The mode is given in the query string (?mode=WS|WoS|M).
+    """
+    selected_mode = request.args.get('mode')
+    if not selected_mode or selected_mode not in ["WS", "WoS", "M"]:
+        manifest_dict = {
+            "Initialization": {
+                "Status": "Error",
+                "Summary": {
+                    "Classification Mode Selection": "Error",
+                    "Error details": "Mode not specified or invalid mode"
+                }
+            }
+        }
+        return create_error_response(manifest_dict, 400)
+
+    predictor_manager = PredictorManager()
+    if not predictor_manager.instantiate_predictor(selected_mode):
+        return create_error_response(predictor_manager.manifest_dict, 500)
+
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 256)
+
+    def generate():
+        serialization_time = 0.0
+        for record_result in predictor_manager.classify_stream(request.stream, batch_size):
+            start = time.perf_counter()
+            line = json.dumps(record_result, ensure_ascii=False) + "\n"
+            serialization_time += time.perf_counter() - start
+            yield line
+        SERIALIZATION_SECONDS.observe(serialization_time, format="ndjson")
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@api_bp.route('/classify/table', methods=['POST'])
+def classify_table():
+    """
+    Classify a table of citation records (id, SECTION, CITATION columns) in Arrow IPC, Parquet or MessagePack,
+    sent as the request body (format given by the Content-Type) or as an uploaded 'file' (format given by the
+    extension). The result table has one row per record, in the input order, in the format given by the
+    query string (?format=arrow|parquet|msgpack), by the Accept header or else in the input format.
+    The mode is given in the query string (?mode=WS|WoS|M).
+    """
+    selected_mode = request.args.get('mode')
+    if not selected_mode or selected_mode not in ["WS", "WoS", "M"]:
+        manifest_dict = {
+            "Initialization": {
+                "Status": "Error",
+                "Summary": {
+                    "Classification Mode Selection": "Error",
+                    "Error details": "Mode not specified or invalid mode"
+                }
+            }
+        }
+        return create_error_response(manifest_dict, 400)
+
+    if 'file' in request.files:
+        input_format = columnar.format_from_filename(request.files['file'].filename)
+    else:
+        input_format = columnar.format_from_mimetype(request.content_type)
+    output_format = request.args.get('format') or columnar.format_from_mimetype(request.headers.get('Accept')) or input_format
+
+    def data_error(details, status_code):
+        manifest_dict = {
+            "Data Processing": {
+                "Status": "Error",
+                "Summary": {
+                    "Data format check": "Error",
+                    "Error details": details
+                }
+            }
+        }
+        return create_error_response(manifest_dict, status_code)
+
+    if input_format is None:
+        mimetypes = [mimetype for spec in columnar.TABLE_FORMATS.values() for mimetype in spec["mimetypes"]]
+        extensions = [extension for spec in columnar.TABLE_FORMATS.values() for extension in spec["extensions"]]
+        return data_error(f"Unsupported table format. Send a body with a Content-Type in {mimetypes}, or a file with an extension in {extensions}", 415)
+    try:
+        columnar.check_format(input_format)
+        columnar.check_format(output_format)
+    except ValueError as e:
+        return data_error(str(e), 400)
+    except RuntimeError as e:
+        return data_error(str(e), 501)
+
+    payload = request.files['file'].read() if 'file' in request.files else request.get_data()
+    try:
+        records = columnar.read_table(payload, input_format)
+    except Exception as e:
+        return data_error(f"Error while trying to read the {input_format} table: {e}", 400)
+
+    predictor_manager = PredictorManager()
+    if not predictor_manager.instantiate_predictor(selected_mode):
+        return create_error_response(predictor_manager.manifest_dict, 500)
+
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 256)
+    results = predictor_manager.classify_record_batches(enumerate(records, start=1), batch_size)
+    columns = columnar.result_columns(records, columnar.in_input_order(results, len(records)))
+
+    start = time.perf_counter()
+    body = columnar.write_table(columns, output_format)
+    SERIALIZATION_SECONDS.observe(time.perf_counter() - start, format=output_format)
+    return Response(body, mimetype=columnar.TABLE_FORMATS[output_format]["mimetypes"][0])
+
+def run_classification_job(job, app, selected_mode, upload_path, filename, request_source):
+    """
+    Classify an uploaded file in the background (see JobManager). The per-file progress and the
+    manifest are written to the job state while the files are processed; the result is stored
+    in the job folder: a ZIP file for archives, the JSON response of /classify for JSON files.
+    """
+    with app.app_context():
+        predictor_manager = PredictorManager()
+        if not predictor_manager.instantiate_predictor(selected_mode):
+            job.update(**{"Manifest": predictor_manager.manifest_dict})
+            raise RuntimeError("Failed to instantiate the Predictor, see the manifest.")
+        predictor_manager.manifest_dict = {}
+
+        if filename.endswith('.json'):
+            read_data = read_json(upload_path, request_source)
+            job.update(**{"Files total": 1, "Files processed": 0})
+            result = predictor_manager.process_data(read_data, filename, from_json=True, request_source=request_source)
+            job.update(**{"Files processed": 1, "Manifest": predictor_manager.manifest_dict})
+            if result is None:
+                raise RuntimeError("Classification failed, see the manifest.")
+            job.save_result("result.json", json.dumps({"result": result, "manifest": predictor_manager.manifest_dict}).encode('utf-8'))
+        else:
+            # The files are classified by chunks as they are read: their total is known once the archive is read
+            data_list = iter_compressed_file(upload_path, filename, predictor_manager)
+            job.update(**{"Files total": None, "Files processed": 0, "Manifest": predictor_manager.manifest_dict})
+
+            def progress_callback(processed_files, total_files):
+                job.update(force=processed_files == total_files, **{"Files total": total_files, "Files processed": processed_files, "Manifest": predictor_manager.manifest_dict})
+
+            all_results = predictor_manager.iter_archive(data_list, request_source, chunk_size=app.config.get('JOB_CHUNK_FILES'), progress_callback=progress_callback)
+            # The results are written to the ZIP file as they are produced, not kept in memory
+            zip_parts = stream_zip(all_results, lambda: predictor_manager.manifest_dict, app.config.get('ZIP_COMPACT_JSON', False))
+            job.save_result("results.zip", zip_parts)
+        shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+
+@api_bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a file to classify in the background. Returns the job id, to poll GET /jobs/<job_id>
+    and download the result from GET /jobs/<job_id>/result.
+    """
+    request_source = request.headers.get('X-Request-Source', 'unknown')
+    manifest_dict = {}
+
+    if 'file' not in request.files:
+        manifest_dict["Initialization"] = {
+            "Status": "Error",
+            "Summary": {
+                "Data Upload": "Error",
+                "Error details": "No file uploaded"
+            }
+        }
+        return create_error_response(manifest_dict, 400)
+
+    selected_mode = request.form.get('mode')
+    if not selected_mode or selected_mode not in ["WS", "WoS", "M"]:
+        manifest_dict["Initialization"] = {
+            "Status": "Error",
+            "Summary": {
+                "Classification Mode Selection": "Error",
+                "Error details": "Mode not specified or invalid mode"
+            }
+        }
+        return create_error_response(manifest_dict, 400)
+
+    file = request.files['file']
+    filename = file.filename
+    if filename == '' or not allowed_file(filename):
+        manifest_dict["Data Processing"] = {
+            "Filename": filename or "Empty",
+            "Status": "Error",
+            "Summary": {
+                "Data format check": "Error",
+                "Error details": f"Invalid file type or empty filename. File types supported are: 'json', 'zip', 'tar', 'gz', 'bz2', 'xz', '7z'."
+            }
+        }
+        return create_error_response(manifest_dict, 400)
+
+    job_manager = get_job_manager()
+    filename = os.path.basename(filename)
+    job = job_manager.create(**{"Mode": selected_mode, "Filename": filename})
+    # The upload is kept apart from the state and result files of the job
+    os.makedirs(os.path.join(job.dir, "upload"))
+    upload_path = os.path.join(job.dir, "upload", filename)
+    file.save(upload_path)
+    try:
+        job_manager.submit(job, run_classification_job, current_app._get_current_object(), selected_mode, upload_path, filename, request_source)
+    except JobQueueFull as e:
+        shutil.rmtree(job.dir, ignore_errors=True)
+        return create_error_response({"Status": "Error", "Error details": f"The service is busy, retry later. {e}"}, 503)
+
+    response = jsonify({
+        "Job ID": job.id,
+        "Status": "queued",
+        "Status URL": f"{request.script_root}{request.path}/{job.id}",
+        "Result URL": f"{request.script_root}{request.path}/{job.id}/result"
+    })
+    response.status_code = 202
+    return response
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    state = get_job_manager().get(job_id)
+    if state is None:
+        return create_error_response({"Status": "Error", "Error details": f"Job {job_id} not found or expired."}, 404)
+    return jsonify(state)
+
+@api_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job_manager = get_job_manager()
+    state = job_manager.get(job_id)
+    if state is None:
+        return create_error_response({"Status": "Error", "Error details": f"Job {job_id} not found or expired."}, 404)
+    if state["Status"] == "failed":
+        return create_error_response(state, 500)
+    result_path = job_manager.result_path(job_id)
+    if result_path is None:
+        return create_error_response({"Status": state["Status"], "Error details": f"Job {job_id} is not completed yet."}, 409)
+    if result_path.endswith('.zip'):
+        return send_file(result_path, mimetype='application/zip', as_attachment=True, download_name='results.zip')
+    return send_file(result_path, mimetype='application/json')
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Metrics of the worker process serving the request, in the Prometheus text format.
+    """
+    response = make_response(metrics.registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@api_bp.route('/health/live', methods=['GET'])
+def liveness():
+    """
+    Liveness probe: the worker process answers requests.
+    """
+    return jsonify({"Status": "alive", "PID": os.getpid()})
+
+@api_bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: the models of the PRELOAD_MODES are loaded in the worker serving the request,
+    so its first requests are not slowed down by loading them. Answers 503 until they are.
+    """
+    loaded_modes = model_registry.status()
+    missing_modes = [mode for mode in current_app.config.get('PRELOAD_MODES', []) if mode not in loaded_modes]
+    body = {
+        "Status": "not ready" if missing_modes else "ready",
+        "PID": os.getpid(),
+        "Loaded modes": list(loaded_modes),
+        "Missing modes": missing_modes
+    }
+    return make_response(jsonify(body), 503 if missing_modes else 200)
+
+def check_admin_token():
+    """
+    Admin endpoints are enabled only when ADMIN_TOKEN is configured,
+    and must be called with the same value in the X-Admin-Token header.
+
+    Returns:
+        Flask response: An error response if the call is not authorized, None otherwise.
+    """
+    admin_token = current_app.config.get('ADMIN_TOKEN')
+    if not admin_token:
+        return create_error_response({"Status": "Error", "Error details": "Admin endpoints are disabled. Set ADMIN_TOKEN to enable them."}, 403)
+    if request.headers.get('X-Admin-Token') != admin_token:
+        return create_error_response({"Status": "Error", "Error details": "Invalid or missing X-Admin-Token header."}, 401)
+    return None
+
+@api_bp.route('/admin/models', methods=['GET'])
+def models_status():
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    return jsonify({"Loaded modes": model_registry.status(), "Ensemble pool": get_ensemble_pool().status()})
+
+@api_bp.route('/admin/models/<mode>/<action>', methods=['POST'])
+def models_admin(mode, action):
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+
+    if mode not in ["WS", "WoS", "M"] or action not in ["reload", "evict"]:
+        return create_error_response({"Status": "Error", "Error details": "Mode must be one of 'WS', 'WoS', 'M' and action one of 'reload', 'evict'."}, 400)
+
+    if action == "reload":
+        try:
+            model_registry.reload(mode, current_app.config.get('SRC_PATH'))
+        except Exception as e:
+            return create_error_response({"Status": "Error", "Error details": f"Failed to reload models for mode {mode}: {e}"}, 500)
+        return jsonify({"Status": "Success", "Mode": mode, "Action": "reload"})
+    else:
+        evicted = model_registry.evict(mode)
+        return jsonify({"Status": "Success", "Mode": mode, "Action": "evict", "Evicted": evicted})
+
+@api_bp.route('/admin/cache', methods=['GET'])
+def cache_status():
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    cache = get_result_cache(current_app.config.get('SRC_PATH'))
+    if cache is None:
+        return jsonify({"Result cache": "Disabled"})
+    return jsonify({"Result cache": cache.stats()})
+
+@api_bp.route('/admin/cache/clear', methods=['POST'])
+def cache_clear():
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    cache = get_result_cache(current_app.config.get('SRC_PATH'))
+    if cache is not None:
+        cache.clear()
+    return jsonify({"Status": "Success", "Action": "clear"})
@@ -0,0 +1,86 @@
+import threading
+import logging
+import time
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT = metrics.registry.histogram(
+    "cic_coalescer_queue_wait_seconds",
+    "Time spent by a request in the coalescer queue before its batch starts.",
+    ["mode"]
+)
+BATCH_REQUESTS = metrics.registry.histogram(
+    "cic_coalescer_batch_requests",
+    "Number of requests classified together by the coalescer.",
+    ["mode"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+class RequestCoalescer:
+    """
+    Groups the concurrent requests of the same mode served by a worker process, so that
+    their citations are classified in one batched pass instead of one small pass each.
+
+    The first request of a mode opens a batch and waits up to max_wait_ms for other
+    requests to join it (or until max_batch_size requests are queued), then classifies the
+    citations of all of them on its own Predictor and hands each Predictor the results of its
+    citations. Each request then builds its own output as usual. Only useful when a worker
+    serves several requests at the same time (threaded workers).
+    """
+
+    def __init__(self, max_wait_ms=5, max_batch_size=32):
+        """
+        Args:
+            max_wait_ms (float): The maximum time the first request of a batch waits for others.
+            max_batch_size (int): The number of queued requests that starts a batch immediately.
+        """
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queues = {}
+        self._condition = threading.Condition()
+
+    def classify(self, mode, predictor):
+        """
+        Queue the data set on a Predictor (a shallow copy borrowed from the model registry) and
+        block until the batch it joined has been classified. On return, the final_classification
+        of the Predictor only builds the output. If the batch fails, the error is logged and the
+        Predictor classifies its data alone.
+
+        Returns:
+            float: The time spent in the queue, in seconds.
+        """
+        item = {"predictor": predictor, "done": threading.Event(), "enqueued_at": time.perf_counter()}
+        with self._condition:
+            queue = self._queues.setdefault(mode, [])
+            queue.append(item)
+            leader = len(queue) == 1
+            if len(queue) >= self.max_batch_size:
+                self._condition.notify_all()
+
+        if not leader:
+            item["done"].wait()
+            return item["queue_wait"]
+
+        with self._condition:
+            deadline = item["enqueued_at"] + self.max_wait
+            while len(queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            # Requests arriving from now on open a new batch
+            batch = self._queues.pop(mode)
+
+        started_at = time.perf_counter()
+        BATCH_REQUESTS.observe(len(batch), mode=mode)
+        try:
+            predictor.coalesced_classification([queued["predictor"] for queued in batch])
+        except Exception as e:
+            logger.error(f"Coalesced classification of {len(batch)} requests failed, they are classified separately: {e}")
+        finally:
+            for queued in batch:
+                queued["queue_wait"] = started_at - queued["enqueued_at"]
+                QUEUE_WAIT.observe(queued["queue_wait"], mode=mode)
+                queued["done"].set()
+        return item["queue_wait"]
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def timestamp():
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime())
+
+def parse_timestamp(value):
+    """
+    Seconds since the epoch of a timestamp written by timestamp().
+    """
+    return time.mktime(time.strptime(value, TIMESTAMP_FORMAT))
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    """
+    A submitted job. Its state is kept in the status.json file of its folder, so that any
+    worker process of the service can report it, not only the one running it.
+    """
+
+    def __init__(self, job_dir, state, progress_interval=1.0):
+        self.dir = job_dir
+        self.state = state
+        self.progress_interval = progress_interval
+        self._saved_at = 0.0
+
+    @property
+    def id(self):
+        return self.state["Job ID"]
+
+    def update(self, force=True, **fields):
+        """
+        Update the state of the job and write it to disk. Without force, the state is written
+        at most once every progress_interval seconds (for frequent progress updates).
+        """
+        self.state.update(fields)
+        now = time.monotonic()
+        if force or now - self._saved_at >= self.progress_interval:
+            self._saved_at = now
+            self.save()
+
+    def save(self):
+        status_path = os.path.join(self.dir, "status.json")
+        temporary_path = status_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as status_file:
+            json.dump(self.state, status_file, indent=4)
+        os.replace(temporary_path, status_path)
+
+    def save_result(self, filename, content):
+        """
+        Store the result of the job in its folder: bytes, or an iterable of bytes written as they are produced.
+        """
+        result_path = os.path.join(self.dir, filename)
+        with open(result_path + ".tmp", "wb") as result_file:
+            if isinstance(content, bytes):
+                result_file.write(content)
+            else:
+                for part in content:
+                    result_file.write(part)
+        os.replace(result_path + ".tmp", result_path)
+        self.state["Result file"] = filename
+
+class JobManager:
+    """
+    Runs jobs on a bounded pool of background threads of this worker process (sharing its
+    resident models) and stores their state and result under jobs_dir. Finished jobs (completed
+    or failed) expire ttl seconds after they finished and are deleted; queued and running jobs
+    never expire.
+    """
+
+    def __init__(self, jobs_dir, max_workers=2, max_pending=100, ttl=3600, progress_interval=1.0):
+        """
+        Args:
+            jobs_dir (str): The folder holding a subfolder per job, shared by the worker processes.
+            max_workers (int): The number of jobs run at the same time by this process.
+            max_pending (int): The maximum number of jobs queued or running in this process.
+            ttl (float): Seconds after which finished jobs are deleted.
+            progress_interval (float): Minimum number of seconds between two writes of the progress of a job.
+        """
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="classification-job")
+        self._pending = 0
+        self._lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def create(self, **fields):
+        """
+        Create a queued job with the given fields in its state.
+
+        Returns:
+            Job: The new job, with an empty folder for its input and result.
+        """
+        self.sweep()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        job = Job(self.job_dir(job_id), {"Job ID": job_id, "Status": "queued", "Submitted at": timestamp(), **fields}, self.progress_interval)
+        job.save()
+        return job
+
+    def submit(self, job, target, *args):
+        """
+        Queue target(job, *args) on the worker pool.
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already queued or running in this process.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({self._pending})")
+            self._pending += 1
+        self._executor.submit(self._run, job, target, args)
+
+    def _run(self, job, target, args):
+        try:
+            if not os.path.isdir(job.dir):
+                logger.warning(f"Job {job.id} was removed before it started")
+                return
+            job.update(**{"Status": "running", "Started at": timestamp()})
+            target(job, *args)
+            job.update(**{"Status": "completed", "Finished at": timestamp()})
+        except Exception as e:
+            if not os.path.isdir(job.dir):
+                logger.warning(f"Job {job.id} was removed while it was running: {e}")
+                return
+            logger.error(f"Job {job.id} failed: {e}")
+            try:
+                job.update(**{"Status": "failed", "Finished at": timestamp(), "Error details": str(e)})
+            except OSError as save_error:
+                logger.error(f"Could not save the state of the failed job {job.id}: {save_error}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id):
+        """
+        Return the state of a job, or None if it does not exist or has expired.
+        """
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        status_path = os.path.join(self.job_dir(job_id), "status.json")
+        try:
+            with open(status_path, "r", encoding="utf-8") as status_file:
+                state = json.load(status_file)
+            # Only finished jobs expire: a queued job or a job without progress updates may keep the same state for long
+            if state["Status"] in ("completed", "failed") and time.time() - parse_timestamp(state["Finished at"]) > self.ttl:
+                shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+                return None
+            return state
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def result_path(self, job_id):
+        """
+        Return the path of the result of a completed job, or None.
+        """
+        state = self.get(job_id)
+        if state is None or state["Status"] != "completed" or "Result file" not in state:
+            return None
+        return os.path.join(self.job_dir(job_id), state["Result file"])
+
+    def sweep(self):
+        """
+        Delete the expired jobs.
+        """
+        for job_id in os.listdir(self.jobs_dir):
+            if JOB_ID_PATTERN.match(job_id):
+                self.get(job_id)
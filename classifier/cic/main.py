@@ -1,9 +1,12 @@
 import sys
 import os
 import argparse
+import tempfile
 from flask import Flask
 from cic.blueprints.web_interface import interface_bp
 from cic.blueprints.cic_api import api_bp
+from cic.predictor_manager import preload_models
+from cic.src.graph_optimization import parse_warmup_shapes
 
 def create_app(src_path, prefix = "/cic"):
     app = Flask(__name__, static_url_path=prefix+'/static', static_folder="static")
@@ -18,6 +21,67 @@ def create_app(src_path, prefix = "/cic"):
     # Configuration of SRC_PATH in the app
     app.config['SRC_PATH'] = src_path
 
+    # Token protecting the model administration endpoints (disabled when unset)
+    app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
+
+    # Inference batching: citations per batch and optional budget of padded tokens per batch
+    app.config['BATCH_SIZE'] = int(os.getenv('BATCH_SIZE', 32))
+    app.config['MAX_BATCH_TOKENS'] = int(os.getenv('MAX_BATCH_TOKENS', 0)) or None
+    # Bucket citations by tokenized length before batching, to reduce padding
+    app.config['SORT_BY_LENGTH'] = os.getenv('SORT_BY_LENGTH', 'true').lower() in ('1', 'true', 'yes')
+
+    # Result cache: maximum number of results kept in memory (0 disables it) and optional SQLite file
+    app.config['RESULT_CACHE_SIZE'] = int(os.getenv('RESULT_CACHE_SIZE', 100000))
+    app.config['RESULT_CACHE_PATH'] = os.getenv('RESULT_CACHE_PATH')
+
+    # CPU inference backend: 'int8' quantizes the binary classifiers, with an optional cache of the quantized weights
+    app.config['QUANTIZATION'] = os.getenv('QUANTIZATION') or None
+    app.config['QUANTIZED_CACHE_DIR'] = os.getenv('QUANTIZED_CACHE_DIR')
+    # Inference backend of the binary classifiers: 'torch' or 'onnx' (graphs exported with cic.tools.export_onnx)
+    app.config['INFERENCE_BACKEND'] = os.getenv('INFERENCE_BACKEND', 'torch')
+    # Ensemble members run at the same time (0 or 1 runs them in sequence) and intra-op threads of each member
+    app.config['CONCURRENT_MEMBERS'] = int(os.getenv('CONCURRENT_MEMBERS', 0))
+    app.config['THREADS_PER_MEMBER'] = int(os.getenv('THREADS_PER_MEMBER', 0)) or None
+    # Optimized graphs of the torch models ('torchscript' or 'compile', unset runs them eagerly), folder caching
+    # them across restarts, and batch shapes run through each ensemble once loaded (e.g. '1x32,32x128')
+    app.config['GRAPH_OPTIMIZATION'] = os.getenv('GRAPH_OPTIMIZATION') or None
+    app.config['GRAPH_CACHE_DIR'] = os.getenv('GRAPH_CACHE_DIR')
+    app.config['WARMUP_SHAPES'] = parse_warmup_shapes(os.getenv('WARMUP_SHAPES'))
+    # Folder keeping the config and tokenizer of the base checkpoints (default: SRC_PATH/models/base_checkpoints)
+    app.config['BASE_CHECKPOINT_DIR'] = os.getenv('BASE_CHECKPOINT_DIR')
+    # Modes whose models are loaded when the server starts (comma-separated, e.g. 'M'), see gunicorn.conf.py
+    app.config['PRELOAD_MODES'] = [mode.strip() for mode in os.getenv('PRELOAD_MODES', '').split(',') if mode.strip()]
+    invalid_modes = [mode for mode in app.config['PRELOAD_MODES'] if mode not in ('WS', 'WoS', 'M')]
+    if invalid_modes:
+        raise ValueError(f"Invalid PRELOAD_MODES: {invalid_modes}. Expected modes among 'WS', 'WoS', 'M'")
+    # Memory budget of the binary classifier ensembles resident in each worker, in MB (0 means no limit)
+    app.config['MODEL_MEMORY_BUDGET_MB'] = int(os.getenv('MODEL_MEMORY_BUDGET_MB', 0))
+    # Cascade mode: confidence of the SciBERT ensemble above which a context is classified without XLNet
+    # and the metaclassifier (0 disables it, see cic/tools/evaluate_cascade.py to pick it)
+    app.config['CASCADE_THRESHOLD'] = float(os.getenv('CASCADE_THRESHOLD', 0)) or None
+    # Coalescing of concurrent JSON-body requests: maximum wait in ms (0 disables it) and maximum requests per batch
+    app.config['COALESCE_WAIT_MS'] = float(os.getenv('COALESCE_WAIT_MS', 0))
+    app.config['COALESCE_MAX_BATCH'] = int(os.getenv('COALESCE_MAX_BATCH', 32))
+
+    # Asynchronous jobs: shared folder of the jobs, jobs run at the same time and queued per worker,
+    # expiration of the results in seconds and number of files classified together
+    app.config['JOBS_DIR'] = os.getenv('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'cic_jobs'))
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_MAX_PENDING'] = int(os.getenv('JOB_MAX_PENDING', 100))
+    app.config['JOB_TTL_SECONDS'] = int(os.getenv('JOB_TTL_SECONDS', 3600))
+    app.config['JOB_CHUNK_FILES'] = int(os.getenv('JOB_CHUNK_FILES', 50))
+
+    # Number of NDJSON records classified together by the streaming endpoint
+    app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', 256))
+
+    # ZIP results of archives: files classified together before their results are streamed, and compact
+    # JSON entries instead of indented ones (serialized with orjson when it is installed)
+    app.config['ARCHIVE_CHUNK_FILES'] = int(os.getenv('ARCHIVE_CHUNK_FILES', 50))
+    app.config['ZIP_COMPACT_JSON'] = os.getenv('ZIP_COMPACT_JSON', 'false').lower() in ('1', 'true', 'yes')
+
+    # Add the time spent in each stage, the batches and the peak memory of the request to the manifest
+    app.config['MANIFEST_METRICS'] = os.getenv('MANIFEST_METRICS', 'false').lower() in ('1', 'true', 'yes')
+
     # Blueprint registration
     app.register_blueprint(interface_bp, url_prefix=prefix+'/')
     app.register_blueprint(api_bp, url_prefix=prefix+'/api')
@@ -44,6 +108,7 @@ if __name__ == '__main__':
             args.src_path or src_path,
             args.prefix or prefix
         )
-    
+    preload_models(app)
+
     # Run with Flask dev server
     app.run(host='0.0.0.0', port=5000, debug=False)
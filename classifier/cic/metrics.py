@@ -0,0 +1,127 @@
+import threading
+
+# Buckets of the duration histograms, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Counter:
+    """
+    A monotonically increasing value, optionally split by labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+class Gauge:
+    """
+    A value that can go up and down, optionally split by labels.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+class Histogram:
+    """
+    Counts observations (e.g. durations) in cumulative buckets, optionally split by labels.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", format_labels(self.labelnames, key, [("le", format_value(bound))]), count))
+                samples.append((f"{self.name}_sum", format_labels(self.labelnames, key), total))
+                samples.append((f"{self.name}_count", format_labels(self.labelnames, key), counts[-1]))
+        return samples
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered in the Prometheus text format by the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Metrics are created at import time: return the existing one when a module is imported again
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
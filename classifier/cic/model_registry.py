@@ -0,0 +1,123 @@
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """
+    Process-resident registry of loaded Predictors, keyed by classification mode.
+
+    Each worker process keeps a single registry, so the ensembles and metaclassifiers
+    of a mode are loaded once and then shared by every request served by that worker.
+    Requests never use the registered Predictor directly: they borrow a shallow copy
+    which shares the loaded models but keeps its own data state.
+    The binary classifier ensembles are held by the ensemble pool of the Predictors and
+    loaded on first use; the registry only holds the metaclassifiers of each mode.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader (callable): Function called as loader(mode, src_path) that returns a loaded Predictor.
+        """
+        self.loader = loader
+        self._entries = {}
+        self._mode_locks = {}
+        self._lock = threading.Lock()
+
+    def _get_mode_lock(self, mode):
+        with self._lock:
+            if mode not in self._mode_locks:
+                self._mode_locks[mode] = threading.Lock()
+            return self._mode_locks[mode]
+
+    def _load(self, mode, src_path):
+        logger.info(f"Loading models for mode {mode}")
+        start = time.perf_counter()
+        predictor = self.loader(mode, src_path)
+        load_time = time.perf_counter() - start
+        logger.info(f"Models for mode {mode} loaded in {load_time:.2f}s")
+        return {
+            "predictor": predictor,
+            "src_path": src_path,
+            "loaded_at": time.time(),
+            "load_time": load_time,
+            "borrow_count": 0
+        }
+
+    def borrow(self, mode, src_path):
+        """
+        Return a Predictor for the given mode, loading its models on first use.
+
+        Args:
+            mode (str): The classification mode ('WS', 'WoS' or 'M').
+            src_path (str): The source path where models are located.
+
+        Returns:
+            Predictor: A per-request Predictor sharing the resident models.
+        """
+        with self._get_mode_lock(mode):
+            entry = self._entries.get(mode)
+            if entry is None or entry["src_path"] != src_path:
+                entry = self._load(mode, src_path)
+                self._entries[mode] = entry
+            entry["borrow_count"] += 1
+            predictor = entry["predictor"]
+        return predictor.shallow_copy()
+
+    def preload(self, mode, src_path):
+        """
+        Load the models of a mode, ensembles included, before any request uses them.
+        Models already resident (e.g. inherited from the Gunicorn master) are kept.
+        """
+        with self._get_mode_lock(mode):
+            entry = self._entries.get(mode)
+            if entry is None or entry["src_path"] != src_path:
+                entry = self._load(mode, src_path)
+                self._entries[mode] = entry
+        entry["predictor"].load_branches()
+
+    def reload(self, mode, src_path):
+        """
+        Load the models of a mode again, ensembles included, and replace the resident ones.
+        Requests already holding the previous models complete with them.
+        """
+        with self._get_mode_lock(mode):
+            entry = self._entries.get(mode)
+            if entry is not None:
+                entry["predictor"].release_ensembles()
+            entry = self._load(mode, src_path)
+            entry["predictor"].load_branches()
+            self._entries[mode] = entry
+
+    def evict(self, mode):
+        """
+        Drop the resident models of a mode, and its ensembles from the pool (also for
+        the modes sharing them). They are loaded again on the next request.
+
+        Returns:
+            bool: True if the mode was loaded, False otherwise.
+        """
+        with self._get_mode_lock(mode):
+            entry = self._entries.pop(mode, None)
+        if entry is not None:
+            entry["predictor"].release_ensembles()
+            logger.info(f"Models for mode {mode} evicted")
+        return entry is not None
+
+    def is_loaded(self, mode):
+        return mode in self._entries
+
+    def status(self):
+        """
+        Describe the resident modes, for the admin endpoints.
+        """
+        status = {}
+        for mode, entry in list(self._entries.items()):
+            status[mode] = {
+                "Loaded at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry["loaded_at"])),
+                "Load time (s)": round(entry["load_time"], 3),
+                "Requests served": entry["borrow_count"]
+            }
+        return status
@@ -1,9 +1,213 @@
 import os
 import sys
+import gc
 import logging
+import torch
 from flask import current_app
 from .src.predictor import Predictor
+from .src.data_processor import DataProcessor
+from .model_registry import ModelRegistry
+from .src.result_cache import ResultCache
+from .src.ensemble_pool import EnsemblePool
+from .coalescer import RequestCoalescer
+from .jobs import JobManager
+from . import metrics
 import ast
+import json
+import itertools
+import resource
+
+STAGE_SECONDS = metrics.registry.histogram(
+    "cic_stage_duration_seconds",
+    "Time spent in each stage of the classification pipeline, per classified data set.",
+    ["mode", "stage"]
+)
+CITATIONS = metrics.registry.counter(
+    "cic_citations_processed_total",
+    "Citations classified and returned.",
+    ["mode"]
+)
+CONTEXTS = metrics.registry.counter(
+    "cic_contexts_classified_total",
+    "Unique citation contexts run through the models (after deduplication and the result cache).",
+    ["mode"]
+)
+EARLY_EXITS = metrics.registry.counter(
+    "cic_cascade_early_exits_total",
+    "Unique citation contexts decided by the SciBERT ensemble alone in cascade mode (see CASCADE_THRESHOLD).",
+    ["mode"]
+)
+BATCH_SIZE = metrics.registry.histogram(
+    "cic_batch_size",
+    "Contexts per batch run through the binary classifiers.",
+    ["mode", "model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+PEAK_RSS = metrics.registry.gauge(
+    "cic_process_peak_rss_bytes",
+    "Peak resident memory of the worker process."
+)
+
+result_cache = None
+ensemble_pool = None
+request_coalescer = None
+job_manager = None
+
+def get_result_cache(src_path):
+    """
+    Returns the result cache shared by the Predictors of this process, as configured
+    by RESULT_CACHE_SIZE and RESULT_CACHE_PATH. None if the cache is disabled.
+    """
+    global result_cache
+    max_entries = current_app.config.get('RESULT_CACHE_SIZE', 0)
+    if not max_entries:
+        return None
+    models_path = os.path.join(src_path, "models")
+    if result_cache is None or result_cache.models_path != models_path:
+        result_cache = ResultCache(models_path, max_entries, current_app.config.get('RESULT_CACHE_PATH'))
+    return result_cache
+
+def get_ensemble_pool():
+    """
+    Returns the pool of binary classifier ensembles shared by the Predictors of this process,
+    bounded by MODEL_MEMORY_BUDGET_MB (0 means no limit).
+    """
+    global ensemble_pool
+    budget_mb = current_app.config.get('MODEL_MEMORY_BUDGET_MB', 0)
+    if ensemble_pool is None:
+        ensemble_pool = EnsemblePool()
+    ensemble_pool.max_bytes = budget_mb * 2**20 if budget_mb else None
+    return ensemble_pool
+
+def get_request_coalescer():
+    """
+    Returns the request coalescer of this process, as configured by COALESCE_WAIT_MS
+    and COALESCE_MAX_BATCH. None if coalescing is disabled.
+    """
+    global request_coalescer
+    max_wait_ms = current_app.config.get('COALESCE_WAIT_MS', 0)
+    if not max_wait_ms:
+        return None
+    max_batch_size = current_app.config.get('COALESCE_MAX_BATCH', 32)
+    if request_coalescer is None or (request_coalescer.max_wait, request_coalescer.max_batch_size) != (max_wait_ms / 1000, max_batch_size):
+        request_coalescer = RequestCoalescer(max_wait_ms, max_batch_size)
+    return request_coalescer
+
+def get_job_manager():
+    """
+    Returns the manager running the asynchronous classification jobs of this process,
+    as configured by JOBS_DIR, JOB_WORKERS, JOB_MAX_PENDING and JOB_TTL_SECONDS.
+    """
+    global job_manager
+    if job_manager is None or job_manager.jobs_dir != current_app.config.get('JOBS_DIR'):
+        job_manager = JobManager(
+            current_app.config.get('JOBS_DIR'),
+            max_workers=current_app.config.get('JOB_WORKERS', 2),
+            max_pending=current_app.config.get('JOB_MAX_PENDING', 100),
+            ttl=current_app.config.get('JOB_TTL_SECONDS', 3600)
+        )
+    return job_manager
+
+def load_predictor(selected_mode, src_path):
+    """
+    Builds the Predictor for the selected mode, loading the models found under src_path.
+
+    Args:
+        selected_mode (str): The classification mode.
+        src_path (str): The source path where models and other resources are located.
+
+    Returns:
+        Predictor: The loaded Predictor.
+    """
+    return Predictor(
+        selected_mode,
+        "allenai/scibert_scivocab_cased",
+        "xlnet-base-cased",
+        [
+            [
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_SciBERT_met.pt"), #"SciBERT_method_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_SciBERT_bkg.pt"), #"SciBERT_background_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_SciBERT_res.pt") #"SciBERT_result_model.pt")
+            ],
+            [
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_XLNet_met.pt"), #"XLNet_method_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_XLNet_bkg.pt"), #"XLNet_background_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithSections", "WS_XLNet_res.pt") #"XLNet_result_model.pt")
+            ],
+        ],
+        [
+            [
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_SciBERT_met.pt"), #"NoSec_SciBERT_method_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_SciBERT_bkg.pt"), #"NoSec_SciBERT_background_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_SciBERT_res.pt") #"NoSec_SciBERT_result_model.pt")
+            ],
+            [
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_XLNet_met.pt"), #"NoSec_XLNet_method_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_XLNet_bkg.pt"), #"NoSec_XLNet_background_model.pt"),
+                os.path.join(src_path, "models", "ModelsWithoutSections", "WoS_XLNet_res.pt") #"NoSec_XLNet_result_model.pt")
+            ],
+        ],
+        os.path.join(src_path, "models", "ModelsWithSections", "FFNN_SciCiteWS.pth"), #"MetaClassifierSections.pth"),
+        os.path.join(src_path, "models", "ModelsWithoutSections", "FFNN_SciCiteWoS.pth"), #"MetaClassifierNoSections.pth"),
+        batch_size=current_app.config.get('BATCH_SIZE', 32),
+        max_batch_tokens=current_app.config.get('MAX_BATCH_TOKENS'),
+        sort_by_length=current_app.config.get('SORT_BY_LENGTH', True),
+        result_cache=get_result_cache(src_path),
+        quantization=current_app.config.get('QUANTIZATION'),
+        quantized_cache_dir=current_app.config.get('QUANTIZED_CACHE_DIR'),
+        backend=current_app.config.get('INFERENCE_BACKEND', 'torch'),
+        concurrent_members=current_app.config.get('CONCURRENT_MEMBERS', 0),
+        threads_per_member=current_app.config.get('THREADS_PER_MEMBER'),
+        base_cache_dir=current_app.config.get('BASE_CHECKPOINT_DIR') or os.path.join(src_path, "models", "base_checkpoints"),
+        ensemble_pool=get_ensemble_pool(),
+        cascade_threshold=current_app.config.get('CASCADE_THRESHOLD'),
+        graph_optimization=current_app.config.get('GRAPH_OPTIMIZATION'),
+        graph_cache_dir=current_app.config.get('GRAPH_CACHE_DIR'),
+        warmup_shapes=current_app.config.get('WARMUP_SHAPES')
+    )
+
+
+model_registry = ModelRegistry(load_predictor)
+
+def preload_models(app, before_fork=False):
+    """
+    Load the models of the PRELOAD_MODES of the app, ensembles included, into the model registry
+    of this process, so that the first requests do not wait for them.
+
+    Args:
+        app (Flask): The application, whose configuration gives the modes and SRC_PATH.
+        before_fork (bool): Whether the models are loaded in the Gunicorn master, to be shared
+                            copy-on-write by the workers forked afterwards. The master then runs
+                            torch on a single thread, as OpenMP threads do not survive a fork,
+                            and moves the loaded objects out of the garbage collector, which would
+                            otherwise write to (and so copy) their pages in each worker.
+    """
+    modes = app.config.get('PRELOAD_MODES', [])
+    if not modes:
+        return
+    if before_fork and app.config.get('INFERENCE_BACKEND', 'torch') == 'onnx':
+        # ONNX Runtime sessions own thread pools, which are not usable in a forked process
+        logging.getLogger(__name__).info("ONNX backend: the models are preloaded by each worker instead of the master")
+        return
+
+    threads = torch.get_num_threads()
+    if before_fork:
+        torch.set_num_threads(1)
+    try:
+        with app.app_context():
+            for mode in modes:
+                model_registry.preload(mode, app.config['SRC_PATH'])
+    finally:
+        torch.set_num_threads(threads)
+    if before_fork:
+        gc.collect()
+        gc.freeze()
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
 
 class PredictorManager:
     """
@@ -14,6 +218,7 @@ class PredictorManager:
     def __init__(self):
         self.manifest_dict = {}
         self.predictor = None
+        self.selected_mode = None
         self.SRC_PATH = self.get_src_path()
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
@@ -37,6 +242,7 @@ class PredictorManager:
     def instantiate_predictor(self, selected_mode):
         """
         Instantiates the Predictor object based on the selected mode.
+        Models are loaded once per process and shared through the model registry.
 
         Args:
             selected_mode (str): The classification mode selected by the user.
@@ -47,37 +253,9 @@ class PredictorManager:
         self.logger.info("Instantiating Predictor")
         try:
             # Predictor instantiation with correct models according tothe selected mode
-            self.predictor = Predictor(
-                selected_mode,
-                "allenai/scibert_scivocab_cased",
-                "xlnet-base-cased",
-                [
-                    [
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_SciBERT_met.pt"), #"SciBERT_method_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_SciBERT_bkg.pt"), #"SciBERT_background_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_SciBERT_res.pt") #"SciBERT_result_model.pt")
-                    ],
-                    [
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_XLNet_met.pt"), #"XLNet_method_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_XLNet_bkg.pt"), #"XLNet_background_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "WS_XLNet_res.pt") #"XLNet_result_model.pt")
-                    ],
-                ],
-                [
-                    [
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_SciBERT_met.pt"), #"NoSec_SciBERT_method_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_SciBERT_bkg.pt"), #"NoSec_SciBERT_background_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_SciBERT_res.pt") #"NoSec_SciBERT_result_model.pt")
-                    ],
-                    [
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_XLNet_met.pt"), #"NoSec_XLNet_method_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_XLNet_bkg.pt"), #"NoSec_XLNet_background_model.pt"),
-                        os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "WoS_XLNet_res.pt") #"NoSec_XLNet_result_model.pt")
-                    ],
-                ],
-                os.path.join(self.SRC_PATH, "models", "ModelsWithSections", "FFNN_SciCiteWS.pth"), #"MetaClassifierSections.pth"),
-                os.path.join(self.SRC_PATH, "models", "ModelsWithoutSections", "FFNN_SciCiteWoS.pth"), #"MetaClassifierNoSections.pth"),
-            )
+            # Borrow the resident models of the selected mode (loaded on first use)
+            self.predictor = model_registry.borrow(selected_mode, self.SRC_PATH)
+            self.selected_mode = selected_mode
             self.logger.info("Predictor instantiated successfully.")
             self.manifest_dict["Initialization"] = {
                 "Status": "Success",
@@ -99,7 +277,51 @@ class PredictorManager:
             self.logger.error(f"Failed to instantiate Predictor: {e}")
             return False
 
-    def process_data(self, data, filename, from_json, request_source):
+    def record_stage_stats(self, citations=0):
+        """
+        Export the stage statistics recorded by the Predictor (see Predictor.take_stage_stats) to the
+        /metrics endpoint and, when MANIFEST_METRICS is enabled, add them to the 'Performance' entry
+        of the manifest, which sums them over the request.
+
+        Args:
+            citations (int): The number of citations classified and returned since the last call.
+        """
+        stats = self.predictor.take_stage_stats()
+        mode = self.selected_mode
+        for stage, seconds in stats["Stage times"].items():
+            STAGE_SECONDS.observe(seconds, mode=mode, stage=stage)
+        for model_name, sizes in stats["Batch sizes"].items():
+            for size in sizes:
+                BATCH_SIZE.observe(size, mode=mode, model=model_name)
+        CONTEXTS.inc(stats["Classified contexts"], mode=mode)
+        EARLY_EXITS.inc(stats["Early exits"], mode=mode)
+        CITATIONS.inc(citations, mode=mode)
+        peak_rss = peak_rss_bytes()
+        PEAK_RSS.set(peak_rss)
+
+        if not current_app.config.get('MANIFEST_METRICS', False):
+            return
+        performance = self.manifest_dict.setdefault("Performance", {
+            "Stage times (s)": {},
+            "Citations": 0,
+            "Classified contexts": 0,
+            "Batches": {},
+            "Peak RSS (MB)": None
+        })
+        for stage, seconds in stats["Stage times"].items():
+            performance["Stage times (s)"][stage] = round(performance["Stage times (s)"].get(stage, 0.0) + seconds, 6)
+        performance["Citations"] += citations
+        performance["Classified contexts"] += stats["Classified contexts"]
+        if self.predictor.cascade_threshold is not None:
+            performance["Early exits"] = performance.get("Early exits", 0) + stats["Early exits"]
+        for model_name, sizes in stats["Batch sizes"].items():
+            batches = performance["Batches"].setdefault(model_name, {"Count": 0, "Contexts": 0, "Max size": 0})
+            batches["Count"] += len(sizes)
+            batches["Contexts"] += sum(sizes)
+            batches["Max size"] = max([batches["Max size"], *sizes])
+        performance["Peak RSS (MB)"] = round(peak_rss / 2**20, 1)
+
+    def process_data(self, data, filename, from_json, request_source, coalesce=False):
         """
         Processes the data using the instantiated Predictor.
 
@@ -108,6 +330,8 @@ class PredictorManager:
             filename (str): The name of the file being processed.
             from_json (bool): Whether the data comes from a JSON file.
             request_source (str): The source of the request (e.g., 'web-interface').
+            coalesce (bool): Whether to classify the data together with the concurrent requests
+                             of the same mode, when the request coalescer is enabled.
 
         Returns:
             dict: The classification output if successful, None otherwise.
@@ -129,8 +353,14 @@ class PredictorManager:
 
             # Set data in the Predictor
             self.predictor.set_data(cls_data, temporary_data, from_json=from_json)
+            coalescer = get_request_coalescer() if coalesce else None
+            if coalescer is not None:
+                # Waits for the batch of concurrent requests including this one to be classified
+                queue_wait = coalescer.classify(self.selected_mode, self.predictor)
+                self.logger.info(f"Coalesced request waited {queue_wait * 1000:.1f} ms in queue")
             # Does classification operation
             output = self.predictor.final_classification()
+            self.record_stage_stats(citations=len(output))
             if "Classification" not in self.manifest_dict:
                 self.manifest_dict["Classification"] = {}
             self.manifest_dict["Classification"][filename] = {
@@ -156,3 +386,173 @@ class PredictorManager:
                 }
                 self.logger.error(f"Error processing data: {e}")
                 return None
+
+    def process_archive(self, data_list, request_source, chunk_size=None, progress_callback=None):
+        """
+        Processes the JSON files extracted from an archive.
+        The citation contexts of the files are classified together, in shared batches,
+        then each file gets its own result and manifest entry as with process_data.
+
+        Args:
+            data_list (list or iterator): The files read by process_compressed_file or iter_compressed_file, with 'filename', 'rel_path' and 'data' keys.
+            request_source (str): The source of the request (e.g., 'web-interface').
+            chunk_size (int or None): The number of files classified together. None classifies all the files together.
+            progress_callback (callable or None): Called as progress_callback(processed_files, total_files) after each file.
+
+        Returns:
+            list: Dictionaries with 'filename', 'rel_path' and 'result' keys, for the files classified successfully.
+        """
+        return list(self.iter_archive(data_list, request_source, chunk_size, progress_callback))
+
+    def iter_archive(self, data_list, request_source, chunk_size=None, progress_callback=None):
+        """
+        Same as process_archive, but yields the result of each file as soon as its chunk is classified,
+        so that it can be sent (see stream_zip) before the following chunks are classified.
+
+        data_list can also be an iterator (see file_processing.iter_compressed_file): each chunk is then
+        read from it only when the previous one is classified, so that only one chunk of files is held
+        in memory. The total number of files passed to progress_callback is None until the last chunk.
+
+        Yields:
+            dict: The 'filename', 'rel_path' and 'result' of each file classified successfully.
+        """
+        total_files = len(data_list) if isinstance(data_list, list) else None
+        files = iter(data_list)
+        position = 0
+        upcoming = next(files, None)
+        while upcoming is not None:
+            chunk = [upcoming] + list(itertools.islice(files, chunk_size - 1 if chunk_size else None))
+            # One file ahead, so that the total is known when the last chunk is classified
+            upcoming = next(files, None)
+            if upcoming is None:
+                total_files = position + len(chunk)
+            datasets = []
+            for item in chunk:
+                cls_data = item['data'][0] if isinstance(item['data'], tuple) else item['data']
+                try:
+                    datasets.append(DataProcessor(cls_data, from_json=True).data)
+                except Exception:
+                    # Invalid files are reported by process_data below
+                    continue
+            try:
+                self.predictor.pool_classification(datasets)
+            except Exception as e:
+                self.logger.error(f"Error while classifying the archive files together, falling back to per-file classification: {e}")
+            self.record_stage_stats()
+
+            for item in chunk:
+                position += 1
+                json_filename = item['filename']
+                rel_path = item.get('rel_path', json_filename)
+                result = self.process_data(item['data'], json_filename, from_json=True, request_source=request_source)
+                if progress_callback is not None:
+                    progress_callback(position, total_files)
+                if result is not None:
+                    yield {'filename': json_filename, 'rel_path': rel_path, 'result': result}
+            # The results of a chunk are not kept for the next ones: memory stays bounded by chunk_size
+            # (the result cache, if enabled, still answers the contexts repeated across chunks)
+            self.predictor.clear_context_results()
+
+    def classify_stream(self, lines, batch_size=256):
+        """
+        Classifies newline-delimited JSON citation records as they are read, in batches of
+        batch_size records, so that memory does not grow with the input and results are
+        returned before the whole input has been read.
+
+        Each record is an object with 'id', 'SECTION' and 'CITATION' keys, and optionally other
+        keys, which are kept in its result as with JSON files.
+
+        Args:
+            lines (iterable): The input lines (str or bytes), e.g. the request body stream.
+            batch_size (int): The number of records classified together.
+
+        Yields:
+            dict: The result of each record, with its 'id', in the input order. Records that cannot
+                  be classified are reported as {'id', 'line', 'error'} as soon as they are read.
+        """
+        def parse(lines):
+            for line_number, line in enumerate(lines, start=1):
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8', errors='replace')
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, e
+
+        yield from self.classify_record_batches(parse(lines), batch_size)
+
+    def classify_record_batches(self, records, batch_size=256):
+        """
+        Validates and classifies citation records in batches of batch_size records, as read from
+        NDJSON lines (classify_stream) or from the rows of a table (see utils.columnar).
+
+        Args:
+            records (iterable): (line number, record) pairs; a record that could not be decoded is
+                                given as the exception raised.
+            batch_size (int): The number of records classified together.
+
+        Yields:
+            dict: The result of each record, as in classify_stream.
+        """
+        batch = []
+        for line_number, record in records:
+            if isinstance(record, Exception):
+                yield {"id": None, "line": line_number, "error": f"Invalid JSON record: {record}"}
+                continue
+            if not isinstance(record, dict) or 'id' not in record:
+                yield {"id": None, "line": line_number, "error": "Invalid record, it must be an object with 'id', 'SECTION' and 'CITATION' keys."}
+                continue
+            if 'SECTION' not in record or 'CITATION' not in record:
+                yield {"id": record['id'], "line": line_number, "error": "Invalid record, missing 'SECTION' or 'CITATION' key."}
+                continue
+            if not isinstance(record['CITATION'], str) or not isinstance(record['SECTION'], str):
+                yield {"id": record['id'], "line": line_number, "error": "Invalid record, 'SECTION' and 'CITATION' must be strings."}
+                continue
+            if record['CITATION'] == '':
+                yield {"id": record['id'], "line": line_number, "error": "Invalid record, 'CITATION' is empty."}
+                continue
+            batch.append((line_number, record))
+            if len(batch) >= batch_size:
+                yield from self.classify_records(batch)
+                batch = []
+        if batch:
+            yield from self.classify_records(batch)
+
+    def classify_records(self, batch):
+        """
+        Classifies a batch of stream records (see classify_stream), given as (line number, record) pairs.
+        Records are keyed by line number, so that repeated ids do not overwrite each other.
+        If the batch cannot be classified, its records are classified again one at a time, so that
+        only the records causing the error are reported.
+        """
+        cls_data = {}
+        temporary_data = {}
+        for line_number, record in batch:
+            key = str(line_number)
+            cls_data[key] = {'SECTION': record['SECTION'], 'CITATION': record['CITATION']}
+            temporary_data[key] = {field: value for field, value in record.items() if field != 'id'}
+        try:
+            self.predictor.set_data(cls_data, temporary_data, from_json=True)
+            output = self.predictor.final_classification()
+            self.record_stage_stats(citations=len(output))
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        finally:
+            # Results are not kept across batches: memory stays bounded by batch_size
+            self.predictor.clear_context_results()
+        if error is not None:
+            if len(batch) > 1:
+                self.logger.error(f"Error processing stream records, classifying them one at a time: {error}")
+                for item in batch:
+                    yield from self.classify_records([item])
+                return
+            self.logger.error(f"Error processing stream record: {error}")
+            line_number, record = batch[0]
+            yield {"id": record['id'], "line": line_number, "error": f"Error while trying to process data: {error}"}
+            return
+        for line_number, record in batch:
+            yield {"id": record['id'], **output[str(line_number)]}
@@ -0,0 +1,60 @@
+import torch
+
+class TorchBackend:
+    """
+    Runs a fine-tuned sequence classifier with PyTorch.
+    """
+    tensor_type = "pt"
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def positive_probabilities(self, input_data):
+        """
+        Return the positive probability of each sequence of a padded batch, as a (B,) tensor.
+        """
+        input_data = {key: val.to(self.device) for key, val in input_data.items()}
+        return torch.softmax(self.model(**input_data).logits, dim=-1)[:, 1]
+
+class GraphBackend:
+    """
+    Runs a sequence classifier optimized with TorchScript or torch.compile (see graph_optimization.py),
+    which takes positional inputs and returns the logits.
+    """
+    tensor_type = "pt"
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def positive_probabilities(self, input_data):
+        """
+        Return the positive probability of each sequence of a padded batch, as a (B,) tensor.
+        """
+        logits = self.model(*(input_data[name].to(self.device) for name in self.input_names))
+        return torch.softmax(logits, dim=-1)[:, 1]
+
+class OnnxBackend:
+    """
+    Runs a fine-tuned sequence classifier exported to ONNX (see cic.tools.export_onnx) with ONNX Runtime.
+    """
+    tensor_type = "np"
+
+    def __init__(self, onnx_path, providers=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The ONNX backend requires onnxruntime: pip install onnxruntime")
+        self.onnx_path = onnx_path
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=providers or ["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def positive_probabilities(self, input_data):
+        """
+        Return the positive probability of each sequence of a padded batch, as a (B,) tensor.
+        """
+        feed = {name: input_data[name].astype("int64") for name in self.input_names}
+        logits = self.session.run(["logits"], feed)[0]
+        return torch.softmax(torch.from_numpy(logits), dim=-1)[:, 1]
@@ -0,0 +1,71 @@
+def make_batches(lengths, batch_size=32, max_batch_tokens=None):
+    """
+    Group datapoints into batches, keeping their order.
+
+    A batch is closed when it holds batch_size datapoints or when padding it to its
+    longest member would exceed max_batch_tokens tokens (if a budget is given).
+    A datapoint longer than the budget still gets a batch of its own.
+
+    Args:
+        lengths (list of int): The number of tokens of each datapoint.
+        batch_size (int): The maximum number of datapoints in a batch.
+        max_batch_tokens (int or None): The maximum number of padded tokens in a batch.
+
+    Returns:
+        list of lists of int: The indices of the datapoints in each batch.
+    """
+    batches = []
+    current_batch = []
+    longest = 0
+    for index, length in enumerate(lengths):
+        padded_longest = max(longest, length)
+        batch_full = len(current_batch) >= batch_size
+        over_budget = max_batch_tokens is not None and padded_longest * (len(current_batch) + 1) > max_batch_tokens
+        if current_batch and (batch_full or over_budget):
+            batches.append(current_batch)
+            current_batch = []
+            padded_longest = length
+        current_batch.append(index)
+        longest = padded_longest
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+def schedule_batches(lengths, batch_size=32, max_batch_tokens=None, sort_by_length=True):
+    """
+    Form the batches for a list of tokenized datapoints.
+
+    With sort_by_length, datapoints are ordered by their number of tokens before
+    being grouped, so that each batch gathers sequences of similar length and
+    little compute is spent on padding. Batches always contain indices into the
+    original list: callers use them to put the outputs back in the input order.
+
+    Args:
+        lengths (list of int): The number of tokens of each datapoint.
+        batch_size (int): The maximum number of datapoints in a batch.
+        max_batch_tokens (int or None): The maximum number of padded tokens in a batch.
+        sort_by_length (bool): Whether to bucket datapoints by length.
+
+    Returns:
+        list of lists of int: The indices of the datapoints in each batch.
+    """
+    if not sort_by_length:
+        return make_batches(lengths, batch_size, max_batch_tokens)
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    sorted_batches = make_batches([lengths[index] for index in order], batch_size, max_batch_tokens)
+    return [[order[position] for position in batch] for batch in sorted_batches]
+
+def padding_counts(lengths, batches):
+    """
+    Count the real tokens and the tokens processed once each batch is padded to its longest member.
+
+    Returns:
+        tuple: (real_tokens, padded_tokens). Their ratio is the padding efficiency.
+    """
+    real_tokens = 0
+    padded_tokens = 0
+    for batch in batches:
+        batch_lengths = [lengths[index] for index in batch]
+        real_tokens += sum(batch_lengths)
+        padded_tokens += max(batch_lengths) * len(batch_lengths)
+    return real_tokens, padded_tokens
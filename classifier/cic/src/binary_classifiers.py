@@ -1,8 +1,69 @@
 from cic.src.metaclassifiers import *
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from cic.src.backends import TorchBackend, GraphBackend, OnnxBackend
+from cic.src.checkpoints import load_checkpoint, load_weights
+from cic.src.graph_optimization import LogitsModel, graph_cache_path, load_cached_graph, optimize_module, configure_compile_cache
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+from transformers.modeling_utils import no_init_weights
+from torch.overrides import TorchFunctionMode
+from contextlib import contextmanager
+import os
+import time
+import threading
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# In-place initializers called by the torch modules constructors
+TORCH_INIT_FUNCTIONS = ["uniform_", "normal_", "trunc_normal_", "constant_", "zeros_", "ones_", "xavier_uniform_", "xavier_normal_", "kaiming_uniform_", "kaiming_normal_", "orthogonal_"]
+
+# The transformers no_init_weights context switches a process-wide flag: overlapping builds
+# (e.g. a job thread and a request loading different modes) would restore it out of order
+INIT_FLAG_LOCK = threading.Lock()
+
+class SkipTorchInit(TorchFunctionMode):
+    """
+    Turns the torch initializers (TORCH_INIT_FUNCTIONS) into no-ops. Torch function modes are
+    thread-local: the modules built by other threads at the same time are initialized as usual.
+    """
+    skipped = {getattr(torch.nn.init, name) for name in TORCH_INIT_FUNCTIONS}
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if func in self.skipped:
+            return args[0] if args else kwargs["tensor"]
+        return func(*args, **kwargs)
+
+@contextmanager
+def skip_weight_init():
+    """
+    Build models without initializing their weights, neither with the transformers initializers
+    nor with the default initializers of the torch layers: every weight is overwritten by the fine-tuned state_dict.
+    """
+    with INIT_FLAG_LOCK, no_init_weights(), SkipTorchInit():
+        yield
+
+def local_base_checkpoint(model_ckp, base_cache_dir):
+    """
+    Return the local folder holding the config and tokenizer of a base checkpoint, saving them there
+    from the Hugging Face Hub the first time: later starts then need no network access.
+    Returns model_ckp unchanged if base_cache_dir is None or the files cannot be saved.
+    """
+    if base_cache_dir is None or os.path.isdir(model_ckp):
+        return model_ckp
+    local_path = os.path.join(base_cache_dir, model_ckp.replace("/", "--"))
+    if os.path.exists(os.path.join(local_path, "config.json")):
+        return local_path
+    try:
+        AutoConfig.from_pretrained(model_ckp).save_pretrained(local_path)
+        AutoTokenizer.from_pretrained(model_ckp).save_pretrained(local_path)
+    except OSError as e:
+        logger.warning(f"Could not cache the config and tokenizer of {model_ckp} in {local_path}: {e}")
+        return model_ckp
+    return local_path
 
 class EnsembleClassifier:
-    def __init__(self, model_ckp, state_dict_paths_list, id2label, label2id):
+    def __init__(self, model_ckp, state_dict_paths_list, id2label, label2id, quantize=False, quantized_cache_dir=None, backend="torch", base_cache_dir=None, graph_optimization=None, graph_cache_dir=None):
         """
         To initialize the classifier, we need to provide the following:
             - model_ckp: the checkpoint of the model used to fine-tune
@@ -15,17 +76,102 @@ class EnsembleClassifier:
             - metaclassifier_state_dict_path: the path to the state_dict of the metaclassifier
             - id2label: id2label dictionary
             - label2id: label2id dictionary
+            - quantize: if True, the Linear layers are quantized to dynamic int8 (CPU inference only)
+            - quantized_cache_dir: optional folder where the quantized weights are cached
+            - backend: 'torch' to run the models with PyTorch, 'onnx' to run with ONNX Runtime the graphs
+                       exported next to each state_dict (same path, '.onnx' extension)
+            - base_cache_dir: optional folder where the config and tokenizer of model_ckp are stored after the first download
+            - graph_optimization: optional 'torchscript' or 'compile', to run the torch models as optimized graphs
+            - graph_cache_dir: optional folder where the TorchScript graphs (and the torch.compile kernels) are cached
         """
-        self.model_ckp = model_ckp
+        self.model_ckp = local_base_checkpoint(model_ckp, base_cache_dir)
         self.state_dict_paths_list = state_dict_paths_list
         self.id2label = id2label
         self.label2id = label2id
+        self.quantize = quantize
+        self.quantized_cache_dir = quantized_cache_dir
+        self.backend = backend
+        self.graph_optimization = graph_optimization if backend == "torch" else None
+        self.graph_cache_dir = graph_cache_dir
+        # Attention of the models: 'sdpa' (fused) when optimized and supported by the installed transformers
+        self.attention = "eager"
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_ckp)
-        self.device = self.retrieve_device()
-        self.models = self.load_fine_tuned_model()
-        self.method_model = self.models[0]
-        self.background_model = self.models[1]
-        self.result_model = self.models[2]
+        self.config = None
+        # Dynamically quantized and ONNX models run on CPU
+        self.device = torch.device("cpu") if self.quantize or self.backend == "onnx" else self.retrieve_device()
+        if self.backend == "onnx":
+            self.models = None
+            self.method_model = self.background_model = self.result_model = None
+            self.backends = [OnnxBackend(self.onnx_path(state_dict_path)) for state_dict_path in self.state_dict_paths_list]
+        elif self.backend == "torch" and self.graph_optimization is not None:
+            if self.graph_optimization == "compile":
+                configure_compile_cache(self.graph_cache_dir)
+            self.models = tuple(self.load_optimized_model(state_dict_path) for state_dict_path in self.state_dict_paths_list)
+            self.method_model = self.models[0]
+            self.background_model = self.models[1]
+            self.result_model = self.models[2]
+            self.backends = [GraphBackend(model, self.device) for model in self.models]
+        elif self.backend == "torch":
+            self.models = self.load_fine_tuned_model()
+            self.method_model = self.models[0]
+            self.background_model = self.models[1]
+            self.result_model = self.models[2]
+            self.backends = [TorchBackend(model, self.device) for model in self.models]
+        else:
+            raise ValueError(f"Invalid backend: {self.backend}. Expected one of: ['torch', 'onnx']")
+
+    def predict(self, encodings, member_times=None):
+        """
+        Pad a batch of encodings to its longest member and run the method, background and result models on it.
+        If member_times (a list with a value per model) is given, the time spent in each model is added to it.
+
+        Returns:
+            torch.Tensor: A (B, 3) tensor with the positive probability of each model, for each encoding.
+        """
+        input_data = self.tokenizer.pad(encodings, return_tensors=self.backends[0].tensor_type)
+        probabilities = []
+        for member, backend in enumerate(self.backends):
+            start = time.perf_counter()
+            probabilities.append(backend.positive_probabilities(input_data))
+            if member_times is not None:
+                member_times[member] += time.perf_counter() - start
+        return torch.stack(probabilities, dim=1)
+
+    def predict_member(self, member, encodings):
+        """
+        Pad a batch of encodings and run a single model of the ensemble on it (0 method, 1 background, 2 result).
+
+        Returns:
+            torch.Tensor: A (B,) tensor with the positive probability of the model, for each encoding.
+        """
+        input_data = self.tokenizer.pad(encodings, return_tensors=self.backends[member].tensor_type)
+        return self.backends[member].positive_probabilities(input_data)
+
+    def memory_bytes(self):
+        """
+        Approximate memory held by the models of the ensemble: their weights and buffers, or the size of the ONNX graphs.
+        """
+        if self.models is None:
+            return sum(os.path.getsize(backend.onnx_path) for backend in self.backends)
+        total = 0
+        for model in self.models:
+            for value in model.state_dict().values():
+                # Quantized Linear layers store their packed weight and bias as a tuple
+                tensors = value if isinstance(value, tuple) else (value,)
+                total += sum(tensor.numel() * tensor.element_size() for tensor in tensors if isinstance(tensor, torch.Tensor))
+        return total
+
+    def onnx_path(self, state_dict_path):
+        """
+        Path of the ONNX graph exported next to a state_dict. A graph older than its state_dict was exported
+        from a previous version of the checkpoint: it is refused instead of serving stale predictions.
+        """
+        onnx_path = os.path.splitext(state_dict_path)[0] + ".onnx"
+        if os.path.exists(onnx_path) and os.path.exists(state_dict_path) \
+                and os.path.getmtime(onnx_path) < os.path.getmtime(state_dict_path):
+            raise ValueError(f"{onnx_path} is older than {state_dict_path}: export the checkpoint again "
+                             f"with cic.tools.export_onnx")
+        return onnx_path
 
     def retrieve_device(self):
         """
@@ -34,7 +180,7 @@ class EnsembleClassifier:
 
         if torch.cuda.is_available():
             device = torch.device("cuda")
-        if torch.backends.mps.is_available():
+        elif torch.backends.mps.is_available():
             device = torch.device("mps")
         else:
             device = torch.device("cpu")
@@ -45,35 +191,120 @@ class EnsembleClassifier:
         Load the fine-tuned models specific to this case.
         """
 
-        method_state_dict_path = self.state_dict_paths_list[0]
-        method_model = AutoModelForSequenceClassification.from_pretrained(
-            self.model_ckp, 
-            num_labels=2, 
-            id2label=self.id2label, 
-            label2id=self.label2id
-        )
-        method_model.load_state_dict(torch.load(method_state_dict_path, map_location=self.device))
-        method_model = method_model.to(self.device).eval()
-
-        background_state_dict_path = self.state_dict_paths_list[1]
-        background_model = AutoModelForSequenceClassification.from_pretrained(
-            self.model_ckp, 
-            num_labels=2, 
-            id2label=self.id2label, 
-            label2id=self.label2id
-        )
-        background_model.load_state_dict(torch.load(background_state_dict_path, map_location=self.device))
-        background_model = background_model.to(self.device).eval()
-
-        result_state_dict_path = self.state_dict_paths_list[2]
-        result_model = AutoModelForSequenceClassification.from_pretrained(
-            self.model_ckp, 
-            num_labels=2, 
-            id2label=self.id2label, 
-            label2id=self.label2id
-        )
-        result_model.load_state_dict(torch.load(result_state_dict_path, map_location=self.device))
-        result_model = result_model.to(self.device).eval()
+        method_model = self.load_model(self.state_dict_paths_list[0])
+        background_model = self.load_model(self.state_dict_paths_list[1])
+        result_model = self.load_model(self.state_dict_paths_list[2])
 
         return (method_model, background_model, result_model)
 
+    def load_model(self, state_dict_path):
+        """
+        Load a single fine-tuned model. With quantize, the Linear layers are converted
+        to dynamic int8 (CPU only), reusing the quantized weights cached on disk if available.
+
+        The architecture is built from the config of the base checkpoint, without loading
+        nor initializing the base weights, since they are all replaced by the fine-tuned ones.
+        When a '.safetensors' copy of the checkpoint exists, its weights are memory-mapped read-only.
+        """
+        if self.config is None:
+            self.config = AutoConfig.from_pretrained(
+                self.model_ckp,
+                num_labels=2,
+                id2label=self.id2label,
+                label2id=self.label2id
+            )
+        with skip_weight_init():
+            model = self.build_architecture()
+
+        if not self.quantize:
+            # Memory-mapped from the safetensors copy of the checkpoint, if there is one
+            return load_weights(model, state_dict_path, self.device)
+
+        cache_path = self.quantized_cache_path(state_dict_path)
+        if cache_path is not None and os.path.exists(cache_path):
+            # The quantized modules must exist before their cached state can be loaded
+            model = torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+            model.load_state_dict(torch.load(cache_path, map_location="cpu"))
+            return model.eval()
+
+        model.load_state_dict(load_checkpoint(state_dict_path)[0])
+        model = torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+        if cache_path is not None:
+            os.makedirs(self.quantized_cache_dir, exist_ok=True)
+            torch.save(model.state_dict(), cache_path)
+        return model.eval()
+
+    def build_architecture(self):
+        """
+        Build a model from the config. Optimized models use the fused scaled dot product attention of
+        torch when the installed transformers supports it for the architecture (eager attention otherwise).
+        """
+        if self.graph_optimization is not None:
+            try:
+                model = AutoModelForSequenceClassification.from_config(self.config, attn_implementation="sdpa")
+                self.attention = "sdpa"
+                return model
+            except (TypeError, ValueError, ImportError):
+                # Older transformers releases, or no fused attention for this architecture
+                pass
+        return AutoModelForSequenceClassification.from_config(self.config)
+
+    def synthetic_encodings(self, lengths):
+        """
+        Encodings of placeholder text, one of each given length (in tokens, special tokens included):
+        the inputs of the tracing, validation and warmup of the optimized models.
+        """
+        text = " ".join(["citation"] * max(lengths))
+        return [{key: value for key, value in self.tokenizer(text, truncation=True, max_length=length).items()} for length in lengths]
+
+    def load_optimized_model(self, state_dict_path):
+        """
+        Load a model optimized with TorchScript or torch.compile (see graph_optimization.optimize_module).
+        TorchScript graphs are loaded from graph_cache_dir when cached by an earlier start, without
+        building nor tracing the model again.
+        """
+        cache_path = None
+        if self.graph_optimization == "torchscript":
+            options = f"{'int8' if self.quantize else 'fp32'}:{self.device.type}"
+            cache_path = graph_cache_path(self.graph_cache_dir, state_dict_path, self.graph_optimization, options)
+            cached = load_cached_graph(cache_path, self.device)
+            if cached is not None:
+                logger.info(f"Loaded the cached TorchScript graph of {state_dict_path}")
+                return cached
+
+        model = LogitsModel(self.load_model(state_dict_path)).eval()
+        # Padded batches of different sizes and lengths for the tracing and the validation
+        example_inputs = self.tokenizer.pad(self.synthetic_encodings([16, 12]), return_tensors="pt")
+        validation_inputs = self.tokenizer.pad(self.synthetic_encodings([40, 8, 25]), return_tensors="pt")
+        return optimize_module(
+            model,
+            self.graph_optimization,
+            tuple(example_inputs[name].to(self.device) for name in GraphBackend.input_names),
+            tuple(validation_inputs[name].to(self.device) for name in GraphBackend.input_names),
+            cache_path=cache_path,
+            name=f"{os.path.basename(state_dict_path)} ({self.attention} attention)"
+        )
+
+    def warmup(self, shapes):
+        """
+        Run every model on batches of the given (batch size, sequence length) shapes, twice each, so that
+        the first requests do not pay for the lazy initializations and graph specializations.
+        """
+        for batch_size, sequence_length in shapes:
+            sequence_length = min(sequence_length, self.tokenizer.model_max_length)
+            encodings = self.synthetic_encodings([sequence_length] * batch_size)
+            with torch.no_grad():
+                for _ in range(2):
+                    self.predict(encodings)
+
+    def quantized_cache_path(self, state_dict_path):
+        """
+        Path of the cached quantized weights of a checkpoint, keyed by the checkpoint size and
+        modification time and by the torch version. None if caching is disabled.
+        """
+        if self.quantized_cache_dir is None:
+            return None
+        stat = os.stat(state_dict_path)
+        key = hashlib.sha256(f"{os.path.abspath(state_dict_path)}:{stat.st_size}:{stat.st_mtime_ns}:{torch.__version__}".encode("utf-8")).hexdigest()[:16]
+        base_name = os.path.splitext(os.path.basename(state_dict_path))[0]
+        return os.path.join(self.quantized_cache_dir, f"{base_name}.{key}.int8.pt")
@@ -0,0 +1,87 @@
+import os
+import json
+import struct
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Tensor types of the safetensors format
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8, "BOOL": torch.bool
+}
+
+def safetensors_path(checkpoint_path):
+    """
+    Path of the safetensors copy of a '.pt' / '.pth' checkpoint (see cic.tools.convert_safetensors).
+    """
+    return os.path.splitext(checkpoint_path)[0] + ".safetensors"
+
+def unwrap_state_dict(checkpoint):
+    """
+    Return the plain state_dict of a checkpoint, accepting checkpoints wrapped in 'model_state_dict'
+    and removing the 'module.' prefix left by DataParallel.
+    """
+    if isinstance(checkpoint, dict) and "model_state_dict" in checkpoint:
+        state = checkpoint["model_state_dict"]
+    else:
+        state = checkpoint
+    if isinstance(state, dict) and any(k.startswith("module.") for k in state.keys()):
+        state = {k[len("module."):] if k.startswith("module.") else k: v for k, v in state.items()}
+    return state
+
+def load_safetensors(path):
+    """
+    Memory-map a safetensors file read-only (copy-on-write): the tensors are views of the file pages,
+    shared through the OS page cache by all the processes mapping the same file, instead of private copies.
+
+    The format is an 8 bytes little-endian header size, a JSON header with the dtype, shape and
+    byte offsets of each tensor, then the tensor data.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    data_start = 8 + header_size
+    tensors = {}
+    for key, info in header.items():
+        start, end = info["data_offsets"]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        raw = data[data_start + start:data_start + end]
+        if (data_start + start) % raw.new_empty(0, dtype=dtype).element_size():
+            # Misaligned tensors cannot be viewed in place
+            raw = raw.clone()
+        tensors[key] = raw.view(dtype).reshape(info["shape"])
+    return tensors
+
+def load_checkpoint(checkpoint_path, map_location="cpu"):
+    """
+    Load the state_dict of a checkpoint, from its safetensors copy when one exists and is
+    not older than the checkpoint, otherwise with torch.load.
+
+    Returns:
+        tuple: (state_dict, memory_mapped). When memory_mapped is True the tensors should be assigned
+               to the model (load_state_dict(..., assign=True)) rather than copied, to keep them shared.
+    """
+    converted_path = safetensors_path(checkpoint_path)
+    if os.path.exists(converted_path):
+        if not os.path.exists(checkpoint_path) or os.path.getmtime(converted_path) >= os.path.getmtime(checkpoint_path):
+            return load_safetensors(converted_path), True
+        else:
+            logger.warning(f"{converted_path} is older than {checkpoint_path}: ignored, convert the checkpoint again")
+    return unwrap_state_dict(torch.load(checkpoint_path, map_location=map_location)), False
+
+def load_weights(model, checkpoint_path, device):
+    """
+    Load a checkpoint into a model (strict) and move it to the device, in evaluation mode.
+    Memory-mapped weights are assigned to the model on CPU, so that the worker processes share them.
+    """
+    state, memory_mapped = load_checkpoint(checkpoint_path)
+    if memory_mapped and device.type == "cpu":
+        model.load_state_dict(state, assign=True)
+    else:
+        model.load_state_dict(state)
+    return model.to(device).eval()
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class EnsemblePool:
+    """
+    Process-wide pool of the loaded binary classifier ensembles, shared by all the Predictors.
+
+    Each entry holds the (SciBERT, XLNet) ensembles of a branch and is keyed by their checkpoints
+    and loading options, so mode M uses the same entries as modes WS and WoS instead of loading
+    its own copies. Entries are loaded on first use. When max_bytes is set, the least recently used
+    entries are dropped once the resident ones exceed the budget: requests already running with a
+    dropped entry complete with it, then its memory is released.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+        Args:
+            max_bytes (int or None): Memory budget of the resident ensembles, in bytes. None means no limit.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.counters = {"loads": 0, "hits": 0, "evictions": 0}
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def get(self, key, loader, name=None):
+        """
+        Return the ensembles stored under key, calling loader() to load them if they are not resident.
+
+        Args:
+            key (tuple): The checkpoints and loading options of the ensembles.
+            loader (callable): Function returning the tuple of loaded EnsembleClassifiers.
+            name (str or None): A readable name of the entry, for the logs and the status.
+        """
+        with self._get_key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry["ensembles"]
+
+            logger.info(f"Loading ensembles {name or key}")
+            start = time.perf_counter()
+            ensembles = loader()
+            load_time = time.perf_counter() - start
+            size = sum(ensemble.memory_bytes() for ensemble in ensembles)
+            logger.info(f"Ensembles {name or key} loaded in {load_time:.2f}s ({size / 2**20:.0f} MB)")
+
+            with self._lock:
+                self._entries[key] = {
+                    "ensembles": ensembles,
+                    "name": name or str(key),
+                    "bytes": size,
+                    "loaded_at": time.time(),
+                    "load_time": load_time
+                }
+                self.counters["loads"] += 1
+                self._evict_over_budget(keep=key)
+            return ensembles
+
+    def _evict_over_budget(self, keep):
+        """
+        Drop the least recently used entries until the resident ones fit max_bytes.
+        The entry just loaded is always kept, even if it exceeds the budget on its own.
+        Must be called holding the lock.
+        """
+        if self.max_bytes is None:
+            return
+        for key in list(self._entries):
+            if self.resident_bytes() <= self.max_bytes:
+                break
+            if key != keep:
+                entry = self._entries.pop(key)
+                self.counters["evictions"] += 1
+                logger.info(f"Ensembles {entry['name']} evicted to stay within the memory budget")
+
+    def resident_bytes(self):
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def evict(self, key):
+        """
+        Drop an entry. It is loaded again on next use.
+
+        Returns:
+            bool: True if the entry was resident, False otherwise.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            logger.info(f"Ensembles {entry['name']} evicted")
+        return entry is not None
+
+    def status(self):
+        """
+        Describe the resident entries, from the least to the most recently used, for the admin endpoints.
+        """
+        with self._lock:
+            return {
+                "Memory budget (MB)": round(self.max_bytes / 2**20) if self.max_bytes is not None else None,
+                "Resident (MB)": round(self.resident_bytes() / 2**20, 1),
+                "Loads": self.counters["loads"],
+                "Hits": self.counters["hits"],
+                "Evictions": self.counters["evictions"],
+                "Ensembles": [
+                    {
+                        "Name": entry["name"],
+                        "Size (MB)": round(entry["bytes"] / 2**20, 1),
+                        "Loaded at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry["loaded_at"])),
+                        "Load time (s)": round(entry["load_time"], 3)
+                    }
+                    for entry in self._entries.values()
+                ]
+            }
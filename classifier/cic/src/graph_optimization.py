@@ -0,0 +1,122 @@
+import os
+import hashlib
+import logging
+import torch
+import transformers
+
+logger = logging.getLogger(__name__)
+
+GRAPH_OPTIMIZATIONS = ["torchscript", "compile"]
+
+# Maximum absolute difference of the outputs accepted by the validation against the eager model
+VALIDATION_ATOL = 1e-4
+
+class LogitsModel(torch.nn.Module):
+    """
+    Wraps a sequence classifier so that the optimized graph (or the exported ONNX graph, see cic.tools.export_onnx)
+    takes positional inputs and returns the logits only.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
+
+def parse_warmup_shapes(value):
+    """
+    Parse the batch shapes run by the warmup, given as 'BATCHxLENGTH' items separated by commas (e.g. '1x32,32x128').
+
+    Returns:
+        list: (batch size, sequence length) pairs.
+    """
+    shapes = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            batch_size, sequence_length = (int(number) for number in item.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Invalid warmup shape: {item}. Expected BATCHxLENGTH, e.g. 32x128")
+        shapes.append((batch_size, sequence_length))
+    return shapes
+
+def graph_cache_path(cache_dir, checkpoint_path, optimization, options=""):
+    """
+    Path of the cached optimized graph of a checkpoint, keyed as the quantized weights by the checkpoint
+    size and modification time and by the torch version, and also by the transformers version and the
+    loading options the graph depends on. None if caching is disabled.
+    """
+    if cache_dir is None:
+        return None
+    stat = os.stat(checkpoint_path)
+    key = hashlib.sha256(f"{os.path.abspath(checkpoint_path)}:{stat.st_size}:{stat.st_mtime_ns}:{torch.__version__}:{transformers.__version__}:{options}".encode("utf-8")).hexdigest()[:16]
+    base_name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    return os.path.join(cache_dir, f"{base_name}.{key}.{optimization}.pt")
+
+def max_difference(expected, actual):
+    return (expected.float() - actual.float()).abs().max().item()
+
+def optimize_module(module, optimization, example_inputs, validation_inputs, cache_path=None, name=None):
+    """
+    Optimize a module taking tensors and returning a tensor: trace it with TorchScript, or compile it with
+    torch.compile (with dynamic shapes). The result is checked against the eager module on validation inputs
+    of a different shape than the tracing ones; if it differs, the eager module is kept.
+    The TorchScript graphs are saved in cache_path, to be loaded by the next starts (see load_cached_graph).
+
+    Args:
+        module (torch.nn.Module): The eager module, in evaluation mode.
+        optimization (str): 'torchscript' or 'compile'.
+        example_inputs (tuple): The inputs traced (TorchScript) or compiled first.
+        validation_inputs (tuple): The inputs of the validation.
+        cache_path (str or None): Where to save the TorchScript graph.
+        name (str or None): A readable name of the module, for the logs.
+
+    Returns:
+        torch.nn.Module: The optimized module, or the eager one if the optimization failed.
+    """
+    if optimization not in GRAPH_OPTIMIZATIONS:
+        raise ValueError(f"Invalid graph optimization: {optimization}. Expected one of: {GRAPH_OPTIMIZATIONS}")
+    name = name or type(module).__name__
+    try:
+        with torch.no_grad():
+            expected = module(*validation_inputs)
+            if optimization == "torchscript":
+                optimized = torch.jit.trace(module, example_inputs, check_trace=False)
+            else:
+                optimized = torch.compile(module, dynamic=True)
+                optimized(*example_inputs)
+            difference = max_difference(expected, optimized(*validation_inputs))
+    except Exception as e:
+        logger.warning(f"Could not optimize {name} with {optimization}, running it eagerly: {e}")
+        return module
+    if difference > VALIDATION_ATOL:
+        logger.warning(f"{optimization} graph of {name} differs from the eager model (max abs difference {difference:.2e} > {VALIDATION_ATOL:.0e}): running it eagerly")
+        return module
+
+    logger.info(f"Optimized {name} with {optimization} (max abs difference {difference:.2e})")
+    if optimization == "torchscript" and cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Written under a temporary name, so that concurrent starts never load a partial graph
+        torch.jit.save(optimized, cache_path + f".{os.getpid()}.tmp")
+        os.replace(cache_path + f".{os.getpid()}.tmp", cache_path)
+    return optimized
+
+def load_cached_graph(cache_path, device):
+    """
+    Load a TorchScript graph saved by optimize_module. None if there is none.
+    """
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+    try:
+        return torch.jit.load(cache_path, map_location=device).eval()
+    except Exception as e:
+        logger.warning(f"Ignoring the cached graph {cache_path}: {e}")
+        return None
+
+def configure_compile_cache(cache_dir):
+    """
+    Keep the kernels generated by torch.compile (Inductor) in cache_dir, so that the next starts reuse them.
+    """
+    if cache_dir is not None:
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
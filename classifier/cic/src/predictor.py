@@ -1,15 +1,85 @@
 from cic.src.binary_classifiers import *
 from cic.src.data_processor import *
+from cic.src.batching import schedule_batches, padding_counts
+from cic.src.checkpoints import load_weights
+from cic.src.ensemble_pool import EnsemblePool
+from cic.src.graph_optimization import GRAPH_OPTIMIZATIONS, graph_cache_path, load_cached_graph, optimize_module, configure_compile_cache
+import logging
 from tqdm import tqdm
+import copy
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Models of each ensemble, in the order of their checkpoints
+MEMBER_NAMES = ["met", "bkg", "res"]
+# Ensembles of each branch, in the order of their probabilities in the result rows
+MODEL_NAMES = ["SciBERT", "XLNet"]
+
+def cascade_exits(scibert_probabilities, threshold):
+    """
+    First stage of the cascade mode: decide which contexts the SciBERT ensemble classifies on its own.
+    A context exits early when the model of one class is confident (positive probability >= threshold)
+    and the other two are not: its probability is at least threshold of the sum of the three. The normalized
+    probabilities then stand for the metaclassifier probabilities, so that thresholds >= 0.9 only exit
+    contexts whose final prediction is not UNRELIABLE.
+
+    Args:
+        scibert_probabilities (torch.Tensor): (N, 3) positive probabilities of the method, background and result models.
+        threshold (float): Confidence required to exit early.
+
+    Returns:
+        tuple: A (N,) boolean tensor of the early exits and the (N, 3) normalized probabilities.
+    """
+    probabilities = scibert_probabilities / scibert_probabilities.sum(dim=1, keepdim=True).clamp_min(1e-12)
+    top_positive, _ = scibert_probabilities.max(dim=1)
+    top_share, _ = probabilities.max(dim=1)
+    return (top_positive >= threshold) & (top_share >= threshold), probabilities
+
+def final_prediction_string(prediction_integer, metaclassifier_probabilities):
+    """
+    Label of the final prediction: the predicted class, or UNRELIABLE when no metaclassifier probability reaches 0.9.
+    """
+    # New threshold based on metaclassifier probabilities
+    if metaclassifier_probabilities[0] >= 0.9 or metaclassifier_probabilities[1] >= 0.9 or metaclassifier_probabilities[2] >= 0.9:
+        if prediction_integer == 0:
+            return "usesMethodIn (METHOD)"
+        elif prediction_integer == 1:
+            return "obtainsBackgroundFrom (BACKGROUND)"
+        elif prediction_integer == 2:
+            return "usesConclusionsFrom (RESULT)"
+    else:
+        return "citesForInformation (UNRELIABLE)"
+
 
 class Predictor:
-    def __init__(self, case, model_1_ckp, model_2_ckp, SECTIONS_binaryCLS_state_dict_paths_list, NO_SECTIONS_binaryCLS_state_dict_paths_list, SECTIONS_metaclassifier_state_dict_path, NO_SECTIONS_metaclassifier_state_dict_path, data=None, temporary_data=None, from_json=False):
+    def __init__(self, case, model_1_ckp, model_2_ckp, SECTIONS_binaryCLS_state_dict_paths_list, NO_SECTIONS_binaryCLS_state_dict_paths_list, SECTIONS_metaclassifier_state_dict_path, NO_SECTIONS_metaclassifier_state_dict_path, data=None, temporary_data=None, from_json=False, batch_size=32, max_batch_tokens=None, sort_by_length=True, result_cache=None, quantization=None, quantized_cache_dir=None, backend="torch", concurrent_members=0, threads_per_member=None, base_cache_dir=None, ensemble_pool=None, cascade_threshold=None, graph_optimization=None, graph_cache_dir=None, warmup_shapes=None):
         self.valid_cases = ["WS", "WoS", "M"]
         if case not in self.valid_cases:
             raise ValueError(f"Invalid case: {case}. Expected one of: {self.valid_cases}")
         self.case = case
         self.model_1_ckp = model_1_ckp
         self.model_2_ckp = model_2_ckp
+        self.quantization = quantization
+        self.quantized_cache_dir = quantized_cache_dir
+        self.backend = backend
+        self.base_cache_dir = base_cache_dir
+        if graph_optimization is not None and graph_optimization not in GRAPH_OPTIMIZATIONS:
+            raise ValueError(f"Invalid graph optimization: {graph_optimization}. Expected one of: {GRAPH_OPTIMIZATIONS}")
+        self.graph_optimization = graph_optimization
+        self.graph_cache_dir = graph_cache_dir
+        if graph_optimization == "compile":
+            configure_compile_cache(graph_cache_dir)
+        # (batch size, sequence length) shapes run through each ensemble once loaded (see EnsembleClassifier.warmup)
+        self.warmup_shapes = warmup_shapes or []
+        if cascade_threshold is not None and not 0 < cascade_threshold <= 1:
+            raise ValueError(f"Invalid cascade threshold: {cascade_threshold}. Expected a value in (0, 1]")
+        # Confidence of the SciBERT ensemble above which XLNet and the metaclassifier are skipped (None runs them on every context)
+        self.cascade_threshold = cascade_threshold
         self.device = self.retrieve_device()
         self.SECTIONS_binaryCLS_state_dict_paths_list = SECTIONS_binaryCLS_state_dict_paths_list
         self.NO_SECTIONS_binaryCLS_state_dict_paths_list = NO_SECTIONS_binaryCLS_state_dict_paths_list
@@ -18,89 +88,208 @@ class Predictor:
         self.from_json = from_json
         self.data = None
         self.temporary_dict = None
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.sort_by_length = sort_by_length
+        self.padding_stats = {}
+        self.context_results = {}
+        self.reset_stage_stats()
+        self.result_cache = result_cache
+        self.member_executor = self.create_member_executor(concurrent_members, threads_per_member)
+        # Without a shared pool the ensembles are only shared by the shallow copies of this Predictor
+        self.ensemble_pool = ensemble_pool if ensemble_pool is not None else EnsemblePool()
         self.initialize_classifiers()
 
     def set_data(self, data, temporary_data, from_json=False):
         self.from_json = from_json
         self.temporary_dict = temporary_data
-        self.data = DataProcessor(data, self.from_json).data if self.from_json else DataProcessor(data, self.from_json).mapped_data
+        self.padding_stats = {}
+        with self.timed("validation"):
+            self.data = DataProcessor(data, self.from_json).data if self.from_json else DataProcessor(data, self.from_json).mapped_data
+
+    def shallow_copy(self):
+        """
+        Return a Predictor sharing the already loaded models, but with its own data state.
+        Used to serve concurrent requests with the same resident models.
+        The results of the contexts classified by the copy (context_results) are kept across
+        its set_data calls, so identical contexts in different files of a request run once.
+        """
+        predictor = copy.copy(self)
+        predictor.data = None
+        predictor.temporary_dict = None
+        predictor.from_json = False
+        predictor.padding_stats = {}
+        predictor.context_results = {}
+        predictor.reset_stage_stats()
+        return predictor
+
+    def reset_stage_stats(self):
+        """
+        Start a new record of the time spent in each stage of the pipeline, of the sizes of the
+        batches run through each family of models and of the number of contexts classified
+        (and, in cascade mode, decided by SciBERT alone).
+        """
+        self.stage_times = {}
+        self.batch_sizes = {}
+        self.classified_contexts = 0
+        self.early_exits = 0
+
+    def take_stage_stats(self):
+        """
+        Return the stage statistics recorded since the last call (or since set_data was first called) and reset them.
+
+        Returns:
+            dict: 'Stage times' (seconds per stage), 'Batch sizes' (list per model family), 'Classified contexts'
+                  and 'Early exits'.
+        """
+        stats = {"Stage times": self.stage_times, "Batch sizes": self.batch_sizes, "Classified contexts": self.classified_contexts, "Early exits": self.early_exits}
+        self.reset_stage_stats()
+        return stats
+
+    def add_stage_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Add the time spent in the block to the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, time.perf_counter() - start)
+
+    def clear_context_results(self):
+        """
+        Forget the results of the contexts classified so far, to bound the memory of long-lived
+        copies (e.g. streams); the result cache, if enabled, still holds them.
+        """
+        self.context_results = {}
 
     def initialize_classifiers(self):
+        """
+        Load the metaclassifiers of the case. The binary classifier ensembles of each branch
+        are loaded on first use, through the ensemble pool (see branch_ensembles).
+        """
         if self.case == self.valid_cases[0]:
-            # Model 1
-            self.binary_classifier_SciBERT = EnsembleClassifier(
-                self.model_1_ckp,
-                self.SECTIONS_binaryCLS_state_dict_paths_list[0], # List for SciBERT (contains the 3 scibert models)
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-            # Model 2
-            self.binary_classifier_XLNet = EnsembleClassifier(
-                self.model_2_ckp,
-                self.SECTIONS_binaryCLS_state_dict_paths_list[1], # List for XLNet (contains the 3 xlnet models)
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
             # Metaclassifier
             self.metaclassifier = self.load_metaclassifier()
+            self.branch_checkpoints = {"SECTIONS": self.SECTIONS_binaryCLS_state_dict_paths_list}
+            self.branch_metaclassifiers = {"SECTIONS": self.metaclassifier}
 
         elif self.case == self.valid_cases[1]:
-            # Model 1
-            self.binary_classifier_SciBERT = EnsembleClassifier(
-                self.model_1_ckp,
-                self.NO_SECTIONS_binaryCLS_state_dict_paths_list[0], # List for SciBERT (contains the 3 scibert models)
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-            # Model 2
-            self.binary_classifier_XLNet = EnsembleClassifier(
-                self.model_2_ckp,
-                self.NO_SECTIONS_binaryCLS_state_dict_paths_list[1], # List for XLNet (contains the 3 xlnet models)
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
             # Metaclassifier
             self.metaclassifier = self.load_metaclassifier()
+            self.branch_checkpoints = {"NO-SECTIONS": self.NO_SECTIONS_binaryCLS_state_dict_paths_list}
+            self.branch_metaclassifiers = {"NO-SECTIONS": self.metaclassifier}
 
         elif self.case == self.valid_cases[2]:
-            # SECTIONS BINARY MODELS
-            self.sections_binary_classifier_SciBERT = EnsembleClassifier(
-                self.model_1_ckp,
-                self.SECTIONS_binaryCLS_state_dict_paths_list[0],
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-            self.sections_binary_classifier_XLNet = EnsembleClassifier(
-                self.model_2_ckp,
-                self.SECTIONS_binaryCLS_state_dict_paths_list[1],
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-
-            # NO-SECTIONS BINARY MODELS
-            self.no_sections_binary_classifier_SciBERT = EnsembleClassifier(
-                self.model_1_ckp,
-                self.NO_SECTIONS_binaryCLS_state_dict_paths_list[0],
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-            self.no_sections_binary_classifier_XLNet = EnsembleClassifier(
-                self.model_2_ckp,
-                self.NO_SECTIONS_binaryCLS_state_dict_paths_list[1],
-                {0: "no", 1: "yes"},
-                {"no": 0, "yes": 1}
-            )
-            
             # METACLASSIFIERS
             self.metaclassifiers = self.load_metaclassifier()
             self.metaclassifier_sections = self.metaclassifiers[0]
             self.metaclassifier_no_sections = self.metaclassifiers[1]
+            # Same checkpoints as the WS and WoS cases: the ensembles are shared with them in the pool
+            self.branch_checkpoints = {
+                "SECTIONS": self.SECTIONS_binaryCLS_state_dict_paths_list,
+                "NO-SECTIONS": self.NO_SECTIONS_binaryCLS_state_dict_paths_list
+            }
+            self.branch_metaclassifiers = {
+                "SECTIONS": self.metaclassifier_sections,
+                "NO-SECTIONS": self.metaclassifier_no_sections
+            }
+
+    def ensemble_key(self, branch):
+        """
+        Key of the ensembles of a branch in the pool: their checkpoints and loading options.
+        """
+        scibert_paths, xlnet_paths = self.branch_checkpoints[branch]
+        return (self.model_1_ckp, tuple(scibert_paths), self.model_2_ckp, tuple(xlnet_paths), self.quantization, self.backend, self.graph_optimization)
+
+    def branch_ensembles(self, branch):
+        """
+        Return the (SciBERT, XLNet) ensembles of a branch, loading them into the pool on first use.
+        """
+        scibert_paths, xlnet_paths = self.branch_checkpoints[branch]
+        name = {"SECTIONS": "WS", "NO-SECTIONS": "WoS"}[branch]
+        options = [option for option in (self.quantization, self.backend if self.backend != "torch" else None, self.graph_optimization) if option]
+        if options:
+            name = f"{name} ({', '.join(options)})"
+        return self.ensemble_pool.get(
+            self.ensemble_key(branch),
+            lambda: (
+                self.build_ensemble(self.model_1_ckp, scibert_paths), # List for SciBERT (contains the 3 scibert models)
+                self.build_ensemble(self.model_2_ckp, xlnet_paths) # List for XLNet (contains the 3 xlnet models)
+            ),
+            name=name
+        )
+
+    def load_branches(self):
+        """
+        Load the ensembles of all the branches of the case, instead of waiting for their first use.
+        """
+        for branch in self.branch_checkpoints:
+            self.branch_ensembles(branch)
+
+    def release_ensembles(self):
+        """
+        Drop the ensembles of the branches of the case from the pool (also for the other cases sharing them).
+        """
+        for branch in self.branch_checkpoints:
+            self.ensemble_pool.evict(self.ensemble_key(branch))
+
+    def create_member_executor(self, concurrent_members, threads_per_member=None):
+        """
+        Create the thread pool running the members of the ensembles at the same time
+        (None if concurrent_members < 2: members then run one after the other).
+
+        Each worker thread sets its own number of torch intra-op threads, so that the cores
+        are split between the members: by default the CPUs are divided evenly among them.
+        The pool is shared by the shallow copies of the predictor and its threads are only
+        started by the first request.
+        """
+        if concurrent_members < 2:
+            return None
+        if threads_per_member is None:
+            threads_per_member = max(1, (os.cpu_count() or 1) // concurrent_members)
+        logger.info(f"Running up to {concurrent_members} ensemble members concurrently with {threads_per_member} threads each")
+        return ThreadPoolExecutor(
+            max_workers=concurrent_members,
+            thread_name_prefix="ensemble-member",
+            initializer=torch.set_num_threads,
+            initargs=(threads_per_member,)
+        )
+
+    def build_ensemble(self, model_ckp, state_dict_paths_list):
+        """
+        Load the method, background and result models of an ensemble, and warm them up.
+        """
+        ensemble = EnsembleClassifier(
+            model_ckp,
+            state_dict_paths_list,
+            {0: "no", 1: "yes"},
+            {"no": 0, "yes": 1},
+            quantize=self.quantization == "int8",
+            quantized_cache_dir=self.quantized_cache_dir,
+            backend=self.backend,
+            base_cache_dir=self.base_cache_dir,
+            graph_optimization=self.graph_optimization,
+            graph_cache_dir=self.graph_cache_dir
+        )
+        if self.warmup_shapes:
+            start = time.perf_counter()
+            ensemble.warmup(self.warmup_shapes)
+            logger.info(f"Ensemble {model_ckp} warmed up in {time.perf_counter() - start:.2f}s")
+        return ensemble
 
     def retrieve_device(self):
         """
         Retrieve the device on which to run the model.
+        Quantized and ONNX models only run on CPU.
         """
-        if torch.cuda.is_available():
+        if self.quantization == "int8" or self.backend == "onnx":
+            device = torch.device("cpu")
+        elif torch.cuda.is_available():
             device = torch.device("cuda")
         elif torch.backends.mps.is_available():
             device = torch.device("mps")
@@ -113,17 +302,11 @@ class Predictor:
         Load the metaclassifier model (compat: accetta sia checkpoint wrappati con 'model_state_dict' sia state_dict puri)
         """
         def _load_into(model, ckpt_path):
-            checkpoint = torch.load(ckpt_path, map_location=self.device)  # weights_only=False di default
-            # Usa la stessa logica dell'eval in training
-            if isinstance(checkpoint, dict) and "model_state_dict" in checkpoint:
-                state = checkpoint["model_state_dict"]
-            else:
-                state = checkpoint
-            # (opzionale ma utile) gestisci il caso DataParallel: rimuovi 'module.' se presente
-            if isinstance(state, dict) and any(k.startswith("module.") for k in state.keys()):
-                state = {k[len("module."):] if k.startswith("module.") else k: v for k, v in state.items()}
-            model.load_state_dict(state)     # strict=True default
-            return model.to(self.device).eval()
+            # Wrapped checkpoints and 'module.' prefixes are handled by load_checkpoint (see checkpoints.py);
+            # a '.safetensors' copy of the checkpoint is memory-mapped
+            if self.graph_optimization is None:
+                return load_weights(model, ckpt_path, self.device)
+            return self.load_optimized_metaclassifier(model, ckpt_path)
 
         if self.case != "M":
             if self.case == "WS":
@@ -143,128 +326,334 @@ class Predictor:
 
 
 
-    def tokenize(self):
-        if self.case != "M":
-            if self.case == "WS":
-                for datapoint in self.data:
-                    context = self.data[datapoint]['SECTION'] + ". " + self.data[datapoint]['CITATION']
-                    self.data[datapoint]['tokenized_SciBERT'] = self.binary_classifier_SciBERT.tokenizer(context, return_tensors="pt")
-                    self.data[datapoint]['tokenized_XLNet'] = self.binary_classifier_XLNet.tokenizer(context, return_tensors="pt")
-            elif self.case == "WoS":
-                for datapoint in self.data:
-                    context = self.data[datapoint]['CITATION']
-                    self.data[datapoint]['tokenized_SciBERT'] = self.binary_classifier_SciBERT.tokenizer(context, return_tensors="pt")
-                    self.data[datapoint]['tokenized_XLNet'] = self.binary_classifier_XLNet.tokenizer(context, return_tensors="pt")
-        else:
-            for datapoint in self.data:
-                if self.data[datapoint]['SECTION'] == "":
-                    context = self.data[datapoint]['CITATION']
-                    self.data[datapoint]['tokenized_SciBERT'] = self.no_sections_binary_classifier_SciBERT.tokenizer(context, return_tensors="pt")
-                    self.data[datapoint]['tokenized_XLNet'] = self.no_sections_binary_classifier_XLNet.tokenizer(context, return_tensors="pt")
+    def load_optimized_metaclassifier(self, model, ckpt_path):
+        """
+        Load a metaclassifier optimized with TorchScript or torch.compile, from the graph cached by an earlier start if any.
+        """
+        cache_path = None
+        if self.graph_optimization == "torchscript":
+            cache_path = graph_cache_path(self.graph_cache_dir, ckpt_path, self.graph_optimization, self.device.type)
+            cached = load_cached_graph(cache_path, self.device)
+            if cached is not None:
+                return cached
+        model = load_weights(model, ckpt_path, self.device)
+        # Rows of 6 probabilities, in batches of different sizes for the tracing and the validation
+        generator = torch.Generator().manual_seed(0)
+        example_inputs = (torch.rand(4, 6, generator=generator).to(self.device),)
+        validation_inputs = (torch.rand(7, 6, generator=generator).to(self.device),)
+        return optimize_module(model, self.graph_optimization, example_inputs, validation_inputs, cache_path=cache_path, name=os.path.basename(ckpt_path))
+
+    def datapoint_branch(self, datapoint):
+        """
+        Return the branch of models ('SECTIONS' or 'NO-SECTIONS') that classifies the datapoint.
+        """
+        if self.case == "WS":
+            return "SECTIONS"
+        elif self.case == "WoS":
+            return "NO-SECTIONS"
+        return "NO-SECTIONS" if datapoint['SECTION'] == "" else "SECTIONS"
+
+    def datapoint_context(self, datapoint):
+        """
+        Return the text given in input to the binary classifiers for the datapoint.
+        """
+        if self.datapoint_branch(datapoint) == "NO-SECTIONS":
+            return datapoint['CITATION']
+        return datapoint['SECTION'] + ". " + datapoint['CITATION']
+
+    def context_key(self, branch, context):
+        """
+        Hash identifying the input of a branch of models. Datapoints with the same key get the same predictions.
+        """
+        return hashlib.sha256(f"{branch}\n{context}".encode("utf-8")).hexdigest()
+
+    def group_contexts(self, datasets):
+        """
+        Map each datapoint of the datasets (processed data dictionaries, like self.data) to the key
+        of its context and collect, per branch, the unique contexts not classified yet by this Predictor.
+
+        CONTEXTS FORMAT:
+        {
+            'SECTIONS': {
+                'keys': [key_1, key_2, ...],
+                'contexts': [context_1, context_2, ...]
+            },
+            ...
+        }
+
+        Returns:
+            tuple: (datapoint_keys, contexts), where datapoint_keys holds, for each dataset,
+                   a dictionary mapping each datapoint id to its context key.
+        """
+        datapoint_keys = []
+        contexts = {}
+        queued_keys = set()
+        for data in datasets:
+            dataset_keys = {}
+            for datapoint in data:
+                branch = self.datapoint_branch(data[datapoint])
+                context = self.datapoint_context(data[datapoint])
+                key = self.context_key(branch, context)
+                dataset_keys[datapoint] = key
+                if key in self.context_results or key in queued_keys:
+                    continue
+                queued_keys.add(key)
+                if branch not in contexts:
+                    contexts[branch] = {'keys': [], 'contexts': []}
+                contexts[branch]['keys'].append(key)
+                contexts[branch]['contexts'].append(context)
+            datapoint_keys.append(dataset_keys)
+        return datapoint_keys, contexts
+
+    def cache_namespace(self):
+        """
+        Mode under which results are cached: backends, quantization and graph optimizations give slightly
+        different probabilities, and the contexts exiting early in cascade mode have no XLNet probabilities.
+        """
+        namespace = f"{self.case}:{self.backend}:{self.quantization or 'fp32'}"
+        if self.graph_optimization is not None:
+            namespace += f":{self.graph_optimization}"
+        if self.cascade_threshold is not None:
+            namespace += f":cascade{self.cascade_threshold}"
+        return namespace
+
+    def load_cached_results(self, contexts):
+        """
+        Fill context_results with the results found in the result cache.
+
+        Returns:
+            dict: The contexts still to be classified, in the same format as group_contexts.
+        """
+        keys = [key for branch_data in contexts.values() for key in branch_data['keys']]
+        cached_results = self.result_cache.get_many(self.cache_namespace(), keys)
+        self.context_results.update(cached_results)
+
+        remaining_contexts = {}
+        for branch, branch_data in contexts.items():
+            for key, context in zip(branch_data['keys'], branch_data['contexts']):
+                if key in cached_results:
+                    continue
+                if branch not in remaining_contexts:
+                    remaining_contexts[branch] = {'keys': [], 'contexts': []}
+                remaining_contexts[branch]['keys'].append(key)
+                remaining_contexts[branch]['contexts'].append(context)
+        return remaining_contexts
+
+    def tokenize(self, contexts, model_names=MODEL_NAMES):
+        """
+        Tokenize the contexts, grouped by branch, for the given families of models.
+        Sequences are not padded here: padding is applied per batch in binary_predictions.
+
+        TOKENIZED DATA FORMAT:
+        {
+            'SECTIONS': {
+                'keys': [key_1, key_2, ...],
+                'tokenized_SciBERT': [encoding_1, encoding_2, ...],
+                'tokenized_XLNet': [encoding_1, encoding_2, ...]
+            },
+            ...
+        }
+        """
+        tokenized = {}
+        for branch, branch_data in contexts.items():
+            ensembles = dict(zip(MODEL_NAMES, self.branch_ensembles(branch)))
+            with self.timed("tokenization"):
+                tokenized[branch] = {'keys': branch_data['keys']}
+                for model_name in model_names:
+                    encodings = ensembles[model_name].tokenizer(branch_data['contexts'])
+                    tokenized[branch][f'tokenized_{model_name}'] = [{key: encodings[key][i] for key in encodings} for i in range(len(branch_data['keys']))]
+        return tokenized
+
+    def ensemble_predictions(self, binary_classifier, encodings, model_name):
+        """
+        Run the method, background and result models of an ensemble on batches of encodings.
+        Encodings are bucketed by length (see schedule_batches) and each batch is padded
+        to its longest member only. Outputs are returned in the order of the encodings.
+
+        Returns:
+            torch.Tensor: A (N, 3) tensor with the positive probability of each model, for each encoding.
+        """
+        batches = self.schedule(encodings, model_name)
+        outputs = [None] * len(encodings)
+        member_times = [0.0] * len(binary_classifier.backends)
+        for batch in tqdm(batches):
+            # Positive method, background and result probabilities
+            batch_out = binary_classifier.predict([encodings[i] for i in batch], member_times)
+            for row, i in enumerate(batch):
+                outputs[i] = batch_out[row]
+        for member, seconds in enumerate(member_times):
+            self.add_stage_time(f"forward {model_name} {MEMBER_NAMES[member]}", seconds)
+        if not outputs:
+            return torch.empty((0, 3), device=self.device)
+        return torch.stack(outputs)
+
+    def submit_members(self, binary_classifier, encodings, model_name):
+        """
+        Submit the method, background and result models of an ensemble to the member thread pool.
+        Each member runs all the batches of the encodings on its own.
+
+        Returns:
+            list: One future per member, resolving to a (N,) tensor of positive probabilities in the order of the encodings
+                  and the time spent running the member (see collect_members).
+        """
+        batches = self.schedule(encodings, model_name)
+        return [self.member_executor.submit(self.member_predictions, binary_classifier, member, encodings, batches) for member in range(len(binary_classifier.backends))]
+
+    def member_predictions(self, binary_classifier, member, encodings, batches):
+        """
+        Run a single member of an ensemble on the scheduled batches (executed by the member thread pool).
+        """
+        start = time.perf_counter()
+        outputs = torch.empty(len(encodings), device=self.device)
+        # Gradient mode is thread-local
+        with torch.no_grad():
+            for batch in batches:
+                outputs[batch] = binary_classifier.predict_member(member, [encodings[i] for i in batch]).to(self.device)
+        return outputs, time.perf_counter() - start
+
+    def collect_members(self, futures, model_name):
+        """
+        Wait for the members submitted by submit_members and record their time (in the calling thread).
+
+        Returns:
+            torch.Tensor: A (N, 3) tensor with the positive probability of each member, for each encoding.
+        """
+        outputs = []
+        for member, future in enumerate(futures):
+            member_outputs, seconds = future.result()
+            self.add_stage_time(f"forward {model_name} {MEMBER_NAMES[member]}", seconds)
+            outputs.append(member_outputs)
+        return torch.stack(outputs, dim=1)
+
+    def schedule(self, encodings, model_name):
+        """
+        Form the batches of a list of encodings (see schedule_batches) and record their padding.
+        """
+        lengths = [len(encoding['input_ids']) for encoding in encodings]
+        batches = schedule_batches(lengths, self.batch_size, self.max_batch_tokens, self.sort_by_length)
+        self.update_padding_stats(model_name, lengths, batches)
+        self.batch_sizes.setdefault(model_name, []).extend(len(batch) for batch in batches)
+        return batches
+
+    def update_padding_stats(self, model_name, lengths, batches):
+        """
+        Accumulate, per tokenizer, the real and padded tokens of the scheduled batches.
+        The padding efficiency is the ratio between real and padded tokens (1.0 means no padding).
+        """
+        real_tokens, padded_tokens = padding_counts(lengths, batches)
+        stats = self.padding_stats.setdefault(model_name, {"Batches": 0, "Real tokens": 0, "Padded tokens": 0, "Padding efficiency": 1.0})
+        stats["Batches"] += len(batches)
+        stats["Real tokens"] += real_tokens
+        stats["Padded tokens"] += padded_tokens
+        if stats["Padded tokens"]:
+            stats["Padding efficiency"] = stats["Real tokens"] / stats["Padded tokens"]
+
+    def run_ensembles(self, tokenized, model_names=MODEL_NAMES):
+        """
+        Run the ensembles of the given families of models on the tokenized contexts of each branch.
+        With the member thread pool, all the members of all the branches are submitted before waiting for any of them.
+
+        Returns:
+            dict: For each branch, one (N, 3) tensor of positive probabilities per family of models.
+        """
+        outputs = {}
+        with torch.no_grad():
+            for branch, branch_data in tokenized.items():
+                ensembles = dict(zip(MODEL_NAMES, self.branch_ensembles(branch)))
+                if self.member_executor is None:
+                    outputs[branch] = [self.ensemble_predictions(ensembles[model_name], branch_data[f'tokenized_{model_name}'], model_name) for model_name in model_names]
                 else:
-                    context = self.data[datapoint]['SECTION'] + ". " + self.data[datapoint]['CITATION']
-                    self.data[datapoint]['tokenized_SciBERT'] = self.no_sections_binary_classifier_SciBERT.tokenizer(context, return_tensors="pt")
-                    self.data[datapoint]['tokenized_XLNet'] = self.no_sections_binary_classifier_XLNet.tokenizer(context, return_tensors="pt")
-        return self.data
+                    outputs[branch] = [self.submit_members(ensembles[model_name], branch_data[f'tokenized_{model_name}'], model_name) for model_name in model_names]
 
-    def binary_predictions(self):
-        self.data = self.tokenize()
+            if self.member_executor is not None:
+                for branch, futures in outputs.items():
+                    outputs[branch] = [self.collect_members(model_futures, model_name) for model_futures, model_name in zip(futures, model_names)]
+        return outputs
 
-        if self.case != "M":
-            # SciBERT
-            scibert_model1 = self.binary_classifier_SciBERT.method_model.to(self.device).eval()
-            scibert_model2 = self.binary_classifier_SciBERT.background_model.to(self.device).eval()
-            scibert_model3 = self.binary_classifier_SciBERT.result_model.to(self.device).eval()
-            # XLNet
-            xlnet_model1 = self.binary_classifier_XLNet.method_model.to(self.device).eval()
-            xlnet_model2 = self.binary_classifier_XLNet.background_model.to(self.device).eval()
-            xlnet_model3 = self.binary_classifier_XLNet.result_model.to(self.device).eval()
-
-            all_predictions = {}
-
-            with torch.no_grad():
-                for datapoint in tqdm(self.data):
-                    # SciBERT Predictions
-                    scibert_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_SciBERT'].items()}
-                    scibert_out1 = torch.softmax(scibert_model1(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                    scibert_out2 = torch.softmax(scibert_model2(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                    scibert_out3 = torch.softmax(scibert_model3(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-                    # XLNet Predictions
-                    xlnet_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_XLNet'].items()}
-                    xlnet_out1 = torch.softmax(xlnet_model1(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                    xlnet_out2 = torch.softmax(xlnet_model2(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                    xlnet_out3 = torch.softmax(xlnet_model3(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-
-                    # The positive probabilities predicted for each class, for each model, are concatenated
-                    out = torch.cat([scibert_out1, scibert_out2, scibert_out3, 
-                                    xlnet_out1, xlnet_out2, xlnet_out3], dim=0).squeeze()
-                                        
-                    all_predictions[datapoint] = out
+    def log_padding_stats(self):
+        for model_name, stats in self.padding_stats.items():
+            logger.info(f"{model_name} padding efficiency: {stats['Padding efficiency']:.3f} ({stats['Real tokens']} real / {stats['Padded tokens']} padded tokens in {stats['Batches']} batches)")
 
-        else:
-            # SECTIONS MODELS
-            scibert_model1_sections = self.sections_binary_classifier_SciBERT.method_model.to(self.device).eval()
-            scibert_model2_sections = self.sections_binary_classifier_SciBERT.background_model.to(self.device).eval()
-            scibert_model3_sections = self.sections_binary_classifier_SciBERT.result_model.to(self.device).eval()
-
-            xlnet_model1_sections = self.sections_binary_classifier_XLNet.method_model.to(self.device).eval()
-            xlnet_model2_sections = self.sections_binary_classifier_XLNet.background_model.to(self.device).eval()
-            xlnet_model3_sections = self.sections_binary_classifier_XLNet.result_model.to(self.device).eval()
-
-            # NO SECTIONS MODELS
-            scibert_model1_no_sections = self.no_sections_binary_classifier_SciBERT.method_model.to(self.device).eval()
-            scibert_model2_no_sections = self.no_sections_binary_classifier_SciBERT.background_model.to(self.device).eval()
-            scibert_model3_no_sections = self.no_sections_binary_classifier_SciBERT.result_model.to(self.device).eval()
-
-            xlnet_model1_no_sections = self.no_sections_binary_classifier_XLNet.method_model.to(self.device).eval()
-            xlnet_model2_no_sections = self.no_sections_binary_classifier_XLNet.background_model.to(self.device).eval()
-            xlnet_model3_no_sections = self.no_sections_binary_classifier_XLNet.result_model.to(self.device).eval()
-
-            all_predictions = {
-                "NO-SECTIONS": {},
-                "SECTIONS": {}
+    def binary_predictions(self, contexts):
+        """
+        Run the binary classifiers of each branch on the contexts.
+
+        PREDICTIONS FORMAT:
+        {
+            'SECTIONS': {
+                'keys': [key_1, key_2, ...],
+                'probabilities': tensor of shape (N, 6)
+            },
+            ...
+        }
+        """
+        tokenized = self.tokenize(contexts)
+        outputs = self.run_ensembles(tokenized)
+
+        all_predictions = {}
+        for branch, (scibert_out, xlnet_out) in outputs.items():
+            # The positive probabilities predicted for each class, for each model, are concatenated
+            all_predictions[branch] = {
+                'keys': tokenized[branch]['keys'],
+                'probabilities': torch.cat([scibert_out, xlnet_out], dim=1)
             }
 
-            with torch.no_grad():
-                for datapoint in tqdm(self.data):
-                    if self.data[datapoint]['SECTION'] == "": # NO SECTIONS case
-                        # SciBERT Predictions
-                        scibert_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_SciBERT'].items()}
-                        scibert_out1 = torch.softmax(scibert_model1_no_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                        scibert_out2 = torch.softmax(scibert_model2_no_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                        scibert_out3 = torch.softmax(scibert_model3_no_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-                        # XLNet Predictions
-                        xlnet_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_XLNet'].items()}
-                        xlnet_out1 = torch.softmax(xlnet_model1_no_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                        xlnet_out2 = torch.softmax(xlnet_model2_no_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                        xlnet_out3 = torch.softmax(xlnet_model3_no_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-
-                        # The positive probabilities predicted for each class, for each model, are concatenated
-                        out = torch.cat([scibert_out1, scibert_out2, scibert_out3, 
-                                        xlnet_out1, xlnet_out2, xlnet_out3], dim=0).squeeze()
-                        
-                        all_predictions['NO-SECTIONS'][datapoint] = out
-
-                    else: # With Section case
-                        # SciBERT Predictions
-                        scibert_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_SciBERT'].items()}
-                        scibert_out1 = torch.softmax(scibert_model1_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                        scibert_out2 = torch.softmax(scibert_model2_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                        scibert_out3 = torch.softmax(scibert_model3_sections(**scibert_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-                        # XLNet Predictions
-                        xlnet_input_data = {key: val.to(self.device) for key, val in self.data[datapoint]['tokenized_XLNet'].items()}
-                        xlnet_out1 = torch.softmax(xlnet_model1_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive method
-                        xlnet_out2 = torch.softmax(xlnet_model2_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive background
-                        xlnet_out3 = torch.softmax(xlnet_model3_sections(**xlnet_input_data).logits, dim=-1)[:, 1].unsqueeze(0)  # Positive result
-
-                        # The positive probabilities predicted for each class, for each model, are concatenated
-                        out = torch.cat([scibert_out1, scibert_out2, scibert_out3, 
-                                        xlnet_out1, xlnet_out2, xlnet_out3], dim=0).squeeze()
-                        
-                        all_predictions['SECTIONS'][datapoint] = out
-
+        self.log_padding_stats()
         return all_predictions
 
+    def cascade_predictions(self, contexts):
+        """
+        Cascade mode: run the SciBERT ensemble of each branch on the contexts first. The confident
+        contexts (see cascade_exits) are decided on its probabilities alone; only the others are run
+        through the XLNet ensemble and then, as in binary_predictions, through the metaclassifier.
+
+        Returns:
+            tuple: The result rows of the early exits ({key: row}, with None in place of the XLNet
+                   probabilities) and the predictions of the other contexts, in the format of binary_predictions.
+        """
+        scibert_outputs = self.run_ensembles(self.tokenize(contexts, ["SciBERT"]), ["SciBERT"])
+
+        early_results = {}
+        remaining_contexts = {}
+        remaining_scibert = {}
+        for branch, (scibert_out,) in scibert_outputs.items():
+            exits, probabilities = cascade_exits(scibert_out, self.cascade_threshold)
+            predicted_classes = probabilities.argmax(dim=1, keepdim=True).to(scibert_out.dtype)
+            # 3 SciBERT probabilities, 3 first stage probabilities and the predicted class of each context
+            rows = torch.cat([scibert_out, probabilities, predicted_classes], dim=1).cpu().tolist()
+            for key, context, exit, row in zip(contexts[branch]['keys'], contexts[branch]['contexts'], exits.tolist(), rows):
+                if exit:
+                    # The XLNet ensemble is not run
+                    early_results[key] = row[:3] + [None, None, None] + row[3:]
+                else:
+                    remaining_contexts.setdefault(branch, {'keys': [], 'contexts': []})
+                    remaining_contexts[branch]['keys'].append(key)
+                    remaining_contexts[branch]['contexts'].append(context)
+            remaining_scibert[branch] = scibert_out[~exits]
+
+        self.early_exits += len(early_results)
+        logger.info(f"{len(early_results)} contexts decided by SciBERT alone (cascade threshold {self.cascade_threshold})")
+
+        all_predictions = {}
+        if remaining_contexts:
+            tokenized = self.tokenize(remaining_contexts, ["XLNet"])
+            for branch, (xlnet_out,) in self.run_ensembles(tokenized, ["XLNet"]).items():
+                all_predictions[branch] = {
+                    'keys': tokenized[branch]['keys'],
+                    'probabilities': torch.cat([remaining_scibert[branch], xlnet_out], dim=1)
+                }
+
+        self.log_padding_stats()
+        return early_results, all_predictions
+
+    def store_results(self, results):
+        """
+        Keep the result rows of classified contexts ({key: row}) in context_results and in the result cache.
+        """
+        self.context_results.update(results)
+        if self.result_cache is not None:
+            self.result_cache.put_many(self.cache_namespace(), results)
+
 
     def final_classification(self):
         """
@@ -272,118 +661,127 @@ class Predictor:
         0 == Method
         1 == Background
         2 == Result
+
+        Datapoints sharing the same context are classified once (see group_contexts).
+        The six positive probabilities of all the contexts of a branch are stacked in a
+        single (N, 6) matrix and classified by the metaclassifier in one forward pass.
+        """
+        datapoint_keys, contexts = self.group_contexts([self.data])
+        self.classify_contexts(contexts)
+        with self.timed("create_json"):
+            output_dict = self.create_json(datapoint_keys[0])
+        return output_dict  # return a new dictionary containing final predictions
+
+    def pool_classification(self, datasets):
         """
-        all_predictions = self.binary_predictions()
-        #print(all_predictions) #debug print
+        Classify together the contexts of several datasets (e.g. all the files of an archive),
+        so that small files share batches instead of leaving them mostly empty.
+        Results are kept in context_results: the final_classification of each dataset
+        then only builds its own output, keeping per-file provenance.
 
-        if self.case != "M":
-            final_predictions = {}
-            model = self.metaclassifier.to(self.device).eval()
-            with torch.no_grad():
-                for id, prediction in all_predictions.items():
-                    input_data = prediction.view(-1, prediction.numel()).to(self.device)  # Flatten the inputs and move to device
-                    # The .numel in pytorch returns the entire number of elements in a tensor
-
-                    # Inference
-                    output_probabilities = model(input_data) # It directly returns probabilities since the softmax has been applied in the model
+        Args:
+            datasets (list): Processed data dictionaries (like self.data), one per file.
+        """
+        _, contexts = self.group_contexts(datasets)
+        self.classify_contexts(contexts)
+
+    def coalesced_classification(self, predictors):
+        """
+        Classify together the data set on several Predictors sharing the models of this one
+        (e.g. concurrent requests of the same mode, see RequestCoalescer), then hand each of
+        them the results of its own contexts: their final_classification only builds the output.
 
-                    # Get the predicted class (0 - method, 1 - background, or 2 - result)
-                    _, predicted_class = torch.max(output_probabilities, 1)  # 1 = dimension over which to return the maximum
-                    final_predictions[id] = {'FinalPrediction': (predicted_class.item(), output_probabilities[0].tolist())}
+        Args:
+            predictors (list): Shallow copies of the same Predictor, with their data set.
+        """
+        datapoint_keys, contexts = self.group_contexts([predictor.data for predictor in predictors])
+        self.classify_contexts(contexts)
+        for predictor, dataset_keys in zip(predictors, datapoint_keys):
+            predictor.context_results.update({key: self.context_results[key] for key in dataset_keys.values()})
 
+    def classify_contexts(self, contexts):
+        """
+        Run the binary classifiers and the metaclassifier on the contexts (in the format of group_contexts)
+        and store the results in context_results. Each result row holds the 6 binary positive probabilities,
+        the 3 metaclassifier probabilities and the predicted class. In cascade mode, the contexts decided by
+        SciBERT alone have no XLNet probabilities (None) and the first stage probabilities in place of the
+        metaclassifier ones (see cascade_predictions).
+        """
+        if self.result_cache is not None:
+            contexts = self.load_cached_results(contexts)
+        new_contexts = sum(len(branch_data['keys']) for branch_data in contexts.values())
+        logger.info(f"{new_contexts} new unique contexts to classify")
+        self.classified_contexts += new_contexts
+        if self.cascade_threshold is None:
+            all_predictions = self.binary_predictions(contexts)
         else:
-            final_predictions = {
-                "NO-SECTIONS": {},
-                "SECTIONS": {}
-            }
-            sections_model = self.metaclassifier_sections.to(self.device).eval()
-            no_sections_model = self.metaclassifier_no_sections.to(self.device).eval()
-
-            with torch.no_grad():
-                for id, prediction in all_predictions['SECTIONS'].items():
-                    input_data = prediction.view(-1, prediction.numel()).to(self.device)
-                    output_probabilities = sections_model(input_data) # It directly returns probabilities since the softmax has been applied in the model
-                    _, predicted_class = torch.max(output_probabilities, 1)
-                    final_predictions['SECTIONS'][id] = {'FinalPrediction': (predicted_class.item(), output_probabilities[0].tolist())}
-
-                for id, prediction in all_predictions['NO-SECTIONS'].items():
-                    input_data = prediction.view(-1, prediction.numel()).to(self.device)
-                    output_probabilities = no_sections_model(input_data) # It directly returns probabilities since the softmax has been applied in the model
-                    _, predicted_class = torch.max(output_probabilities, 1)
-                    final_predictions['NO-SECTIONS'][id] = {'FinalPrediction': (predicted_class.item(), output_probabilities[0].tolist())}
-
-        # output_probabilities (in final_predictions) is a tensor of shape (1, 3) - 1 datapoint and 3 labels -
-        # containing the probabilities for each class in the following order (method, background, result)
-        output_dict = self.create_json(all_predictions, final_predictions)
-        #print("Final output:", output_dict)  # Debug print
-        return output_dict  # return a new dictionary containing final predictions
+            early_results, all_predictions = self.cascade_predictions(contexts)
+            self.store_results(early_results)
 
-    def create_json(self, predictions, final_predictions):
-        def final_prediction_string(prediction_integer, metaclassifier_probabilities):
-            # New threshold based on metaclassifier probabilities
-            if metaclassifier_probabilities[0] >= 0.9 or metaclassifier_probabilities[1] >= 0.9 or metaclassifier_probabilities[2] >= 0.9:
-                if prediction_integer == 0:
-                    return "usesMethodIn (METHOD)"
-                elif prediction_integer == 1:
-                    return "obtainsBackgroundFrom (BACKGROUND)"
-                elif prediction_integer == 2:
-                    return "usesConclusionsFrom (RESULT)"
-            else:
-                return "citesForInformation (UNRELIABLE)"
+        with torch.no_grad():
+            for branch, branch_predictions in all_predictions.items():
+                model = self.branch_metaclassifiers[branch].to(self.device).eval()
+                input_data = branch_predictions['probabilities'].to(self.device)
 
-        if self.case != "M":
-            merged_dict = {}
-            for id in self.data:
-                merged_dict[id] = {
-                    "SECTION": self.data[id]['SECTION'],
-                    "CITATION": self.data[id]['CITATION'],
-                    "SCIBERT MET POSITIVE PROBABILITY": predictions[id][0].item(),
-                    "SCIBERT BKG POSITIVE PROBABILITY": predictions[id][1].item(),
-                    "SCIBERT RES POSITIVE PROBABILITY": predictions[id][2].item(),
-                    "XLNET MET POSITIVE PROBABILITY": predictions[id][3].item(),
-                    "XLNET BKG POSITIVE PROBABILITY": predictions[id][4].item(),
-                    "XLNET RES POSITIVE PROBABILITY": predictions[id][5].item(),
-                    "MET ENSEMBLE CONFIDENCE": final_predictions[id]['FinalPrediction'][1][0],
-                    "BKG ENSEMBLE CONFIDENCE": final_predictions[id]['FinalPrediction'][1][1],
-                    "RES ENSEMBLE CONFIDENCE": final_predictions[id]['FinalPrediction'][1][2],
-                    "FINAL PREDICTION": final_prediction_string(final_predictions[id]['FinalPrediction'][0], final_predictions[id]['FinalPrediction'][1])
-                }
+                # Inference
+                with self.timed("metaclassifier"):
+                    output_probabilities = model(input_data) # It directly returns probabilities since the softmax has been applied in the model
 
-        else:
-            merged_dict = {}
-            for id in self.data:
-                merged_dict[id] = {
-                    "SECTION": self.data[id]['SECTION'],
-                    "CITATION": self.data[id]['CITATION']
-                }
-                if self.data[id]['SECTION'] == "":
-                    merged_dict[id]["SCIBERT MET POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][0].item()
-                    merged_dict[id]["SCIBERT BKG POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][1].item()
-                    merged_dict[id]["SCIBERT RES POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][2].item()
-                    merged_dict[id]["XLNET MET POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][3].item()
-                    merged_dict[id]["XLNET BKG POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][4].item()
-                    merged_dict[id]["XLNET RES POSITIVE PROBABILITY"] = predictions['NO-SECTIONS'][id][5].item()
-                    merged_dict[id]["MET ENSEMBLE CONFIDENCE"] = final_predictions['NO-SECTIONS'][id]['FinalPrediction'][1][0]
-                    merged_dict[id]["BKG ENSEMBLE CONFIDENCE"] = final_predictions['NO-SECTIONS'][id]['FinalPrediction'][1][1]
-                    merged_dict[id]["RES ENSEMBLE CONFIDENCE"] = final_predictions['NO-SECTIONS'][id]['FinalPrediction'][1][2]
-                    merged_dict[id]["FINAL PREDICTION"] = final_prediction_string(final_predictions['NO-SECTIONS'][id]['FinalPrediction'][0], final_predictions['NO-SECTIONS'][id]['FinalPrediction'][1])
-                else:
-                    merged_dict[id]["SCIBERT MET POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][0].item()
-                    merged_dict[id]["SCIBERT BKG POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][1].item()
-                    merged_dict[id]["SCIBERT RES POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][2].item()
-                    merged_dict[id]["XLNET MET POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][3].item()
-                    merged_dict[id]["XLNET BKG POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][4].item()
-                    merged_dict[id]["XLNET RES POSITIVE PROBABILITY"] = predictions['SECTIONS'][id][5].item()
-                    merged_dict[id]["MET ENSEMBLE CONFIDENCE"] = final_predictions['SECTIONS'][id]['FinalPrediction'][1][0]
-                    merged_dict[id]["BKG ENSEMBLE CONFIDENCE"] = final_predictions['SECTIONS'][id]['FinalPrediction'][1][1]
-                    merged_dict[id]["RES ENSEMBLE CONFIDENCE"] = final_predictions['SECTIONS'][id]['FinalPrediction'][1][2]
-                    merged_dict[id]["FINAL PREDICTION"] = final_prediction_string(final_predictions['SECTIONS'][id]['FinalPrediction'][0], final_predictions['SECTIONS'][id]['FinalPrediction'][1])
+                # Get the predicted class (0 - method, 1 - background, or 2 - result)
+                _, predicted_classes = torch.max(output_probabilities, 1)  # 1 = dimension over which to return the maximum
+
+                # Binary probabilities, metaclassifier probabilities and predicted class are moved to the CPU together:
+                # each row holds 6 + 3 + 1 values
+                final_predictions = torch.cat([input_data, output_probabilities, predicted_classes.unsqueeze(1).to(input_data.dtype)], dim=1).cpu().numpy()
+
+                # One conversion per branch from the NumPy matrix to Python floats
+                self.store_results(dict(zip(branch_predictions['keys'], final_predictions.tolist())))
+
+    def create_json(self, datapoint_keys):
+        merged_dict = {}
+        for id in self.data:
+            row = self.context_results[datapoint_keys[id]]
+            merged_dict[id] = {
+                "SECTION": self.data[id]['SECTION'],
+                "CITATION": self.data[id]['CITATION'],
+                "SCIBERT MET POSITIVE PROBABILITY": row[0],
+                "SCIBERT BKG POSITIVE PROBABILITY": row[1],
+                "SCIBERT RES POSITIVE PROBABILITY": row[2],
+                "XLNET MET POSITIVE PROBABILITY": row[3],
+                "XLNET BKG POSITIVE PROBABILITY": row[4],
+                "XLNET RES POSITIVE PROBABILITY": row[5],
+                "MET ENSEMBLE CONFIDENCE": row[6],
+                "BKG ENSEMBLE CONFIDENCE": row[7],
+                "RES ENSEMBLE CONFIDENCE": row[8],
+                "FINAL PREDICTION": final_prediction_string(int(row[9]), row[6:9])
+            }
+            if self.cascade_threshold is not None:
+                merged_dict[id].update(self.cascade_fields(row))
 
         if self.temporary_dict is not None:
             merged_dict = self.update_with_original_metadata_dict(merged_dict)
         return merged_dict
 
 
+    @staticmethod
+    def cascade_fields(row):
+        """
+        Result fields of the cascade mode: the stage that decided the context and, for the early exits
+        (rows without XLNet probabilities), the normalized SciBERT probabilities the decision is based on,
+        in place of the metaclassifier probabilities.
+        """
+        if row[3] is not None:
+            return {"DECIDED BY": "Ensemble"}
+        return {
+            "MET ENSEMBLE CONFIDENCE": None,
+            "BKG ENSEMBLE CONFIDENCE": None,
+            "RES ENSEMBLE CONFIDENCE": None,
+            "SCIBERT MET SHARE": row[6],
+            "SCIBERT BKG SHARE": row[7],
+            "SCIBERT RES SHARE": row[8],
+            "DECIDED BY": "SciBERT"
+        }
+
     def update_with_original_metadata_dict(self, result_dict):
         final_dict = {}
         for id in result_dict:
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """
+    Content-addressed cache of classification results.
+
+    Entries are keyed by a hash of the classification mode, the fingerprint of the model
+    checkpoints and the context key computed by the Predictor (branch + exact input text).
+    The front tier is an in-process LRU bounded to max_entries results, the optional back
+    tier is a SQLite database that survives restarts and is shared by the worker processes.
+
+    The fingerprint is computed from the size and modification time of every '.pt' / '.pth' /
+    '.safetensors' file under models_path: when any checkpoint changes, the cache is invalidated.
+    """
+
+    def __init__(self, models_path, max_entries=100000, db_path=None, fingerprint_interval=5.0):
+        """
+        Args:
+            models_path (str): The folder containing the model checkpoints.
+            max_entries (int): The maximum number of results kept in memory.
+            db_path (str or None): Path of the SQLite database. If None, only the memory tier is used.
+            fingerprint_interval (float): Minimum number of seconds between two checks of the checkpoints.
+        """
+        self.models_path = models_path
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.fingerprint_interval = fingerprint_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._fingerprint = None
+        self._fingerprint_checked_at = 0.0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "invalidations": 0}
+
+    def compute_fingerprint(self):
+        """
+        Hash the path, size and modification time of the checkpoints (and of the ONNX graphs exported from them)
+        under models_path.
+        """
+        entries = []
+        for root, _, files in os.walk(self.models_path):
+            for name in files:
+                if name.endswith(('.pt', '.pth', '.safetensors', '.onnx')):
+                    file_path = os.path.join(root, name)
+                    stat = os.stat(file_path)
+                    entries.append(f"{os.path.relpath(file_path, self.models_path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        return hashlib.sha256("\n".join(sorted(entries)).encode("utf-8")).hexdigest()
+
+    def fingerprint(self):
+        """
+        Return the current checkpoints fingerprint, invalidating the cache if it changed.
+        Must be called holding the lock.
+        """
+        now = time.monotonic()
+        if self._fingerprint is None or now - self._fingerprint_checked_at >= self.fingerprint_interval:
+            fingerprint = self.compute_fingerprint()
+            self._fingerprint_checked_at = now
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                logger.info("Model checkpoints changed: invalidating the result cache")
+                self.counters["invalidations"] += 1
+                self._memory.clear()
+                connection = self.get_connection()
+                if connection is not None:
+                    with connection:
+                        connection.execute("DELETE FROM results WHERE fingerprint != ?", (fingerprint,))
+            self._fingerprint = fingerprint
+        return self._fingerprint
+
+    def get_connection(self):
+        """
+        Open the SQLite database lazily, once per process (connections must not be shared across forks).
+        """
+        if self.db_path is None:
+            return None
+        if self._connection is None or self._connection_pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, value TEXT NOT NULL)")
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def cache_key(self, mode, fingerprint, context_key):
+        return hashlib.sha256(f"{mode}\n{fingerprint}\n{context_key}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, mode, context_keys):
+        """
+        Look up the results of several contexts.
+
+        Returns:
+            dict: The cached results, keyed by context key. Missing contexts are not included.
+        """
+        found = {}
+        with self._lock:
+            fingerprint = self.fingerprint()
+            missing = {}
+            for context_key in context_keys:
+                key = self.cache_key(mode, fingerprint, context_key)
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[context_key] = self._memory[key]
+                    self.counters["memory_hits"] += 1
+                else:
+                    missing[key] = context_key
+
+            connection = self.get_connection()
+            if connection is not None and missing:
+                keys = list(missing)
+                # SQLite limits the number of parameters of a single statement
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    rows = connection.execute(f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                    for key, value in rows:
+                        value = json.loads(value)
+                        self._remember(key, value)
+                        found[missing.pop(key)] = value
+                        self.counters["disk_hits"] += 1
+            self.counters["misses"] += len(missing)
+        return found
+
+    def put_many(self, mode, results):
+        """
+        Store the results of several contexts.
+
+        Args:
+            mode (str): The classification mode.
+            results (dict): The results to store, keyed by context key.
+        """
+        if not results:
+            return
+        with self._lock:
+            fingerprint = self.fingerprint()
+            rows = []
+            for context_key, value in results.items():
+                key = self.cache_key(mode, fingerprint, context_key)
+                self._remember(key, value)
+                rows.append((key, fingerprint, json.dumps(value)))
+            connection = self.get_connection()
+            if connection is not None:
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO results (key, fingerprint, value) VALUES (?, ?, ?)", rows)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            connection = self.get_connection()
+            if connection is not None:
+                with connection:
+                    connection.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                "Memory entries": len(self._memory),
+                "Memory capacity": self.max_entries,
+                "Persistent store": self.db_path,
+                "Memory hits": self.counters["memory_hits"],
+                "Disk hits": self.counters["disk_hits"],
+                "Misses": self.counters["misses"],
+                "Hit rate": (self.counters["memory_hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0,
+                "Invalidations": self.counters["invalidations"]
+            }
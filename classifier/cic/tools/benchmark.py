@@ -0,0 +1,287 @@
+import os
+
+# CPU only and no network: the base checkpoints must be available locally (see BASE_CHECKPOINT_DIR)
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+# Every request is classified from scratch
+os.environ["RESULT_CACHE_SIZE"] = "0"
+
+import sys
+import io
+import json
+import time
+import random
+import zipfile
+import logging
+import argparse
+import platform
+import resource
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+MODES = ["WS", "WoS", "M"]
+
+SECTIONS = ["Introduction", "Related Work", "Methods", "Materials and Methods", "Results", "Discussion", "Conclusion"]
+
+WORDS = (
+    "the of and a to in we this our that with for is are was were as by on from model method methods "
+    "approach data dataset results result study studies analysis previous prior work proposed using used "
+    "based performance accuracy baseline experiments experimental evaluation reported shown similar findings "
+    "consistent previously described following procedure sample samples significant increase decrease effect "
+    "effects observed compared comparison estimate estimated algorithm framework training trained network "
+    "features parameters protocol measured measurements population patients cells protein expression"
+).split()
+
+def percentile(values, q):
+    """
+    Percentile of a list of values, with linear interpolation between the closest ranks.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def citation_length(rng, args):
+    """
+    Number of words of a synthetic citation, drawn from the configured length distribution.
+    """
+    if args.length_dist == "fixed":
+        length = args.mean_words
+    elif args.length_dist == "uniform":
+        length = rng.randint(args.min_words, args.max_words)
+    else:
+        # Lognormal with the given mean: a few long citations among many short ones, as in real papers
+        length = round(rng.lognormvariate(0, 0.5) * args.mean_words / 1.133)
+    return max(args.min_words, min(args.max_words, length))
+
+def load_sample(sample_path):
+    """
+    Read the citations of a JSON file, or of the JSON files of a ZIP archive, in the input format of the classifier.
+
+    Returns:
+        list: (SECTION, CITATION) pairs.
+    """
+    documents = []
+    if sample_path.endswith(".zip"):
+        with zipfile.ZipFile(sample_path) as zip_ref:
+            for name in zip_ref.namelist():
+                if name.endswith(".json") and not os.path.basename(name).startswith("._"):
+                    documents.append(json.load(io.TextIOWrapper(zip_ref.open(name), encoding="utf-8")))
+    else:
+        with open(sample_path, "r", encoding="utf-8") as sample_file:
+            documents.append(json.load(sample_file))
+
+    citations = []
+    for document in documents:
+        for entry in document.values():
+            if isinstance(entry, dict) and entry.get("CITATION"):
+                citations.append((entry.get("SECTION", ""), entry["CITATION"]))
+    if not citations:
+        raise ValueError(f"No citation found in {sample_path}")
+    return citations
+
+def generate_requests(args):
+    """
+    Build the benchmark requests: args.requests data sets of args.request_size citations each,
+    synthetic or sampled (with replacement) from args.sample. Synthetic citations are unique, so
+    that each of them is classified; a fraction args.duplicates repeats an earlier citation.
+
+    Returns:
+        list: Data dictionaries in the format of the JSON files ({id: {'SECTION', 'CITATION'}}).
+    """
+    rng = random.Random(args.seed)
+    sample = load_sample(args.sample) if args.sample else None
+    generated = []
+    requests = []
+    for request_index in range(args.warmup + args.requests):
+        data = {}
+        for citation_index in range(args.request_size):
+            if generated and rng.random() < args.duplicates:
+                section, citation = rng.choice(generated)
+            elif sample is not None:
+                section, citation = rng.choice(sample)
+            else:
+                section = rng.choice(SECTIONS) if rng.random() < args.section_ratio else ""
+                words = [rng.choice(WORDS) for _ in range(citation_length(rng, args))]
+                citation = f"{' '.join(words).capitalize()} [{request_index}.{citation_index}]."
+            generated.append((section, citation))
+            data[f"{request_index}-{citation_index}"] = {"SECTION": section, "CITATION": citation}
+        requests.append(data)
+    return requests
+
+def latency_summary(latencies, citations):
+    total_time = sum(latencies)
+    return {
+        "Requests": len(latencies),
+        "Citations": citations,
+        "Total time (s)": round(total_time, 4),
+        "Citations/s": round(citations / total_time, 2) if total_time else None,
+        "Latency (s)": {
+            "mean": round(total_time / len(latencies), 4) if latencies else None,
+            "p50": round(percentile(latencies, 50), 4) if latencies else None,
+            "p95": round(percentile(latencies, 95), 4) if latencies else None,
+            "p99": round(percentile(latencies, 99), 4) if latencies else None
+        }
+    }
+
+def bench_predictor(predictor, requests, warmup):
+    """
+    Classify each request on a fresh copy of the Predictor, as the API does.
+    """
+    latencies = []
+    padding = {}
+    citations = 0
+    for index, data in enumerate(requests):
+        copy = predictor.shallow_copy()
+        start = time.perf_counter()
+        copy.set_data(data, None, from_json=True)
+        copy.final_classification()
+        elapsed = time.perf_counter() - start
+        if index < warmup:
+            continue
+        latencies.append(elapsed)
+        citations += len(data)
+        for model_name, stats in copy.padding_stats.items():
+            totals = padding.setdefault(model_name, {"Real tokens": 0, "Padded tokens": 0})
+            totals["Real tokens"] += stats["Real tokens"]
+            totals["Padded tokens"] += stats["Padded tokens"]
+
+    summary = latency_summary(latencies, citations)
+    summary["Padding efficiency"] = {
+        model_name: round(totals["Real tokens"] / totals["Padded tokens"], 4) if totals["Padded tokens"] else 1.0
+        for model_name, totals in padding.items()
+    }
+    return summary
+
+def bench_api(app, mode, requests, warmup):
+    """
+    Send each request to POST /cic/api/classify (JSON body) through the Flask test client: no network.
+    """
+    client = app.test_client()
+    latencies = []
+    citations = 0
+    for index, data in enumerate(requests):
+        start = time.perf_counter()
+        # The JSON body holds [SECTION, CITATION] pairs
+        response = client.post("/cic/api/classify", json={"mode": mode, "data": [[entry["SECTION"], entry["CITATION"]] for entry in data.values()]})
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"/classify answered {response.status_code}: {response.get_data(as_text=True)[:500]}")
+        if index < warmup:
+            continue
+        latencies.append(elapsed)
+        citations += len(data)
+    return latency_summary(latencies, citations)
+
+def run_mode(args, mode):
+    """
+    Benchmark a mode in the current process (a fresh one per mode, so that the load time and peak RSS are its own).
+    """
+    import torch
+    from cic.main import create_app
+    from cic.predictor_manager import load_predictor
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    requests = generate_requests(args)
+    app = create_app(args.src_path)
+    report = {}
+    with app.app_context():
+        start = time.perf_counter()
+        predictor = load_predictor(mode, args.src_path)
+        predictor.load_branches()
+        report["Model load time (s)"] = round(time.perf_counter() - start, 3)
+        if predictor.device.type != "cpu":
+            raise RuntimeError(f"The benchmark runs on CPU only, the models were loaded on {predictor.device}")
+        if "predictor" in args.paths:
+            report["Predictor"] = bench_predictor(predictor, requests, args.warmup)
+    if "api" in args.paths:
+        # The API loads its own Predictor, sharing the ensembles loaded above
+        report["API"] = bench_api(app, mode, requests, args.warmup)
+    report["Peak RSS (MB)"] = round(peak_rss_mb(), 1)
+    return report
+
+def compare(report, baseline):
+    """
+    Relative change of the throughput and latencies of each mode and path against a baseline report.
+    """
+    comparison = {}
+    for mode, runs in report["Modes"].items():
+        for path in ["Predictor", "API"]:
+            current, reference = runs.get(path), baseline.get("Modes", {}).get(mode, {}).get(path)
+            if not current or not reference:
+                continue
+            changes = {}
+            if current["Citations/s"] and reference["Citations/s"]:
+                changes["Citations/s"] = round(current["Citations/s"] / reference["Citations/s"] - 1, 4)
+            for key in ["p50", "p95", "p99"]:
+                if current["Latency (s)"][key] and reference["Latency (s)"][key]:
+                    changes[f"Latency {key}"] = round(current["Latency (s)"][key] / reference["Latency (s)"][key] - 1, 4)
+            comparison[f"{mode} {path}"] = changes
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the throughput and latency of the classifier on CPU, with the local checkpoints.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES, help='Classification modes to benchmark.')
+    parser.add_argument('--paths', nargs='+', default=['predictor', 'api'], choices=['predictor', 'api'], help='Call the Predictor directly and/or POST /cic/api/classify through the Flask app.')
+    parser.add_argument('--requests', type=int, default=20, help='Timed requests per mode and path.')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests sent first.')
+    parser.add_argument('--request_size', type=int, default=32, help='Citations per request.')
+    parser.add_argument('--sample', default=None, help='JSON file or ZIP of JSON files to sample the citations from, instead of generating them.')
+    parser.add_argument('--length_dist', default='lognormal', choices=['fixed', 'uniform', 'lognormal'], help='Distribution of the number of words of the generated citations.')
+    parser.add_argument('--mean_words', type=int, default=30, help='Mean number of words of the generated citations (fixed and lognormal).')
+    parser.add_argument('--min_words', type=int, default=5, help='Minimum number of words of the generated citations.')
+    parser.add_argument('--max_words', type=int, default=120, help='Maximum number of words of the generated citations.')
+    parser.add_argument('--section_ratio', type=float, default=0.7, help='Fraction of the generated citations with a section.')
+    parser.add_argument('--duplicates', type=float, default=0.0, help='Fraction of citations repeating an earlier one.')
+    parser.add_argument('--threads', type=int, default=0, help='Torch intra-op threads (0 keeps the default).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated citations.')
+    parser.add_argument('--output', default=None, help='Path of the JSON report.')
+    parser.add_argument('--baseline', default=None, help='JSON report of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    import torch
+
+    report = {
+        "Configuration": {
+            **{key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "Torch": torch.__version__,
+            "Torch threads": args.threads or torch.get_num_threads(),
+            "CPUs": os.cpu_count(),
+            "Platform": platform.platform(),
+            "Python": platform.python_version(),
+            "Timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+        },
+        "Modes": {}
+    }
+    # One fresh process per mode: models are loaded cold and the peak RSS is not shared with the other modes
+    context = multiprocessing.get_context("spawn")
+    for mode in args.modes:
+        with context.Pool(1) as pool:
+            report["Modes"][mode] = pool.apply(run_mode, (args, mode))
+        logger.info(f"{mode}: {json.dumps(report['Modes'][mode])}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            report["Comparison with baseline"] = compare(report, json.load(baseline_file))
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Checkpoint log of the run, in the output folder: one JSON line per processed file
+LOG_FILENAME = "bulk_log.jsonl"
+
+# Worker process state: the Flask app context and the classification mode (see init_worker)
+worker_state = {}
+
+def list_input_files(input_path):
+    """
+    List the JSON files to classify: the JSON files under a folder, or the files listed by a JSONL manifest
+    (one path per line, as a JSON string or an object with a 'path' key, relative to the manifest folder).
+
+    Returns:
+        list: (path, rel_path) pairs sorted by rel_path, where rel_path is the path of the result in the output folder.
+    """
+    files = {}
+    if os.path.isdir(input_path):
+        for root, _, names in os.walk(input_path):
+            for name in names:
+                if name.endswith('.json') and not name.startswith('._'):
+                    path = os.path.join(root, name)
+                    files[os.path.relpath(path, input_path)] = path
+    else:
+        base_dir = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, 'r', encoding='utf-8') as manifest_file:
+            for line_number, line in enumerate(manifest_file, start=1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                listed_path = entry['path'] if isinstance(entry, dict) else entry
+                if not isinstance(listed_path, str):
+                    raise ValueError(f"Line {line_number} of {input_path} is not a path nor an object with a 'path' key")
+                path = os.path.join(base_dir, listed_path)
+                rel_path = os.path.normpath(listed_path)
+                if os.path.isabs(rel_path) or rel_path.startswith(os.pardir):
+                    # Results of files outside the manifest folder mirror their absolute path
+                    rel_path = os.path.abspath(path).lstrip(os.sep)
+                files[rel_path] = path
+    return sorted((path, rel_path) for rel_path, path in files.items())
+
+def file_chunks(files, chunk_files):
+    """
+    Split the files into chunks of at most chunk_files files, none holding two files with the same name:
+    the errors of a chunk are reported by file name, as in the manifest of an archive (see process_json_files).
+    The n-th file of each name goes to the chunks of the n-th round, so most chunks stay full.
+
+    Returns:
+        list: The chunks, lists of (path, rel_path) pairs.
+    """
+    rounds = []
+    occurrences = {}
+    for path, rel_path in files:
+        name = os.path.basename(rel_path)
+        occurrence = occurrences.get(name, 0)
+        occurrences[name] = occurrence + 1
+        if occurrence == len(rounds):
+            rounds.append([])
+        rounds[occurrence].append((path, rel_path))
+    return [files_round[start:start + chunk_files] for files_round in rounds for start in range(0, len(files_round), chunk_files)]
+
+def read_checkpoint(log_path, retry_failed=False):
+    """
+    Read the files already processed by earlier runs from the checkpoint log.
+
+    Returns:
+        set: The rel_path of the files to skip: the classified ones, and the failed ones unless retry_failed.
+    """
+    processed = set()
+    if not os.path.exists(log_path):
+        return processed
+    with open(log_path, 'r', encoding='utf-8') as log_file:
+        for line in log_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted run
+                continue
+            if entry["Status"] == "done" or not retry_failed:
+                processed.add(entry["File"])
+    return processed
+
+def init_worker(src_path, mode, threads):
+    """
+    Load the models of the mode in a worker process, once: they stay resident for all its chunks.
+    The configuration is read from the environment, as by the service.
+    """
+    import torch
+    from cic.main import create_app
+    from cic.predictor_manager import model_registry
+
+    if threads:
+        torch.set_num_threads(threads)
+    app = create_app(src_path)
+    context = app.app_context()
+    context.push()
+    model_registry.borrow(mode, src_path)
+    worker_state.update(app=app, context=context, mode=mode)
+
+def file_error(manifest_dict, name):
+    """
+    Error reported in the manifest for a file that produced no result.
+    """
+    read_errors = manifest_dict.get("Data Loading", {}).get("Files processing", {}).get("Files generating errors", {})
+    if name in read_errors:
+        return read_errors[name]["Error details"]
+    classification = manifest_dict.get("Classification", {}).get(name)
+    if classification is not None:
+        return classification["Summary"].get("Error details", classification["Status"])
+    return "No result produced."
+
+def classify_chunk(task):
+    """
+    Classify a chunk of files in a worker process, as the files of an archive uploaded to /classify:
+    same validation (process_json_files), shared batches (PredictorManager.iter_archive) and result
+    files (the '_result.json' entries of the ZIP response). Each result is written as soon as it is
+    produced, to a temporary file renamed when complete.
+
+    Returns:
+        list: The checkpoint log entry of each file of the chunk.
+    """
+    from cic.predictor_manager import PredictorManager
+    from cic.utils.file_processing import process_json_files
+    from cic.utils.response_helpers import dumps_json, result_entry_name
+
+    chunk, output_dir, compact = task
+    entries = {}
+    contents = []
+    for path, rel_path in chunk:
+        try:
+            with open(path, 'rb') as input_file:
+                contents.append((rel_path, input_file.read()))
+        except OSError as e:
+            entries[rel_path] = {"File": rel_path, "Status": "failed", "Error details": str(e)}
+
+    predictor_manager = PredictorManager()
+    if not predictor_manager.instantiate_predictor(worker_state["mode"]):
+        raise RuntimeError(f"Failed to instantiate the Predictor: {json.dumps(predictor_manager.manifest_dict)}")
+    predictor_manager.manifest_dict = {}
+
+    data_list, manifest_dict = process_json_files(contents, predictor_manager)
+    for item in predictor_manager.iter_archive(data_list, 'bulk-cli'):
+        result_path = result_entry_name(item)
+        output_path = os.path.join(output_dir, result_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path + ".tmp", 'wb') as output_file:
+            output_file.write(dumps_json(item['result'], compact))
+        os.replace(output_path + ".tmp", output_path)
+        entries[item['rel_path']] = {"File": item['rel_path'], "Status": "done", "Result": result_path, "Citations": len(item['result'])}
+
+    # The manifest reports the errors by file name, unique in the chunk (see file_chunks)
+    id_errors = manifest_dict.get("Single entries processing", {}).get("Citation IDs Processing", {}).get("Files generating errors", {})
+    for rel_path, _ in contents:
+        name = os.path.basename(rel_path)
+        if rel_path not in entries:
+            entries[rel_path] = {"File": rel_path, "Status": "failed", "Error details": file_error(manifest_dict, name)}
+        elif name in id_errors:
+            entries[rel_path]["IDs not processed"] = id_errors[name]
+    return [entries[rel_path] for _, rel_path in chunk]
+
+def classify_rows(task):
+    """
+    Classify a chunk of the rows of a table in a worker process, as /classify/table classifies a table: same
+    validation and batches (PredictorManager.classify_record_batches) and same result columns. The result
+    table of the chunk is written to a temporary file renamed when complete.
+
+    Returns:
+        list: The checkpoint log entry of the chunk.
+    """
+    from cic.predictor_manager import PredictorManager
+    from cic.utils import columnar
+
+    part, first_row, records, output_dir, output_format = task
+    predictor_manager = PredictorManager()
+    if not predictor_manager.instantiate_predictor(worker_state["mode"]):
+        raise RuntimeError(f"Failed to instantiate the Predictor: {json.dumps(predictor_manager.manifest_dict)}")
+
+    batch_size = worker_state["app"].config.get('STREAM_BATCH_SIZE', 256)
+    results = predictor_manager.classify_record_batches(enumerate(records, start=1), batch_size)
+    columns = columnar.result_columns(records, columnar.in_input_order(results, len(records)))
+    output_path = os.path.join(output_dir, part)
+    with open(output_path + ".tmp", 'wb') as output_file:
+        output_file.write(columnar.write_table(columns, output_format))
+    os.replace(output_path + ".tmp", output_path)
+
+    errors = [error for error in columns["error"] if error is not None]
+    entry = {"File": part, "Status": "done", "Rows": [first_row, first_row + len(records) - 1], "Citations": len(records) - len(errors), "Rows not processed": len(errors)}
+    if len(errors) == len(records):
+        # No row could be classified, e.g. the models failed: processed again with --retry_failed
+        entry.update({"Status": "failed", "Error details": errors[0]})
+    return [entry]
+
+def table_tasks(args, input_format, processed):
+    """
+    Split the rows of an Arrow IPC, Parquet or MessagePack table into chunks of --chunk_rows rows, each
+    classified into its own result table 'part-NNNNN' in the output folder.
+
+    Returns:
+        tuple: The number of chunks and the tasks of the chunks not processed yet (see classify_rows).
+    """
+    from cic.utils import columnar
+
+    output_format = args.output_format or input_format
+    columnar.check_format(input_format)
+    columnar.check_format(output_format)
+    with open(args.input, 'rb') as input_file:
+        records = columnar.read_table(input_file.read(), input_format)
+    extension = columnar.TABLE_FORMATS[output_format]["extensions"][0]
+    tasks = []
+    starts = range(0, len(records), args.chunk_rows)
+    for index, start in enumerate(starts):
+        part = f"part-{index:05d}{extension}"
+        if part not in processed:
+            tasks.append((part, start, records[start:start + args.chunk_rows], args.output, output_format))
+    return len(starts), tasks
+
+def main():
+    parser = argparse.ArgumentParser(description='Classify a folder or JSONL manifest of JSON files, or an Arrow IPC, Parquet or MessagePack table, offline, in several processes, resuming interrupted runs.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--input', required=True, help='Folder of JSON files, JSONL manifest listing their paths, or table file (.arrow, .feather, .parquet, .msgpack).')
+    parser.add_argument('--output', required=True, help='Folder of the result files and of the checkpoint log.')
+    parser.add_argument('--mode', default='M', choices=['WS', 'WoS', 'M'], help='Classification mode.')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes, each with its own resident models.')
+    parser.add_argument('--chunk_files', type=int, default=50, help='Files classified together by a worker (shared batches).')
+    parser.add_argument('--threads', type=int, default=0, help='Torch intra-op threads per worker (0 divides the CPUs among the workers).')
+    parser.add_argument('--compact', action='store_true', help='Write compact JSON results, as with ZIP_COMPACT_JSON.')
+    parser.add_argument('--retry_failed', action='store_true', help='Process again the files that failed in earlier runs.')
+    parser.add_argument('--chunk_rows', type=int, default=10000, help='Rows classified together by a worker, for table inputs.')
+    parser.add_argument('--output_format', default=None, choices=['arrow', 'parquet', 'msgpack'], help='Format of the result tables, for table inputs (default: the input format).')
+    args = parser.parse_args()
+
+    from cic.utils import columnar
+
+    os.makedirs(args.output, exist_ok=True)
+    log_path = os.path.join(args.output, LOG_FILENAME)
+    processed = read_checkpoint(log_path, args.retry_failed)
+    input_format = columnar.format_from_filename(args.input) if os.path.isfile(args.input) else None
+    if input_format is not None:
+        total, tasks = table_tasks(args, input_format, processed)
+        pending_count = len(tasks)
+        worker_function = classify_rows
+        unit = "row chunks"
+    else:
+        files = list_input_files(args.input)
+        pending = [(path, rel_path) for path, rel_path in files if rel_path not in processed]
+        chunks = file_chunks(pending, args.chunk_files)
+        total = len(files)
+        pending_count = len(pending)
+        tasks = [(chunk, args.output, args.compact) for chunk in chunks]
+        worker_function = classify_chunk
+        unit = "files"
+    logger.info(f"{total} {unit}, {total - pending_count} already processed, {pending_count} to classify")
+    if not tasks:
+        return
+
+    workers = max(1, min(args.workers, len(tasks)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    done = failed = citations = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with open(log_path, 'a', encoding='utf-8') as log_file, context.Pool(workers, initializer=init_worker, initargs=(args.src_path, args.mode, threads)) as pool:
+        for entries in pool.imap_unordered(worker_function, tasks):
+            # The results of the chunk are on disk: record them, so that a new run skips them
+            for entry in entries:
+                log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                if entry["Status"] == "done":
+                    done += 1
+                    citations += entry["Citations"]
+                else:
+                    failed += 1
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            elapsed = time.perf_counter() - start
+            logger.info(f"{done + failed}/{pending_count} {unit} processed ({failed} failed), {citations} citations, {citations / elapsed:.1f} citations/s")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import argparse
+import logging
+import torch
+
+from cic.src.checkpoints import safetensors_path, unwrap_state_dict, load_safetensors
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def convert_checkpoint(checkpoint_path):
+    """
+    Write the state_dict of a '.pt' / '.pth' checkpoint to a '.safetensors' file next to it,
+    then check that the file holds exactly the same tensors. The original checkpoint is kept.
+
+    Returns:
+        str: The path of the safetensors file.
+    """
+    from safetensors.torch import save_file
+
+    state = unwrap_state_dict(torch.load(checkpoint_path, map_location="cpu"))
+    if not isinstance(state, dict) or not all(isinstance(tensor, torch.Tensor) for tensor in state.values()):
+        raise ValueError(f"{checkpoint_path} is not a state_dict of tensors")
+    # safetensors does not store tensors sharing memory nor non-contiguous views
+    tensors = {key: tensor.detach().contiguous().clone() for key, tensor in state.items()}
+
+    converted_path = safetensors_path(checkpoint_path)
+    temporary_path = converted_path + ".tmp"
+    save_file(tensors, temporary_path, metadata={"source": os.path.basename(checkpoint_path)})
+
+    # Validation: same keys, dtypes, shapes and values as the original checkpoint
+    loaded = load_safetensors(temporary_path)
+    try:
+        if set(loaded) != set(tensors):
+            raise ValueError(f"Keys differ: {sorted(set(loaded) ^ set(tensors))[:5]}")
+        for key, tensor in tensors.items():
+            if loaded[key].dtype != tensor.dtype or loaded[key].shape != tensor.shape or not torch.equal(loaded[key], tensor):
+                raise ValueError(f"Tensor {key} differs from the original checkpoint")
+    except ValueError:
+        del loaded
+        os.remove(temporary_path)
+        raise
+    del loaded
+    os.replace(temporary_path, converted_path)
+    return converted_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the checkpoints of the models to safetensors, so that they are memory-mapped when loaded.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--force', action='store_true', help='Convert again the checkpoints that already have an up-to-date safetensors file.')
+    args = parser.parse_args()
+
+    models_path = os.path.join(args.src_path, "models")
+    checkpoint_paths = []
+    for root, _, files in os.walk(models_path):
+        checkpoint_paths.extend(os.path.join(root, name) for name in files if name.endswith(('.pt', '.pth')))
+    if not checkpoint_paths:
+        logger.error(f"No checkpoint found under {models_path}")
+        sys.exit(1)
+
+    failures = 0
+    for checkpoint_path in sorted(checkpoint_paths):
+        converted_path = safetensors_path(checkpoint_path)
+        if not args.force and os.path.exists(converted_path) and os.path.getmtime(converted_path) >= os.path.getmtime(checkpoint_path):
+            logger.info(f"Skipping {checkpoint_path}: already converted")
+            continue
+        try:
+            convert_checkpoint(checkpoint_path)
+            logger.info(f"Converted {checkpoint_path}")
+        except Exception as e:
+            failures += 1
+            logger.error(f"Failed to convert {checkpoint_path}: {e}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
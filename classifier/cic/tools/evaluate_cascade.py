@@ -0,0 +1,157 @@
+import os
+
+# The reference predictions come from the full ensemble, classified from scratch
+os.environ["CASCADE_THRESHOLD"] = "0"
+os.environ["RESULT_CACHE_SIZE"] = "0"
+
+import io
+import json
+import time
+import zipfile
+import logging
+import argparse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ["WS", "WoS", "M"]
+
+def load_documents(input_path):
+    """
+    Read the JSON files to evaluate on: a JSON file, a folder of JSON files or a ZIP archive of JSON files.
+
+    Returns:
+        list: (name, data) pairs, where data is in the format of the JSON files ({id: {'SECTION', 'CITATION'}}).
+    """
+    documents = []
+    if os.path.isdir(input_path):
+        for root, _, names in sorted(os.walk(input_path)):
+            for name in sorted(names):
+                if name.endswith('.json') and not name.startswith('._'):
+                    with open(os.path.join(root, name), 'r', encoding='utf-8') as input_file:
+                        documents.append((os.path.relpath(os.path.join(root, name), input_path), json.load(input_file)))
+    elif input_path.endswith('.zip'):
+        with zipfile.ZipFile(input_path) as zip_ref:
+            for name in zip_ref.namelist():
+                if name.endswith('.json') and not os.path.basename(name).startswith('._'):
+                    documents.append((name, json.load(io.TextIOWrapper(zip_ref.open(name), encoding='utf-8'))))
+    else:
+        with open(input_path, 'r', encoding='utf-8') as input_file:
+            documents.append((os.path.basename(input_path), json.load(input_file)))
+    if not documents:
+        raise ValueError(f"No JSON file found in {input_path}")
+    return documents
+
+def full_predictions(predictor, documents):
+    """
+    Classify the documents with the full ensemble (SciBERT, XLNet and metaclassifier), one file at a time.
+
+    Returns:
+        tuple: The results of all the citations (in the output format of the classifier) and the stage times (s).
+    """
+    results = []
+    stage_times = {}
+    for name, data in documents:
+        copy = predictor.shallow_copy()
+        try:
+            copy.set_data(data, None, from_json=True)
+        except Exception as e:
+            logger.warning(f"Skipping {name}: {e}")
+            continue
+        results.extend(copy.final_classification().values())
+        for stage, seconds in copy.take_stage_stats()["Stage times"].items():
+            stage_times[stage] = stage_times.get(stage, 0.0) + seconds
+    return results, stage_times
+
+def evaluate_threshold(results, threshold, xlnet_time):
+    """
+    Replay the first stage of the cascade on the SciBERT probabilities of the full ensemble results:
+    the contexts exiting early get the prediction of the first stage, the others keep the full one.
+    """
+    import torch
+    from cic.src.predictor import cascade_exits, final_prediction_string
+
+    scibert = torch.tensor([[result["SCIBERT MET POSITIVE PROBABILITY"], result["SCIBERT BKG POSITIVE PROBABILITY"], result["SCIBERT RES POSITIVE PROBABILITY"]] for result in results])
+    exits, probabilities = cascade_exits(scibert, threshold)
+    predicted_classes = probabilities.argmax(dim=1).tolist()
+    probabilities = probabilities.tolist()
+
+    early_exits = same_prediction = same_class = 0
+    disagreements = {}
+    for result, exit, predicted_class, first_stage in zip(results, exits.tolist(), predicted_classes, probabilities):
+        if not exit:
+            continue
+        early_exits += 1
+        confidences = [result["MET ENSEMBLE CONFIDENCE"], result["BKG ENSEMBLE CONFIDENCE"], result["RES ENSEMBLE CONFIDENCE"]]
+        cascade_prediction = final_prediction_string(predicted_class, first_stage)
+        if cascade_prediction == result["FINAL PREDICTION"]:
+            same_prediction += 1
+        else:
+            pair = f"{result['FINAL PREDICTION']} -> {cascade_prediction}"
+            disagreements[pair] = disagreements.get(pair, 0) + 1
+        if predicted_class == confidences.index(max(confidences)):
+            same_class += 1
+
+    citations = len(results)
+    return {
+        "Early exits": early_exits,
+        "Early exit share": round(early_exits / citations, 4),
+        # The citations going through the second stage get the prediction of the full ensemble
+        "Agreement": round((citations - early_exits + same_prediction) / citations, 4),
+        "Agreement of early exits": round(same_prediction / early_exits, 4) if early_exits else None,
+        "Class agreement of early exits": round(same_class / early_exits, 4) if early_exits else None,
+        "Disagreements": dict(sorted(disagreements.items(), key=lambda item: -item[1])),
+        "Estimated XLNet time saved (s)": round(xlnet_time * early_exits / citations, 3)
+    }
+
+def evaluate_mode(args, mode, documents):
+    from cic.main import create_app
+    from cic.predictor_manager import load_predictor
+
+    app = create_app(args.src_path)
+    with app.app_context():
+        predictor = load_predictor(mode, args.src_path)
+        predictor.load_branches()
+        start = time.perf_counter()
+        results, stage_times = full_predictions(predictor, documents)
+        elapsed = time.perf_counter() - start
+    if not results:
+        raise ValueError(f"No citation could be classified in {mode} mode")
+
+    xlnet_time = sum(seconds for stage, seconds in stage_times.items() if stage.startswith("forward XLNet"))
+    return {
+        "Citations": len(results),
+        "Full ensemble time (s)": round(elapsed, 3),
+        "XLNet forward time (s)": round(xlnet_time, 3),
+        "Thresholds": {str(threshold): evaluate_threshold(results, threshold, xlnet_time) for threshold in args.thresholds}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the cascade mode (CASCADE_THRESHOLD) against the full ensemble: share of citations exiting early after SciBERT and agreement of the predictions.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--input', required=True, help='JSON file, folder of JSON files or ZIP of JSON files, with the citations to evaluate on.')
+    parser.add_argument('--modes', nargs='+', default=['M'], choices=MODES, help='Classification modes to evaluate.')
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[0.9, 0.95, 0.97, 0.99], help='Cascade thresholds to evaluate, in (0, 1].')
+    parser.add_argument('--output', default=None, help='Path of the JSON report.')
+    args = parser.parse_args()
+
+    for threshold in args.thresholds:
+        if not 0 < threshold <= 1:
+            parser.error(f"Invalid threshold: {threshold}. Expected a value in (0, 1]")
+
+    documents = load_documents(args.input)
+    report = {
+        "Configuration": {"Input": args.input, "Files": len(documents), "Thresholds": args.thresholds},
+        "Modes": {}
+    }
+    for mode in args.modes:
+        report["Modes"][mode] = evaluate_mode(args, mode, documents)
+        logger.info(f"{mode}: {json.dumps(report['Modes'][mode]['Thresholds'])}")
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == '__main__':
+    main()
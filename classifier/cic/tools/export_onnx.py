@@ -0,0 +1,139 @@
+import os
+import sys
+import glob
+import argparse
+import logging
+import numpy as np
+import torch
+from cic.src.binary_classifiers import EnsembleClassifier
+from cic.src.graph_optimization import LogitsModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Base checkpoint of each family of binary classifiers (see load_predictor in predictor_manager.py)
+BASE_CHECKPOINTS = {
+    "SciBERT": "allenai/scibert_scivocab_cased",
+    "XLNet": "xlnet-base-cased"
+}
+
+# Members of an ensemble, in the order of EnsembleClassifier
+MEMBERS = ["met", "bkg", "res"]
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+EXPORT_SENTENCES = [
+    "Introduction. This method is based on Smith et al. (2020).",
+    "Compared to prior work, our model achieves higher accuracy."
+]
+
+VALIDATION_SENTENCES = [
+    "Results.",
+    "Methods. We adopt the sampling procedure described by Doe and colleagues, with the parameters reported in their appendix (2019).",
+    "Our results build upon prior work."
+]
+
+def load_ensemble(model_ckp, state_dict_paths, base_cache_dir):
+    """
+    Load the fine-tuned models of an ensemble as the classifier does (EnsembleClassifier with the torch backend),
+    so that the graphs are exported from the same models that the torch backend runs.
+    """
+    return EnsembleClassifier(
+        model_ckp,
+        state_dict_paths,
+        {0: "no", 1: "yes"},
+        {"no": 0, "yes": 1},
+        base_cache_dir=base_cache_dir
+    )
+
+def export_model(tokenizer, model, state_dict_path, opset_version, atol):
+    """
+    Export a fine-tuned model to ONNX, next to its state_dict, with dynamic batch and sequence axes,
+    then check the graph against PyTorch on a batch of a different shape.
+
+    Returns:
+        float: The maximum absolute difference between ONNX Runtime and PyTorch logits.
+    """
+    import onnxruntime
+
+    onnx_path = os.path.splitext(state_dict_path)[0] + ".onnx"
+    # Exported and validated on CPU, where ONNX Runtime runs the graphs
+    model = LogitsModel(model.to("cpu")).eval()
+
+    export_inputs = tokenizer(EXPORT_SENTENCES, padding=True, return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    dynamic_axes["logits"] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(export_inputs[name] for name in INPUT_NAMES),
+            onnx_path,
+            input_names=INPUT_NAMES,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version
+        )
+
+    # Validation on a batch with a different size and sequence length than the export one
+    validation_inputs = tokenizer(VALIDATION_SENTENCES, padding=True, return_tensors="pt")
+    with torch.no_grad():
+        expected = model(*(validation_inputs[name] for name in INPUT_NAMES)).numpy()
+    session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    feed = {model_input.name: validation_inputs[model_input.name].numpy().astype(np.int64) for model_input in session.get_inputs()}
+    actual = session.run(["logits"], feed)[0]
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if max_diff > atol:
+        os.remove(onnx_path)
+        raise ValueError(f"ONNX graph for {state_dict_path} differs from PyTorch (max abs difference {max_diff:.2e} > {atol:.0e}). The graph has been removed.")
+    return max_diff
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the fine-tuned binary classifiers to ONNX for the onnx inference backend.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--base_checkpoint_dir', default=os.getenv('BASE_CHECKPOINT_DIR'), help='Folder of the base checkpoints configurations and tokenizers (default: BASE_CHECKPOINT_DIR, or src_path/models/base_checkpoints).')
+    parser.add_argument('--opset', type=int, default=14, help='ONNX opset version.')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Maximum absolute difference of the logits accepted by the validation.')
+    args = parser.parse_args()
+
+    state_dict_paths = sorted(glob.glob(os.path.join(args.src_path, "models", "Models*", "W*_*_*.pt")))
+    if not state_dict_paths:
+        logger.error(f"No binary classifier checkpoint found under {os.path.join(args.src_path, 'models')}")
+        sys.exit(1)
+
+    base_cache_dir = args.base_checkpoint_dir or os.path.join(args.src_path, "models", "base_checkpoints")
+
+    # Checkpoints grouped by ensemble (folder, prefix and family), e.g. ModelsWithSections/WS_SciBERT
+    ensembles = {}
+    for state_dict_path in state_dict_paths:
+        prefix, family = os.path.basename(state_dict_path).split("_")[:2]
+        if family not in BASE_CHECKPOINTS:
+            logger.warning(f"Skipping {state_dict_path}: unknown model family {family}")
+            continue
+        ensembles.setdefault((os.path.dirname(state_dict_path), prefix, family), []).append(state_dict_path)
+
+    failures = 0
+    for (folder, prefix, family), found in ensembles.items():
+        members = [os.path.join(folder, f"{prefix}_{family}_{member}.pt") for member in MEMBERS]
+        missing = [path for path in members if path not in found]
+        if missing:
+            failures += len(found)
+            logger.error(f"Failed to export the {prefix}_{family} ensemble: missing checkpoints {missing}")
+            continue
+        try:
+            ensemble = load_ensemble(BASE_CHECKPOINTS[family], members, base_cache_dir)
+        except Exception as e:
+            failures += len(members)
+            logger.error(f"Failed to load the {prefix}_{family} ensemble: {e}")
+            continue
+        for state_dict_path, model in zip(members, ensemble.models):
+            try:
+                max_diff = export_model(ensemble.tokenizer, model, state_dict_path, args.opset, args.atol)
+                logger.info(f"Exported {state_dict_path} (max abs difference {max_diff:.2e})")
+            except Exception as e:
+                failures += 1
+                logger.error(f"Failed to export {state_dict_path}: {e}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
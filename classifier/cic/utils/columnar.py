@@ -0,0 +1,173 @@
+import os
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Media types and file extensions of the table formats; the first media type is the one of the responses
+TABLE_FORMATS = {
+    "arrow": {
+        "mimetypes": ["application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file"],
+        "extensions": [".arrow", ".arrows", ".feather", ".ipc"]
+    },
+    "parquet": {
+        "mimetypes": ["application/vnd.apache.parquet", "application/x-parquet"],
+        "extensions": [".parquet"]
+    },
+    "msgpack": {
+        "mimetypes": ["application/msgpack", "application/x-msgpack", "application/vnd.msgpack"],
+        "extensions": [".msgpack", ".mpk"]
+    }
+}
+
+INPUT_COLUMNS = ["id", "SECTION", "CITATION"]
+
+PROBABILITY_COLUMNS = [
+    "SCIBERT MET POSITIVE PROBABILITY", "SCIBERT BKG POSITIVE PROBABILITY", "SCIBERT RES POSITIVE PROBABILITY",
+    "XLNET MET POSITIVE PROBABILITY", "XLNET BKG POSITIVE PROBABILITY", "XLNET RES POSITIVE PROBABILITY",
+    "MET ENSEMBLE CONFIDENCE", "BKG ENSEMBLE CONFIDENCE", "RES ENSEMBLE CONFIDENCE"
+]
+
+# Cascade mode only (see Predictor.cascade_fields): null otherwise
+CASCADE_COLUMNS = ["SCIBERT MET SHARE", "SCIBERT BKG SHARE", "SCIBERT RES SHARE", "DECIDED BY"]
+
+OUTPUT_COLUMNS = INPUT_COLUMNS + PROBABILITY_COLUMNS + ["FINAL PREDICTION"] + CASCADE_COLUMNS + ["error"]
+
+# Magic bytes opening the Arrow IPC file format (the stream format has none)
+ARROW_FILE_MAGIC = b"ARROW1"
+
+def format_from_mimetype(mimetype):
+    """
+    Table format of a media type (e.g. the Content-Type or Accept header), None if it is not one of TABLE_FORMATS.
+    """
+    mimetype = (mimetype or "").split(";")[0].strip().lower()
+    for table_format, spec in TABLE_FORMATS.items():
+        if mimetype in spec["mimetypes"]:
+            return table_format
+    return None
+
+def format_from_filename(filename):
+    """
+    Table format of a file, from its extension. None if it is not one of TABLE_FORMATS.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    for table_format, spec in TABLE_FORMATS.items():
+        if extension in spec["extensions"]:
+            return table_format
+    return None
+
+def check_format(table_format):
+    """
+    Raise an error if the table format is unknown or its library (pyarrow or msgpack) is not installed.
+    """
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Invalid table format: {table_format}. Expected one of: {list(TABLE_FORMATS)}")
+    if table_format in ("arrow", "parquet") and pyarrow is None:
+        raise RuntimeError(f"The {table_format} format requires pyarrow, which is not installed")
+    if table_format == "msgpack" and msgpack is None:
+        raise RuntimeError("The msgpack format requires msgpack, which is not installed")
+
+def read_table(payload, table_format):
+    """
+    Read the citation records of a table: an Arrow IPC stream or file, a Parquet file, or a MessagePack map
+    of columns ({"id": [...], "SECTION": [...], "CITATION": [...]}) or array of row maps.
+    Only the id, SECTION and CITATION columns are read.
+
+    Args:
+        payload (bytes): The encoded table.
+        table_format (str): One of TABLE_FORMATS.
+
+    Returns:
+        list: The records, as {'id', 'SECTION', 'CITATION'} dicts, in the table order.
+    """
+    check_format(table_format)
+    if table_format == "msgpack":
+        content = msgpack.unpackb(payload, raw=False)
+        if isinstance(content, dict):
+            missing = [column for column in INPUT_COLUMNS if column not in content]
+            if missing:
+                raise ValueError(f"Missing columns: {missing}")
+            return [dict(zip(INPUT_COLUMNS, values)) for values in zip(*(content[column] for column in INPUT_COLUMNS))]
+        if isinstance(content, list):
+            return content
+        raise ValueError("Invalid MessagePack table, it must be a map of columns or an array of rows.")
+
+    buffer = pyarrow.BufferReader(payload)
+    if table_format == "parquet":
+        table = pyarrow.parquet.read_table(buffer)
+    elif payload[:len(ARROW_FILE_MAGIC)] == ARROW_FILE_MAGIC:
+        table = pyarrow.ipc.open_file(buffer).read_all()
+    else:
+        table = pyarrow.ipc.open_stream(buffer).read_all()
+    missing = [column for column in INPUT_COLUMNS if column not in table.column_names]
+    if missing:
+        raise ValueError(f"Missing columns: {missing}")
+    return table.select(INPUT_COLUMNS).to_pylist()
+
+def in_input_order(results, count):
+    """
+    Order the results of PredictorManager.classify_record_batches as the records given, numbered from 1:
+    the errors carry their record number and are produced as soon as the record is read, the other results
+    follow the order of their records.
+    """
+    errors = {}
+    classified = []
+    for result in results:
+        if "line" in result:
+            errors[result["line"]] = result
+        else:
+            classified.append(result)
+    classified = iter(classified)
+    return [errors[number] if number in errors else next(classified) for number in range(1, count + 1)]
+
+def result_columns(records, results):
+    """
+    Build the columns of the result table (OUTPUT_COLUMNS) from the records and their results, in the same order.
+    The rows of the records that could not be classified have null probabilities and prediction and an error;
+    with the cascade mode, the XLNet probabilities and ensemble confidences of the citations exiting early are null.
+    """
+    columns = {column: [] for column in OUTPUT_COLUMNS}
+    for record, result in zip(records, results):
+        record = record if isinstance(record, dict) else {}
+        columns["id"].append(result.get("id", record.get("id")))
+        for column in ["SECTION", "CITATION"]:
+            # Values of rejected records that are not strings (e.g. numbers) do not fit the string columns
+            value = result.get(column, record.get(column))
+            columns[column].append(value if isinstance(value, str) else None)
+        for column in OUTPUT_COLUMNS[len(INPUT_COLUMNS):]:
+            columns[column].append(result.get(column))
+    return columns
+
+def write_table(columns, table_format):
+    """
+    Encode result columns (see result_columns) as an Arrow IPC stream, a Parquet file or a MessagePack map of columns.
+
+    Returns:
+        bytes: The encoded table.
+    """
+    check_format(table_format)
+    if table_format == "msgpack":
+        return msgpack.packb(columns, use_bin_type=True)
+
+    float_columns = PROBABILITY_COLUMNS + CASCADE_COLUMNS[:3]
+    fields = [pyarrow.field(column, pyarrow.float64()) if column in float_columns else pyarrow.field(column, pyarrow.string())
+              for column in OUTPUT_COLUMNS if column != "id"]
+    table = pyarrow.table(
+        [pyarrow.array(columns["id"])] + [pyarrow.array(columns[field.name], type=field.type) for field in fields],
+        names=OUTPUT_COLUMNS
+    )
+    sink = pyarrow.BufferOutputStream()
+    if table_format == "parquet":
+        pyarrow.parquet.write_table(table, sink)
+    else:
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
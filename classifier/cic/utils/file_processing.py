@@ -5,8 +5,8 @@ import tarfile
 import gzip
 import bz2
 import lzma
+import itertools
 import py7zr
-import shutil
 import logging
 
 logger = logging.getLogger(__name__)
@@ -79,20 +79,62 @@ def read_json(json_file_path, request_source):
         else:
             raise
 
-def process_compressed_file(file_path, temp_dir, predictor_manager):
+def process_compressed_file(archive, filename, predictor_manager):
     """
     Process a compressed file containing JSON files (or folders with JSON files) with citation data.
+    The archive is read in memory, without extracting it to disk, and all its valid files are returned
+    together (see iter_compressed_file to classify them while the archive is read).
 
     Args:
-        file_path (str): Path to the compressed file.
-        temp_dir (str): Temporary directory to extract files.
+        archive (str or file object): Path to the compressed file, or seekable binary file object with its content (e.g. the uploaded file).
+        filename (str): Name of the compressed file, used to detect its type.
         predictor_manager (PredictorManager): Instance of PredictorManager to update the manifest_dict.
 
     Returns:
         tuple: (data_list, manifest_dict)
     """
-    extract_file(file_path, temp_dir)
-    data_list = []
+    return process_json_files(iter_archive_members(archive, filename), predictor_manager)
+
+def iter_compressed_file(archive, filename, predictor_manager):
+    """
+    Same as process_compressed_file, but the files are validated and returned one at a time as they are
+    read (see iter_json_files), to be classified by chunks (PredictorManager.iter_archive) while the
+    following ones are still in the archive.
+    The archive is opened and its member names checked before returning, so that an invalid archive
+    raises here rather than while the files are classified.
+
+    Returns:
+        iterator: The files to classify, as the items of the data_list of process_compressed_file.
+    """
+    members = iter_archive_members(archive, filename)
+    first_member = next(members, None)
+    if first_member is not None:
+        members = itertools.chain([first_member], members)
+    return iter_json_files(members, predictor_manager)
+
+def process_json_files(files, predictor_manager):
+    """
+    Read and validate all the JSON files with citation data, as the files of an archive (see iter_json_files).
+
+    Returns:
+        tuple: (data_list, manifest_dict)
+    """
+    data_list = list(iter_json_files(files, predictor_manager))
+    return data_list, predictor_manager.manifest_dict
+
+def iter_json_files(files, predictor_manager):
+    """
+    Read and validate JSON files with citation data, as the files of an archive, yielding each valid file
+    as soon as it is read: only the files not classified yet are held in memory. The files and IDs that
+    cannot be processed are reported in the manifest_dict, which is complete once all the files are read.
+
+    Args:
+        files (iterable): (rel_path, content) pairs, with the path of each file and its content (bytes).
+        predictor_manager (PredictorManager): Instance of PredictorManager to update the manifest_dict.
+
+    Yields:
+        dict: The 'path', 'filename', 'rel_path' and 'data' of each file to classify.
+    """
     manifest_read_errors = {}
     read_errors = False
 
@@ -103,97 +145,98 @@ def process_compressed_file(file_path, temp_dir, predictor_manager):
     files_with_all_correctly_processed_ids = []
     correctly_processed_map_file_id = {}
 
-    for root, _, files in os.walk(temp_dir):
-        for name in files:
-            file_path = os.path.join(root, name)
-            if name.endswith('.json') and not name.startswith('._'):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as json_file:
-                        json_data = json.load(json_file)
-                        rel_path = os.path.relpath(file_path, temp_dir)
-
-                        simple_format_check = True
-                        id_errors = False
-                        for id in json_data:
-                            if not isinstance(json_data[id], dict):
-                                id_errors = True
-                                general_id_errors = True
-                                if name not in manifest_id_errors:
-                                    manifest_id_errors[name] = {}
-                                manifest_id_errors[name][id] = {
-                                    "Citation ID": id,
-                                    "Error details": f"Invalid entry format for ID {id} in file {name}. Each entry must be a dictionary. This entry will not be processed."
-                                }
-                                continue
-                            keys = json_data[id].keys()
-                            if len(keys) < 2:
-                                id_errors = True
-                                general_id_errors = True
-                                if name not in manifest_id_errors:
-                                    manifest_id_errors[name] = {}
-                                manifest_id_errors[name][id] = {
-                                    "Citation ID": id,
-                                    "Error details": f"Invalid JSON entry, missing keys for ID {id} in file {name}. Must have 'SECTION' and 'CITATION'. This entry will not be processed."
-                                }
-                                continue
-                            if 'SECTION' not in keys or 'CITATION' not in keys:
-                                id_errors = True
-                                general_id_errors = True
-                                if name not in manifest_id_errors:
-                                    manifest_id_errors[name] = {}
-                                manifest_id_errors[name][id] = {
-                                    "Citation ID": id,
-                                    "Error details": f"Invalid JSON entry, missing 'SECTION' or 'CITATION' for ID {id}. This entry will not be processed."
-                                }
-                                continue
-                            if 'CITATION' in keys and json_data[id]['CITATION'] == '':
-                                id_errors = True
-                                if name not in manifest_id_errors:
-                                    manifest_id_errors[name] = {}
-                                manifest_id_errors[name][id] = {
-                                    "Citation ID": id,
-                                    "Error details": f"Invalid JSON entry, 'CITATION' is empty for ID {id}. This entry will not be processed."
-                                }
-                                continue
-
-                            if len(json_data[id]) > 2:
-                                simple_format_check = False
-
-                            if name not in correctly_processed_map_file_id:
-                                correctly_processed_map_file_id[name] = []
-                            correctly_processed_map_file_id[name].append(id)
-
-                        if simple_format_check:
-                            data_list.append({'path': file_path, 'filename': name, 'rel_path': rel_path, 'data': json_data})
-                        else:
-                            clean_data = {}
-                            temporary_data = json_data
-                            for id in json_data:
-                                clean_data[id] = {
-                                    'SECTION': json_data[id]['SECTION'],
-                                    'CITATION': json_data[id]['CITATION']
-                                }
-                            extended_data = (clean_data, temporary_data)
-                            data_list.append({'path': file_path, 'filename': name, 'rel_path': rel_path, 'data': extended_data})
-
-                        if id_errors:
-                            general_id_errors = True
-                        else:
-                            files_with_all_correctly_processed_ids.append(name)
-
-                    correctly_read_files.append(name)
-                except (UnicodeDecodeError, json.JSONDecodeError) as e:
-                    read_errors = True
-                    manifest_read_errors[name] = {
-                        "Filename": name,
-                        "Error details": str(e)
-                    }
-            elif not name.startswith('._') and not allowed_file(name):
+    # Filled once all the files are read, but kept before the classification entries of the manifest
+    predictor_manager.manifest_dict["Data Loading"] = {}
+    predictor_manager.manifest_dict["Single entries processing"] = {}
+
+    for rel_path, content in files:
+        name = os.path.basename(rel_path)
+        if name.endswith('.json') and not name.startswith('._'):
+            try:
+                json_data = json.loads(content.decode('utf-8'))
+
+                simple_format_check = True
+                id_errors = False
+                for id in json_data:
+                    if not isinstance(json_data[id], dict):
+                        id_errors = True
+                        general_id_errors = True
+                        if name not in manifest_id_errors:
+                            manifest_id_errors[name] = {}
+                        manifest_id_errors[name][id] = {
+                            "Citation ID": id,
+                            "Error details": f"Invalid entry format for ID {id} in file {name}. Each entry must be a dictionary. This entry will not be processed."
+                        }
+                        continue
+                    keys = json_data[id].keys()
+                    if len(keys) < 2:
+                        id_errors = True
+                        general_id_errors = True
+                        if name not in manifest_id_errors:
+                            manifest_id_errors[name] = {}
+                        manifest_id_errors[name][id] = {
+                            "Citation ID": id,
+                            "Error details": f"Invalid JSON entry, missing keys for ID {id} in file {name}. Must have 'SECTION' and 'CITATION'. This entry will not be processed."
+                        }
+                        continue
+                    if 'SECTION' not in keys or 'CITATION' not in keys:
+                        id_errors = True
+                        general_id_errors = True
+                        if name not in manifest_id_errors:
+                            manifest_id_errors[name] = {}
+                        manifest_id_errors[name][id] = {
+                            "Citation ID": id,
+                            "Error details": f"Invalid JSON entry, missing 'SECTION' or 'CITATION' for ID {id}. This entry will not be processed."
+                        }
+                        continue
+                    if 'CITATION' in keys and json_data[id]['CITATION'] == '':
+                        id_errors = True
+                        if name not in manifest_id_errors:
+                            manifest_id_errors[name] = {}
+                        manifest_id_errors[name][id] = {
+                            "Citation ID": id,
+                            "Error details": f"Invalid JSON entry, 'CITATION' is empty for ID {id}. This entry will not be processed."
+                        }
+                        continue
+
+                    if len(json_data[id]) > 2:
+                        simple_format_check = False
+
+                    if name not in correctly_processed_map_file_id:
+                        correctly_processed_map_file_id[name] = []
+                    correctly_processed_map_file_id[name].append(id)
+
+                if simple_format_check:
+                    yield {'path': rel_path, 'filename': name, 'rel_path': rel_path, 'data': json_data}
+                else:
+                    clean_data = {}
+                    temporary_data = json_data
+                    for id in json_data:
+                        clean_data[id] = {
+                            'SECTION': json_data[id]['SECTION'],
+                            'CITATION': json_data[id]['CITATION']
+                        }
+                    extended_data = (clean_data, temporary_data)
+                    yield {'path': rel_path, 'filename': name, 'rel_path': rel_path, 'data': extended_data}
+
+                if id_errors:
+                    general_id_errors = True
+                else:
+                    files_with_all_correctly_processed_ids.append(name)
+
+                correctly_read_files.append(name)
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
                 read_errors = True
                 manifest_read_errors[name] = {
                     "Filename": name,
-                    "Error details": f"File {name} cannot be read or is of unsupported type."
+                    "Error details": str(e)
                 }
+        elif not name.startswith('._') and not allowed_file(name):
+            read_errors = True
+            manifest_read_errors[name] = {
+                "Filename": name,
+                "Error details": f"File {name} cannot be read or is of unsupported type."
+            }
 
     # Update the manifest_dict
     if read_errors:
@@ -233,94 +276,82 @@ def process_compressed_file(file_path, temp_dir, predictor_manager):
             }
         }
 
-    return data_list, predictor_manager.manifest_dict
+def is_within_directory(directory, target):
+    """
+    Check if the target path is within the given directory.
+
+    Args:
+        directory (str): The base directory.
+        target (str): The target path to check.
+
+    Returns:
+        bool: True if the target is within the directory, False otherwise.
+    """
+    abs_directory = os.path.abspath(directory)
+    abs_target = os.path.abspath(target)
+
+    return os.path.commonpath([abs_directory]) == os.path.commonpath([abs_directory, abs_target])
 
-def extract_file(file_path, temp_dir):
+def check_member_names(member_names):
     """
-    Securely extract compressed files to a temporary directory.
+    Check that no member of an archive would be extracted outside of the extraction folder,
+    preventing path traversal attacks. The members are not extracted, so they are resolved
+    against a virtual root folder.
 
     Args:
-        file_path (str): Path to the compressed file.
-        temp_dir (str): Temporary directory to extract files.
+        member_names (list): Names of the members of the archive.
 
     Raises:
-        Exception: If an unsupported file type is provided.
+        Exception: If a path traversal attempt is detected.
     """
+    root = os.path.join(os.sep, "archive")
+    for member_name in member_names:
+        if not is_within_directory(root, os.path.join(root, member_name)):
+            raise Exception("Attempted Path Traversal in Archive File")
 
-    def is_within_directory(directory, target):
-        """
-        Check if the target path is within the given directory.
-
-        Args:
-            directory (str): The base directory.
-            target (str): The target path to check.
-
-        Returns:
-            bool: True if the target is within the directory, False otherwise.
-        """
-        abs_directory = os.path.abspath(directory)
-        abs_target = os.path.abspath(target)
-
-        return os.path.commonpath([abs_directory]) == os.path.commonpath([abs_directory, abs_target])
-
-    def safe_extract_archive(archive, path="."):
-        """
-        Safely extract an archive, preventing path traversal attacks.
-
-        Args:
-            archive: Archive object (ZipFile or TarFile).
-            path (str): Destination path for extraction.
-
-        Raises:
-            Exception: If a path traversal attempt is detected.
-        """
-        # Determine the list of members based on the type of archive
-        if isinstance(archive, zipfile.ZipFile):
-            members = archive.namelist()
-            is_tar = False
-        elif isinstance(archive, tarfile.TarFile):
-            members = archive.getmembers()
-            is_tar = True
-        else:
-            raise Exception("Unsupported archive type")
+def iter_archive_members(archive, filename):
+    """
+    Read the files of a compressed file one at a time, without extracting them to disk.
 
-        for member in members:
-            # For TarFile, member is a TarInfo object; for ZipFile, it's a string
-            if is_tar:
-                member_name = member.name
-            else:
-                member_name = member
-
-            member_path = os.path.join(path, member_name)
-            if not is_within_directory(path, member_path):
-                raise Exception("Attempted Path Traversal in Archive File")
-
-        # Extract all members
-        archive.extractall(path)
-
-    if file_path.endswith('.zip'):
-        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            safe_extract_archive(zip_ref, temp_dir)
-    elif file_path.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
-        with tarfile.open(file_path, mode='r:*') as tar_ref:
-            safe_extract_archive(tar_ref, temp_dir)
-    elif file_path.endswith('.gz') and not file_path.endswith('.tar.gz'):
-        with gzip.open(file_path, 'rb') as gz_ref:
-            output_file = os.path.join(temp_dir, os.path.basename(file_path)[:-3])
-            with open(output_file, 'wb') as out_f:
-                shutil.copyfileobj(gz_ref, out_f)
-    elif file_path.endswith('.bz2') and not file_path.endswith('.tar.bz2'):
-        with bz2.open(file_path, 'rb') as bz2_ref:
-            output_file = os.path.join(temp_dir, os.path.basename(file_path)[:-4])
-            with open(output_file, 'wb') as out_f:
-                shutil.copyfileobj(bz2_ref, out_f)
-    elif file_path.endswith('.xz') and not file_path.endswith('.tar.xz'):
-        with lzma.open(file_path, 'rb') as xz_ref:
-            output_file = os.path.join(temp_dir, os.path.basename(file_path)[:-3])
-            with open(output_file, 'wb') as out_f:
-                shutil.copyfileobj(xz_ref, out_f)
-    elif file_path.endswith('.7z'):
-        with py7zr.SevenZipFile(file_path, mode='r') as z:
-            z.extractall(temp_dir)
+    Args:
+        archive (str or file object): Path to the compressed file, or seekable binary file object with its content.
+        filename (str): Name of the compressed file, used to detect its type.
+
+    Yields:
+        tuple: (rel_path, content) with the path of each file in the archive and its content (bytes).
+
+    Raises:
+        Exception: If an unsupported file type is provided or a path traversal attempt is detected.
+    """
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(archive, 'r') as zip_ref:
+            check_member_names(zip_ref.namelist())
+            for info in zip_ref.infolist():
+                if not info.is_dir():
+                    yield os.path.normpath(info.filename), zip_ref.read(info)
+    elif filename.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+        if isinstance(archive, str):
+            tar_ref = tarfile.open(archive, mode='r:*')
+        else:
+            tar_ref = tarfile.open(fileobj=archive, mode='r:*')
+        with tar_ref:
+            members = tar_ref.getmembers()
+            check_member_names([member.name for member in members])
+            for member in members:
+                # Links and special files are skipped: only the content of regular files is read
+                if member.isfile():
+                    with tar_ref.extractfile(member) as member_file:
+                        yield os.path.normpath(member.name), member_file.read()
+    elif filename.endswith(('.gz', '.bz2', '.xz')):
+        # Single compressed file, named as the archive without its extension
+        opener = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+        extension = os.path.splitext(filename)[1]
+        with opener[extension](archive, 'rb') as compressed_file:
+            yield os.path.basename(filename)[:-len(extension)], compressed_file.read()
+    elif filename.endswith('.7z'):
+        with py7zr.SevenZipFile(archive, mode='r') as z:
+            check_member_names(z.getnames())
+            for name, member_file in z.readall().items():
+                yield os.path.normpath(name), member_file.read()
     else:
         raise Exception("Unsupported compressed file type.")
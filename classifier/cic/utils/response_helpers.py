@@ -1,12 +1,25 @@
-from flask import jsonify, send_file, make_response
+from flask import Response, jsonify, stream_with_context
 import json
 import os
 import zipfile
 import io
+import time
 import logging
+from .. import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+SERIALIZATION_SECONDS = metrics.registry.histogram(
+    "cic_serialization_duration_seconds",
+    "Time spent serializing a response (for ZIP files, serializing and compressing their entries).",
+    ["format"]
+)
+
 def create_error_response(manifest_dict, status_code):
     response = jsonify(manifest_dict)
     response.status_code = status_code
@@ -19,65 +32,117 @@ def create_success_response(result, manifest_dict, filename):
     if manifest_dict is not None:
         response_data["manifest"] = manifest_dict
 
-    return jsonify(response_data), 200
+    start = time.perf_counter()
+    response = jsonify(response_data)
+    SERIALIZATION_SECONDS.observe(time.perf_counter() - start, format="json")
+    return response, 200
+
+def dumps_json(obj, compact=False):
+    """
+    Serialize a result or manifest for the ZIP files: indented with 4 spaces, or compact.
+    Compact JSON is serialized with orjson when it is installed.
+
+    Returns:
+        bytes: The UTF-8 encoded JSON.
+    """
+    if not compact:
+        return json.dumps(obj, indent=4).encode('utf-8')
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def result_entry_name(item):
+    """
+    Path in the ZIP file of the result of a file: its path in the archive, with '_result.json' in place of '.json'.
+    """
+    original_rel_path = item.get('rel_path', item['filename'])
+    # Get the directory part and filename
+    dir_name, original_filename = os.path.split(original_rel_path)
+    # Remove the .json extension from the original filename
+    base_name, ext = os.path.splitext(original_filename)
+    # Avoid adding '.json' twice
+    if ext == '.json':
+        new_filename = f"{base_name}_result.json"
+    else:
+        new_filename = f"{original_filename}_result.json"
+    # Construct the new relative path
+    return os.path.join(dir_name, new_filename)
+
+class ZipStreamBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable sink of a ZipFile: the written bytes are kept until taken.
+    As the sink cannot seek back, the ZipFile writes the sizes of each entry after its data.
+    """
+
+    def __init__(self):
+        self._chunks = []
 
-def create_zip_response(results_list, manifest_dict):
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(results, manifest=None, compact=False):
+    """
+    Generate a ZIP file with the results and the manifest, preserving the original directory structure,
+    one entry at a time: each result is compressed and sent as soon as it is produced, and the manifest
+    is added last, once all the files have been processed.
+
+    Args:
+        results (iterable): Dictionaries with 'filename', 'rel_path', and 'result' keys (e.g. PredictorManager.iter_archive).
+        manifest (callable or dict or None): The manifest dictionary, or a function returning it once the results are consumed.
+        compact (bool): Write compact JSON instead of indented JSON.
+
+    Yields:
+        bytes: The successive parts of the ZIP file.
+    """
+    sink = ZipStreamBuffer()
+    # Time spent writing the entries, excluding the classification of the results
+    serialization_time = 0.0
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for item in results:
+            start = time.perf_counter()
+            zipf.writestr(result_entry_name(item), dumps_json(item['result'], compact))
+            serialization_time += time.perf_counter() - start
+            yield sink.take()
+
+        manifest_dict = manifest() if callable(manifest) else manifest
+        start = time.perf_counter()
+        # Add the manifest file at the root of the ZIP archive if provided
+        if manifest_dict is not None:
+            zipf.writestr('manifest.json', dumps_json(manifest_dict, compact))
+    serialization_time += time.perf_counter() - start
+    SERIALIZATION_SECONDS.observe(serialization_time, format="zip")
+    yield sink.take()
+
+def create_zip_response(results_list, manifest_dict, compact=False):
     """
     Create a ZIP file containing the results and manifest, preserving the original directory structure.
+    The ZIP file is streamed: when results_list is a generator (e.g. PredictorManager.iter_archive), the
+    results of the first files are sent while the following ones are still being classified.
 
     Args:
-        results_list (list): List of dictionaries with 'filename', 'rel_path', and 'result' keys.
-        manifest_dict (dict): The manifest dictionary to include in the ZIP.
+        results_list (iterable): Dictionaries with 'filename', 'rel_path', and 'result' keys.
+        manifest_dict (callable or dict or None): The manifest dictionary to include in the ZIP, or a function returning it.
+        compact (bool): Write compact JSON instead of indented JSON.
 
     Returns:
-        Flask response: The response containing the ZIP file.
+        Flask response: The response streaming the ZIP file.
     """
+    parts = stream_zip(results_list, manifest_dict, compact)
     try:
-        # Create an in-memory ZIP file using BytesIO
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add the manifest file at the root of the ZIP archive if provided
-            if manifest_dict is not None:
-                manifest_json = json.dumps(manifest_dict, indent=4)
-                zipf.writestr('manifest.json', manifest_json)
-
-            # Add each result file, preserving directory structure
-            for item in results_list:
-                original_rel_path = item.get('rel_path', item['filename'])
-                # Get the directory part and filename
-                dir_name, original_filename = os.path.split(original_rel_path)
-                # Remove the .json extension from the original filename
-                base_name, ext = os.path.splitext(original_filename)
-                # Avoid adding '.json' twice
-                if ext == '.json':
-                    new_filename = f"{base_name}_result.json"
-                else:
-                    new_filename = f"{original_filename}_result.json"
-                # Construct the new relative path
-                new_rel_path = os.path.join(dir_name, new_filename)
-                # Convert the result to JSON string
-                result_json = json.dumps(item['result'], indent=4)
-                # Write the result to the ZIP archive
-                zipf.writestr(new_rel_path, result_json)
-
-        # Seek to the beginning of the BytesIO buffer (cause after writing the pointer is at the end)
-        memory_file.seek(0)
-
-        # Create the flask response
-        response = make_response(send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name='results.zip'
-        ))
-
-        # Set headers
-        response.headers['Content-Type'] = 'application/zip'
-        response.headers['Content-Disposition'] = 'attachment; filename=results.zip'
-
-        return response
+        # Produce the first entry before answering, so that early failures still get an error response
+        first_part = next(parts)
     except Exception as e:
         logger.error(f"Error creating ZIP response: {e}")
+        manifest_dict = manifest_dict() if callable(manifest_dict) else manifest_dict
         # Update the manifest with the error if manifest_dict is provided
         if manifest_dict is not None:
             manifest_dict["Response Creation"] = {
@@ -92,3 +157,16 @@ def create_zip_response(results_list, manifest_dict):
                 "Error details": f"Failed to create ZIP response: {e}"
             }
             return create_error_response(error_response, 500)
+
+    def generate():
+        yield first_part
+        try:
+            yield from parts
+        except Exception as e:
+            # The response has started: the client gets a truncated ZIP file
+            logger.error(f"Error while streaming the ZIP response: {e}")
+            raise
+
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=results.zip'
+    return response
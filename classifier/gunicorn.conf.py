@@ -0,0 +1,28 @@
+# Gunicorn settings of the classifier, read from the working directory (see the Dockerfile).
+# The command line options (workers, bind, timeout, ...) are added to these ones.
+import os
+
+# The application is imported once in the master, before the workers are forked
+preload_app = True
+
+# Sync workers serve one request at a time: request coalescing (COALESCE_WAIT_MS) needs threaded workers,
+# e.g. GUNICORN_THREADS=16 (gunicorn switches the sync workers to gthread when threads > 1)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+
+def when_ready(server):
+    # Master, before forking: the PRELOAD_MODES models loaded here are shared copy-on-write by all the workers,
+    # including those started later (scale-out, restarted workers)
+    from cic.predictor_manager import preload_models
+    try:
+        preload_models(server.app.wsgi(), before_fork=True)
+    except Exception:
+        server.log.exception("Failed to preload the models in the master: the workers will load them")
+
+def post_worker_init(worker):
+    # Worker, before serving: loads the PRELOAD_MODES models not inherited from the master (e.g. ONNX backend)
+    from cic.predictor_manager import preload_models
+    try:
+        preload_models(worker.wsgi)
+    except Exception:
+        worker.log.exception("Failed to preload the models: they are loaded by the first requests")
@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cic.main import create_app
+from cic.predictor_manager import load_predictor
+from quantization_parity import load_test_inputs, classify_all
+
+PROBABILITY_KEYS = [
+    "SCIBERT MET POSITIVE PROBABILITY", "SCIBERT BKG POSITIVE PROBABILITY", "SCIBERT RES POSITIVE PROBABILITY",
+    "XLNET MET POSITIVE PROBABILITY", "XLNET BKG POSITIVE PROBABILITY", "XLNET RES POSITIVE PROBABILITY",
+    "MET ENSEMBLE CONFIDENCE", "BKG ENSEMBLE CONFIDENCE", "RES ENSEMBLE CONFIDENCE"
+]
+
+def compare(eager_results, optimized_results):
+    citations = 0
+    agreements = 0
+    max_diff = 0.0
+    disagreements = []
+    for name in eager_results:
+        for id, eager_entry in eager_results[name].items():
+            optimized_entry = optimized_results[name][id]
+            citations += 1
+            if eager_entry["FINAL PREDICTION"] == optimized_entry["FINAL PREDICTION"]:
+                agreements += 1
+            else:
+                disagreements.append({"File": name, "ID": id, "eager": eager_entry["FINAL PREDICTION"], "optimized": optimized_entry["FINAL PREDICTION"]})
+            for key in PROBABILITY_KEYS:
+                max_diff = max(max_diff, abs(eager_entry[key] - optimized_entry[key]))
+    return {
+        "Citations": citations,
+        "FINAL PREDICTION agreement": agreements / citations if citations else 1.0,
+        "Max probability difference": max_diff,
+        "Disagreements": disagreements
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the predictions of the TorchScript / torch.compile graphs with the eager models on the test payloads.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--mode', default='M', choices=['WS', 'WoS', 'M'], help='Classification mode.')
+    parser.add_argument('--optimizations', nargs='+', default=['torchscript'], choices=['torchscript', 'compile'], help='Graph optimizations to compare with the eager models.')
+    parser.add_argument('--graph_cache_dir', default=None, help='Optional folder for the cached graphs: the optimized models are then loaded a second time, from it.')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Maximum probability difference accepted.')
+    parser.add_argument('--output', default=None, help='Optional path of a JSON report.')
+    args = parser.parse_args()
+
+    inputs = load_test_inputs()
+    app = create_app(args.src_path)
+    app.config['RESULT_CACHE_SIZE'] = 0
+    app.config['GRAPH_CACHE_DIR'] = args.graph_cache_dir
+
+    report = {"Mode": args.mode, "Files": len(inputs)}
+    results = {}
+    with app.app_context():
+        for optimization in ['eager'] + args.optimizations:
+            app.config['GRAPH_OPTIMIZATION'] = None if optimization == 'eager' else optimization
+            start = time.perf_counter()
+            predictor = load_predictor(args.mode, args.src_path)
+            predictor.load_branches()
+            load_time = time.perf_counter() - start
+            report[optimization] = {"Load time (s)": round(load_time, 3)}
+            if optimization != 'eager' and args.graph_cache_dir:
+                # A second load, from the graphs cached by the first one
+                predictor.release_ensembles()
+                start = time.perf_counter()
+                predictor = load_predictor(args.mode, args.src_path)
+                predictor.load_branches()
+                report[optimization]["Cached load time (s)"] = round(time.perf_counter() - start, 3)
+            # A first pass warms up the models, the second one is timed
+            classify_all(predictor, inputs)
+            predictor = predictor.shallow_copy()
+            results[optimization], classification_time = classify_all(predictor, inputs)
+            report[optimization]["Classification time (s)"] = round(classification_time, 3)
+
+    failed = False
+    for optimization in args.optimizations:
+        comparison = compare(results['eager'], results[optimization])
+        if report[optimization]["Classification time (s)"]:
+            comparison["Speedup"] = report['eager']["Classification time (s)"] / report[optimization]["Classification time (s)"]
+        report[optimization].update(comparison)
+        failed = failed or comparison["Max probability difference"] > args.atol or bool(comparison["Disagreements"])
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import io
+import json
+import time
+import zipfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cic.main import create_app
+from cic.predictor_manager import load_predictor
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_test_inputs():
+    """
+    Collect the test payloads: the JSON body example, the JSON file example and the JSON files in the test archive.
+
+    Returns:
+        list: (name, data, from_json) tuples.
+    """
+    inputs = []
+    with open(os.path.join(TEST_DIR, 'test_payload.json'), 'r', encoding='utf-8') as f:
+        inputs.append(('test_payload.json', json.load(f)['data'], False))
+    with open(os.path.join(TEST_DIR, 'test_file.json'), 'r', encoding='utf-8') as f:
+        inputs.append(('test_file.json', json.load(f), True))
+    with zipfile.ZipFile(os.path.join(TEST_DIR, 'input_dir', 'json_to_cls.zip')) as zip_ref:
+        for name in zip_ref.namelist():
+            if name.endswith('.json') and not os.path.basename(name).startswith('._'):
+                data = json.load(io.TextIOWrapper(zip_ref.open(name), encoding='utf-8'))
+                clean_data = {id: {'SECTION': data[id]['SECTION'], 'CITATION': data[id]['CITATION']} for id in data
+                              if isinstance(data[id], dict) and 'SECTION' in data[id] and 'CITATION' in data[id]}
+                inputs.append((name, clean_data, True))
+    return inputs
+
+def classify_all(predictor, inputs):
+    results = {}
+    start = time.perf_counter()
+    for name, data, from_json in inputs:
+        predictor.set_data(data, None, from_json=from_json)
+        results[name] = predictor.final_classification()
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare int8 quantized and fp32 predictions on the test payloads.')
+    parser.add_argument('--src_path', required=True, help='Path to src folder (containing the models folder).')
+    parser.add_argument('--mode', default='M', choices=['WS', 'WoS', 'M'], help='Classification mode.')
+    parser.add_argument('--quantized_cache_dir', default=None, help='Optional folder for the cached quantized weights.')
+    parser.add_argument('--output', default=None, help='Optional path of a JSON report.')
+    args = parser.parse_args()
+
+    inputs = load_test_inputs()
+    app = create_app(args.src_path)
+    app.config['RESULT_CACHE_SIZE'] = 0
+
+    report = {"Mode": args.mode, "Files": len(inputs)}
+    results = {}
+    with app.app_context():
+        for backend in ['fp32', 'int8']:
+            app.config['QUANTIZATION'] = 'int8' if backend == 'int8' else None
+            app.config['QUANTIZED_CACHE_DIR'] = args.quantized_cache_dir
+            start = time.perf_counter()
+            predictor = load_predictor(args.mode, args.src_path)
+            predictor.load_branches()
+            load_time = time.perf_counter() - start
+            # A first pass warms up the models, the second one is timed
+            classify_all(predictor, inputs)
+            predictor = predictor.shallow_copy()
+            results[backend], classification_time = classify_all(predictor, inputs)
+            report[backend] = {"Load time (s)": round(load_time, 3), "Classification time (s)": round(classification_time, 3)}
+
+    citations = 0
+    agreements = 0
+    max_confidence_diff = 0.0
+    total_confidence_diff = 0.0
+    disagreements = []
+    for name in results['fp32']:
+        for id, fp32_entry in results['fp32'][name].items():
+            int8_entry = results['int8'][name][id]
+            citations += 1
+            if fp32_entry["FINAL PREDICTION"] == int8_entry["FINAL PREDICTION"]:
+                agreements += 1
+            else:
+                disagreements.append({"File": name, "ID": id, "fp32": fp32_entry["FINAL PREDICTION"], "int8": int8_entry["FINAL PREDICTION"]})
+            for key in ["MET ENSEMBLE CONFIDENCE", "BKG ENSEMBLE CONFIDENCE", "RES ENSEMBLE CONFIDENCE"]:
+                diff = abs(fp32_entry[key] - int8_entry[key])
+                max_confidence_diff = max(max_confidence_diff, diff)
+                total_confidence_diff += diff
+
+    report["Citations"] = citations
+    report["FINAL PREDICTION agreement"] = agreements / citations if citations else 1.0
+    report["Max ensemble confidence difference"] = max_confidence_diff
+    report["Mean ensemble confidence difference"] = total_confidence_diff / (3 * citations) if citations else 0.0
+    report["Speedup"] = report['fp32']["Classification time (s)"] / report['int8']["Classification time (s)"] if report['int8']["Classification time (s)"] else None
+    report["Disagreements"] = disagreements
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == '__main__':
+    main()